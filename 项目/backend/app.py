@@ -1,14 +1,70 @@
 ﻿from __future__ import annotations
 
-import base64
+import functools
+import hashlib
+import hmac
+import ipaddress
+import json
+import math
 import os
+import threading
+import time
 import uuid
 import logging
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
 
-from flask import Flask, jsonify, request
+import requests
+
+from flask import Flask, Response, g, jsonify, request, send_file
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 
+from utils.metrics import (
+    FAIR_QUEUE_SECONDS,
+    IDEMPOTENT_DUPLICATES,
+    RATE_LIMITED,
+    READY,
+    REFINE_SAVINGS,
+    REGISTRY,
+    REQUEST_SECONDS,
+    ROUTED_REQUESTS,
+    STARTUP_SECONDS,
+    begin_request,
+    current_endpoint,
+    current_timings,
+    end_request,
+    record_fallback,
+    render_metrics,
+    stage_timer,
+)
+from utils.community_store import SHARE_ID_LENGTH, CommunityStore, SnapshotCache
+from utils.compression import (
+    COMPRESSIBLE_MIMETYPES,
+    PrecompressedBody,
+    compress_observed,
+    encoded_etag,
+    etag_variants,
+    negotiate,
+    record_response_bytes,
+)
+from utils.guide_cache import SharedGuideCache
+from utils.guide_model import GUIDE_FIELDS, Guide, Step
+from utils.guide_sessions import GuideSessionStore
+from utils.health_probe import UpstreamProber
+from utils.idempotency import IdempotencyStore, SharedIdempotencyStore
+from utils.image_prep import IMAGE_MIME_TYPES, ImagePrepPool, InvalidImage, image_data_url
+from utils.pipeline import GuideContext, Pipeline
+from utils.profiler import ProfileStore, SamplingProfiler, render_collapsed
+from utils.rate_limit import FairScheduler, SharedTokenBucketLimiter, TokenBucketLimiter
+from utils.routing import PeerRouter
+from utils.step_renderer import RENDER_FORMATS, StepRenderer, is_render_id
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
 try:
     from utils.ai_service import create_ai_service
 except Exception as exc:  # pragma: no cover - import guard for broken env
@@ -17,8 +73,27 @@ except Exception as exc:  # pragma: no cover - import guard for broken env
 else:
     AI_IMPORT_ERROR = None
 
+
+class _TimedJSONProvider(DefaultJSONProvider):
+    """Times response serialization; encodes compact bodies with orjson when available."""
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        with stage_timer("serialize"):
+            pretty = (self.compact is None and self._app.debug) or self.compact is False
+            if orjson is None or not RESPONSE_FAST_JSON or pretty:
+                return super().response(*args, **kwargs)
+            obj = self._prepare_response_obj(args, kwargs)
+            body = orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+            return self._app.response_class(body, mimetype=self.mimetype)
+
+
 app = Flask(__name__)
-CORS(app)
+app.json = _TimedJSONProvider(app)
+# Let browser clients read throttling hints on cross-origin responses.
+CORS(
+    app,
+    expose_headers=["Retry-After", "X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset", "X-GuideBot-Node"],
+)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
@@ -36,6 +111,20 @@ logging.basicConfig(
 logger = logging.getLogger("guidebot")
 
 _ai_service = None
+_ai_service_lock = threading.Lock()
+
+_startup_started = time.perf_counter()
+_readiness: Dict[str, Any] = {
+    "ready": False,
+    "phase": "starting",
+    "cold_start_ms": None,
+    "service_init_ms": None,
+    "prompts_ms": None,
+    "prewarm_ms": None,
+    "prewarmed_connections": 0,
+    "image_pool_ms": None,
+    "error": None,
+}
 
 
 def _parse_bool(value: Optional[str], default: bool = True) -> bool:
@@ -44,8 +133,214 @@ def _parse_bool(value: Optional[str], default: bool = True) -> bool:
     return value.strip().lower() in {"1", "true", "yes", "on"}
 
 
+def _parse_float(value: Optional[str], default: float) -> float:
+    if value is None:
+        return default
+    try:
+        parsed = float(value.strip())
+        return parsed if parsed >= 0 else default
+    except Exception:
+        return default
+
+
 ALLOW_MOCK_ON_AI_ERROR = _parse_bool(os.getenv("AI_ALLOW_MOCK_FALLBACK"), True)
 
+PROFILER_ENABLED = _parse_bool(os.getenv("PROFILER_ENABLED"), False)
+PROFILER_SLOW_SECONDS = _parse_float(os.getenv("PROFILER_SLOW_MS"), 5000) / 1000
+PROFILER_SAMPLE_INTERVAL_SECONDS = _parse_float(os.getenv("PROFILER_SAMPLE_INTERVAL_MS"), 10) / 1000
+PROFILER_MAX_PROFILES = int(_parse_float(os.getenv("PROFILER_MAX_PROFILES"), 50))
+PROFILE_FOLDER = os.getenv("PROFILER_DIR") or os.path.join(BASE_DIR, "profiles")
+PROFILE_HEADER = "X-GuideBot-Profile"
+# Saved profiles hold stack traces and file paths. With a token set, /api/debug/profiles
+# needs it in PROFILER_TOKEN_HEADER; without one it answers loopback callers only.
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN") or ""
+PROFILER_TOKEN_HEADER = "X-GuideBot-Debug-Token"
+
+_profiler = SamplingProfiler(PROFILER_SAMPLE_INTERVAL_SECONDS) if PROFILER_ENABLED else None
+_profile_store = ProfileStore(PROFILE_FOLDER, PROFILER_MAX_PROFILES) if PROFILER_ENABLED else None
+
+# Each worker writes its metrics under METRICS_DIR and /api/metrics merges them, so a
+# scrape reports the whole host instead of whichever worker answered it.
+METRICS_SHARED = _parse_bool(os.getenv("METRICS_SHARED"), True)
+METRICS_DIR = os.getenv("METRICS_DIR") or os.path.join(BASE_DIR, "data", "metrics")
+METRICS_FLUSH_SECONDS = _parse_float(os.getenv("METRICS_FLUSH_SECONDS"), 5)
+if METRICS_SHARED:
+    try:
+        REGISTRY.share(METRICS_DIR, METRICS_FLUSH_SECONDS)
+    except (OSError, RuntimeError) as exc:
+        logger.warning("Shared metrics unavailable, /api/metrics reports this process only: %s", exc)
+
+# echo: return the uploaded screenshot as a data URL; hash: return only its
+# sha256 (the client already has the image); none: omit it entirely.
+IMAGE_REFERENCE_MODES = ("echo", "hash", "none")
+RESPONSE_IMAGE_MODE = (os.getenv("RESPONSE_IMAGE_MODE") or "hash").strip().lower()
+if RESPONSE_IMAGE_MODE not in IMAGE_REFERENCE_MODES:
+    RESPONSE_IMAGE_MODE = "hash"
+RESPONSE_FAST_JSON = _parse_bool(os.getenv("RESPONSE_FAST_JSON"), True)
+# Always kept in sparse fieldsets so clients can branch on the outcome.
+ALWAYS_INCLUDED_FIELDS = frozenset({"success", "error"})
+
+COMPRESSION_ENABLED = _parse_bool(os.getenv("COMPRESSION_ENABLED"), True)
+COMPRESSION_MIN_BYTES = int(_parse_float(os.getenv("COMPRESSION_MIN_BYTES"), 1024))
+COMPRESSION_GZIP_LEVEL = min(int(_parse_float(os.getenv("COMPRESSION_GZIP_LEVEL"), 6)), 9)
+COMPRESSION_BROTLI_QUALITY = min(int(_parse_float(os.getenv("COMPRESSION_BROTLI_QUALITY"), 5)), 11)
+
+AI_PROBE_INTERVAL_SECONDS = _parse_float(os.getenv("AI_PROBE_INTERVAL_SECONDS"), 15)
+AI_PROBE_WINDOW = int(_parse_float(os.getenv("AI_PROBE_WINDOW"), 40))
+
+_prober: Optional[UpstreamProber] = None
+_prober_lock = threading.Lock()
+
+IDEMPOTENCY_ENABLED = _parse_bool(os.getenv("IDEMPOTENCY_ENABLED"), True)
+IDEMPOTENCY_TTL_SECONDS = _parse_float(os.getenv("IDEMPOTENCY_TTL_SECONDS"), 600)
+IDEMPOTENCY_MAX_ENTRIES = int(_parse_float(os.getenv("IDEMPOTENCY_MAX_ENTRIES"), 1000))
+# How long a duplicate waits for the original request; covers a full generation with retries.
+IDEMPOTENCY_WAIT_SECONDS = _parse_float(os.getenv("IDEMPOTENCY_WAIT_SECONDS"), 300)
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+# Entries on disk shared by every worker on the host; a retry on a new connection
+# usually lands on another worker and would otherwise repeat the upstream call.
+IDEMPOTENCY_SHARED = _parse_bool(os.getenv("IDEMPOTENCY_SHARED"), True)
+IDEMPOTENCY_DIR = os.getenv("IDEMPOTENCY_DIR") or os.path.join(BASE_DIR, "data", "idempotency")
+
+
+def _build_idempotency_store() -> IdempotencyStore:
+    if IDEMPOTENCY_SHARED:
+        try:
+            return SharedIdempotencyStore(IDEMPOTENCY_DIR, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_ENTRIES)
+        except (OSError, RuntimeError) as exc:
+            logger.warning("Shared idempotency store unavailable, keeping entries per process: %s", exc)
+    return IdempotencyStore(IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_ENTRIES)
+
+
+_idempotency = _build_idempotency_store()
+
+# Decode/validate/hash (and optional downscale) of uploads runs in worker processes;
+# 0 workers runs it on the request thread.
+IMAGE_POOL_WORKERS = int(_parse_float(os.getenv("IMAGE_POOL_WORKERS"), os.cpu_count() or 1))
+IMAGE_POOL_TIMEOUT_SECONDS = _parse_float(os.getenv("IMAGE_POOL_TIMEOUT_SECONDS"), 30)
+# Longest side after downscaling (needs Pillow; 0 keeps the original size).
+IMAGE_MAX_DIMENSION = int(_parse_float(os.getenv("IMAGE_MAX_DIMENSION"), 0))
+IMAGE_MAX_PIXELS = int(_parse_float(os.getenv("IMAGE_MAX_PIXELS"), 50_000_000))
+# Upper bound on the original size a client may report after downscaling in the browser.
+ORIGINAL_MAX_DIMENSION = 20000
+_image_pool = ImagePrepPool(IMAGE_POOL_WORKERS, IMAGE_POOL_TIMEOUT_SECONDS, IMAGE_MAX_DIMENSION, IMAGE_MAX_PIXELS)
+
+RATE_LIMIT_ENABLED = _parse_bool(os.getenv("RATE_LIMIT_ENABLED"), True)
+# Clients are told apart by this header when present (hashed, never stored raw), else by IP.
+RATE_LIMIT_CLIENT_HEADER = os.getenv("RATE_LIMIT_CLIENT_HEADER") or "X-API-Key"
+# Only behind a proxy that overwrites X-Forwarded-For; otherwise clients could pick their own identity.
+RATE_LIMIT_TRUST_FORWARDED = _parse_bool(os.getenv("RATE_LIMIT_TRUST_FORWARDED"), False)
+RATE_LIMIT_MAX_CLIENTS = int(_parse_float(os.getenv("RATE_LIMIT_MAX_CLIENTS"), 10000))
+# Buckets in files shared by every worker on the host; per-process buckets would let
+# each of SERVER_WORKERS workers grant the full rate.
+RATE_LIMIT_SHARED = _parse_bool(os.getenv("RATE_LIMIT_SHARED"), True)
+RATE_LIMIT_DIR = os.getenv("RATE_LIMIT_DIR") or os.path.join(BASE_DIR, "data", "rate_limits")
+# (burst, refills per minute) per endpoint, overridable as RATE_LIMIT_<NAME>_BURST / _PER_MINUTE.
+RATE_LIMIT_DEFAULTS = {
+    "image": (5, 12),
+    "refine": (10, 30),
+    "url": (5, 12),
+    "text": (10, 30),
+    "share": (10, 20),
+}
+
+
+def _build_rate_limiter(name: str) -> Optional[TokenBucketLimiter]:
+    burst, per_minute = RATE_LIMIT_DEFAULTS[name]
+    burst = _parse_float(os.getenv(f"RATE_LIMIT_{name.upper()}_BURST"), burst)
+    per_minute = _parse_float(os.getenv(f"RATE_LIMIT_{name.upper()}_PER_MINUTE"), per_minute)
+    if not RATE_LIMIT_ENABLED or burst <= 0 or per_minute <= 0:
+        return None
+    if RATE_LIMIT_SHARED:
+        try:
+            return SharedTokenBucketLimiter(
+                os.path.join(RATE_LIMIT_DIR, f"{name}.bin"), burst, per_minute / 60.0, RATE_LIMIT_MAX_CLIENTS
+            )
+        except (OSError, RuntimeError) as exc:
+            logger.warning("Shared rate limit buckets unavailable, limiting per process: %s", exc)
+    return TokenBucketLimiter(burst, per_minute / 60.0, RATE_LIMIT_MAX_CLIENTS)
+
+
+_rate_limiters = {name: _build_rate_limiter(name) for name in RATE_LIMIT_DEFAULTS}
+
+# Upstream-bound requests run through a per-process fair scheduler with this many
+# slots; keep it below SERVER_THREADS so cheap endpoints always find a free thread.
+FAIR_SCHEDULER_ENABLED = _parse_bool(os.getenv("FAIR_SCHEDULER_ENABLED"), True)
+FAIR_UPSTREAM_SLOTS = int(_parse_float(os.getenv("FAIR_UPSTREAM_SLOTS"), 16))
+FAIR_MAX_QUEUED_PER_CLIENT = int(_parse_float(os.getenv("FAIR_MAX_QUEUED_PER_CLIENT"), 4))
+FAIR_QUEUE_TIMEOUT_SECONDS = _parse_float(os.getenv("FAIR_QUEUE_TIMEOUT_SECONDS"), 30)
+_scheduler = FairScheduler(FAIR_UPSTREAM_SLOTS, FAIR_MAX_QUEUED_PER_CLIENT) if FAIR_SCHEDULER_ENABLED else None
+
+GUIDE_SESSION_ENABLED = _parse_bool(os.getenv("GUIDE_SESSION_ENABLED"), True)
+GUIDE_SESSION_TTL_SECONDS = _parse_float(os.getenv("GUIDE_SESSION_TTL_SECONDS"), 900)
+GUIDE_SESSION_MAX = int(_parse_float(os.getenv("GUIDE_SESSION_MAX"), 500))
+GUIDE_SESSION_FOLDER = os.getenv("GUIDE_SESSION_DIR") or os.path.join(BASE_DIR, "sessions")
+
+_guide_sessions = (
+    GuideSessionStore(GUIDE_SESSION_FOLDER, GUIDE_SESSION_TTL_SECONDS, GUIDE_SESSION_MAX)
+    if GUIDE_SESSION_ENABLED
+    else None
+)
+
+COMMUNITY_DB_PATH = os.getenv("COMMUNITY_DB_PATH") or os.path.join(BASE_DIR, "data", "community.db")
+COMMUNITY_PAGE_SIZE_MAX = 100
+
+_community_store: Optional[CommunityStore] = None
+_community_store_lock = threading.Lock()
+
+# Shared guides never change, so their snapshots may be cached anywhere forever.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+SNAPSHOT_CACHE_SIZE = int(_parse_float(os.getenv("SNAPSHOT_CACHE_SIZE"), 1024))
+_snapshot_cache = SnapshotCache(SNAPSHOT_CACHE_SIZE)
+
+
+GUIDE_CACHE_ENABLED = _parse_bool(os.getenv("GUIDE_CACHE_ENABLED"), True)
+GUIDE_CACHE_PATH = os.getenv("GUIDE_CACHE_PATH") or os.path.join(BASE_DIR, "data", "guide_cache.bin")
+GUIDE_CACHE_MAX_MB = _parse_float(os.getenv("GUIDE_CACHE_MAX_MB"), 64)
+GUIDE_CACHE_TTL_SECONDS = _parse_float(os.getenv("GUIDE_CACHE_TTL_SECONDS"), 86400)
+
+_guide_cache: Optional[SharedGuideCache] = None
+_guide_cache_lock = threading.Lock()
+_guide_cache_failed = False
+
+# Annotated step images drawn server-side from session screenshots (needs Pillow).
+RENDER_ENABLED = _parse_bool(os.getenv("RENDER_ENABLED"), True)
+RENDER_DIR = os.getenv("RENDER_DIR") or os.path.join(BASE_DIR, "data", "renders")
+RENDER_MAX_MB = _parse_float(os.getenv("RENDER_MAX_MB"), 256)
+RENDER_FONT_PATH = os.getenv("RENDER_FONT_PATH") or None
+RENDER_FORMAT = (os.getenv("RENDER_FORMAT") or "png").strip().lower()
+
+_renderer: Optional[StepRenderer] = None
+_renderer_lock = threading.Lock()
+_renderer_failed = False
+
+# Consistent-hash routing between nodes: the same screenshot/URL/text always lands on
+# the node whose guide cache already holds it. Off unless peers, self and secret are set.
+ROUTING_PEERS = [peer.strip() for peer in (os.getenv("ROUTING_PEERS") or "").split(",") if peer.strip()]
+ROUTING_SELF = (os.getenv("ROUTING_SELF") or "").strip()
+ROUTING_SECRET = os.getenv("ROUTING_SECRET") or ""
+ROUTING_VNODES = int(_parse_float(os.getenv("ROUTING_VNODES"), 64))
+ROUTING_MAX_HOPS = int(_parse_float(os.getenv("ROUTING_MAX_HOPS"), 1))
+ROUTING_TIMEOUT_SECONDS = _parse_float(os.getenv("ROUTING_TIMEOUT_SECONDS"), 180)
+ROUTING_HEALTH_INTERVAL_SECONDS = _parse_float(os.getenv("ROUTING_HEALTH_INTERVAL_SECONDS"), 5)
+ROUTING_HOPS_HEADER = "X-GuideBot-Hops"
+ROUTING_CLIENT_HEADER = "X-GuideBot-Client"
+ROUTING_TOKEN_HEADER = "X-GuideBot-Peer-Token"
+ROUTING_NODE_HEADER = "X-GuideBot-Node"
+
+_router: Optional[PeerRouter] = None
+if ROUTING_PEERS and ROUTING_SELF:
+    if ROUTING_SECRET:
+        _router = PeerRouter(
+            ROUTING_SELF,
+            ROUTING_PEERS,
+            vnodes=ROUTING_VNODES,
+            health_interval_seconds=ROUTING_HEALTH_INTERVAL_SECONDS,
+        )
+    else:
+        logger.warning("ROUTING_PEERS is set but ROUTING_SECRET is not; routing disabled")
+_routing_session = requests.Session()
+
 
 def _get_ai_service() -> Tuple[Optional[Any], Optional[str]]:
     global _ai_service
@@ -56,70 +351,859 @@ def _get_ai_service() -> Tuple[Optional[Any], Optional[str]]:
     if create_ai_service is None:
         return None, f"AI service import failed: {AI_IMPORT_ERROR}"
 
-    try:
-        _ai_service = create_ai_service()
-        return _ai_service, None
-    except Exception as exc:  # pragma: no cover - startup guard
-        logger.exception("Failed to initialize AI service")
-        return None, str(exc)
+    with _ai_service_lock:
+        if _ai_service is not None:
+            return _ai_service, None
+        try:
+            _ai_service = create_ai_service()
+            return _ai_service, None
+        except Exception as exc:  # pragma: no cover - startup guard
+            logger.exception("Failed to initialize AI service")
+            return None, str(exc)
 
 
-def _save_base64_image(base64_str: str, filename: str) -> Optional[str]:
+def _get_prober() -> Optional[UpstreamProber]:
+    """Start the background upstream prober on first use (one per worker process)."""
+    global _prober
+
+    if _prober is not None:
+        return _prober
+
+    service, _ = _get_ai_service()
+    if service is None:
+        return None
+
+    with _prober_lock:
+        if _prober is None:
+            _prober = UpstreamProber(service.probe_upstream, AI_PROBE_INTERVAL_SECONDS, AI_PROBE_WINDOW)
+            _prober.start()
+    return _prober
+
+
+def _get_community_store() -> CommunityStore:
+    global _community_store
+
+    if _community_store is None:
+        with _community_store_lock:
+            if _community_store is None:
+                _community_store = CommunityStore(COMMUNITY_DB_PATH)
+    return _community_store
+
+
+def _get_renderer() -> Optional[StepRenderer]:
+    global _renderer, _renderer_failed
+    if not RENDER_ENABLED or _renderer_failed:
+        return None
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None and not _renderer_failed:
+                try:
+                    _renderer = StepRenderer(RENDER_DIR, int(RENDER_MAX_MB * 1024 * 1024), font_path=RENDER_FONT_PATH)
+                except Exception as exc:
+                    logger.warning("Step renderer unavailable (%s); server-side rendering disabled", exc)
+                    _renderer_failed = True
+    return _renderer
+
+
+def _get_guide_cache() -> Optional[SharedGuideCache]:
+    """Map the host-wide guide cache on first use (one mapping per worker process)."""
+    global _guide_cache, _guide_cache_failed
+    if not GUIDE_CACHE_ENABLED or _guide_cache_failed:
+        return None
+    if _guide_cache is None:
+        with _guide_cache_lock:
+            if _guide_cache is None and not _guide_cache_failed:
+                try:
+                    _guide_cache = SharedGuideCache(GUIDE_CACHE_PATH, int(GUIDE_CACHE_MAX_MB * 1024 * 1024))
+                except Exception:
+                    logger.exception("Guide cache unavailable; generating without it")
+                    _guide_cache_failed = True
+    return _guide_cache
+
+
+def reset_startup_clock() -> None:
+    """Restart cold-start accounting, e.g. in a worker process right after fork."""
+    global _startup_started
+    _startup_started = time.perf_counter()
+    _readiness.update(ready=False, phase="starting")
+    READY.set(0)
+
+
+def warm_up() -> Dict[str, Any]:
+    """Build the AI service once, compile prompts and pre-open upstream connections.
+
+    ``/api/ready`` answers 503 until this finishes so load balancers keep traffic away.
+    """
+    _readiness["phase"] = "service_init"
+    started = time.perf_counter()
+    service, ai_error = _get_ai_service()
+    _readiness["service_init_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    STARTUP_SECONDS.set(_readiness["service_init_ms"] / 1000, phase="service_init")
+
+    if service is not None:
+        _readiness["phase"] = "prewarm"
+        try:
+            _readiness.update(service.warm_up())
+        except Exception as exc:  # pragma: no cover - warm-up is best effort
+            logger.exception("AI service warm-up failed")
+            ai_error = str(exc)
+        STARTUP_SECONDS.set((_readiness["prompts_ms"] or 0) / 1000, phase="prompts")
+        STARTUP_SECONDS.set((_readiness["prewarm_ms"] or 0) / 1000, phase="prewarm")
+
+    _readiness["phase"] = "image_pool"
+    started = time.perf_counter()
     try:
-        if "," in base64_str:
-            base64_str = base64_str.split(",", 1)[1]
+        _image_pool.warm_up()
+    except Exception:  # pragma: no cover - uploads fall back to inline work
+        logger.exception("Image pool warm-up failed")
+    _readiness["image_pool_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    STARTUP_SECONDS.set(_readiness["image_pool_ms"] / 1000, phase="image_pool")
+
+    _get_prober()
+    cold_start = time.perf_counter() - _startup_started
+    _readiness.update(ready=True, phase="ready", cold_start_ms=round(cold_start * 1000, 3), error=ai_error)
+    STARTUP_SECONDS.set(cold_start, phase="total")
+    READY.set(1)
+    logger.info(
+        "Warm-up finished in %.1f ms (%d upstream connection(s) pre-opened)",
+        cold_start * 1000,
+        _readiness["prewarmed_connections"],
+    )
+    return dict(_readiness)
 
-        image_data = base64.b64decode(base64_str)
-        path = os.path.join(UPLOAD_FOLDER, filename)
 
-        with open(path, "wb") as f:
-            f.write(image_data)
+def _save_base64_image(base64_str: str, filename: str) -> Optional[str]:
+    """Decode, validate, hash and store an upload as ``filename`` plus its format's extension.
 
-        return path
+    Raises ``InvalidImage`` for bad input. The image's sha256, format and
+    dimensions are kept on ``g.upload`` for the rest of the request.
+    """
+    path = os.path.join(UPLOAD_FOLDER, filename)
+    try:
+        with stage_timer("image_prep"):
+            info = _image_pool.prepare(base64_str, path)
+    except InvalidImage:
+        raise
     except Exception:
         logger.exception("Failed to decode/save uploaded image")
         return None
+    g.upload = info
+    return info["path"]
+
+
+def _record_original_size(data: Dict[str, Any]) -> None:
+    """Fold a browser-side downscale into ``g.upload``.
+
+    Clients that shrink a screenshot before uploading send the size they
+    started from as ``original_width``/``original_height``. When it has the
+    uploaded image's aspect ratio it becomes the upload's size, and ``scale``
+    then maps step rects all the way back to the original screenshot.
+    """
+    upload = g.upload
+    try:
+        width = int(data.get("original_width") or 0)
+        height = int(data.get("original_height") or 0)
+    except (TypeError, ValueError):
+        return
+    if width <= upload["width"] or height <= upload["height"] or max(width, height) > ORIGINAL_MAX_DIMENSION:
+        return
+    # Rounding on the client may shift either edge by a pixel, nothing more.
+    if abs(width * upload["height"] - height * upload["width"]) > max(width, height):
+        return
+    upload["scale"] *= upload["width"] / width
+    upload.update(uploaded_width=upload["width"], uploaded_height=upload["height"], width=width, height=height)
 
 
 def _build_image_data_url(filepath: str) -> str:
-    with open(filepath, "rb") as f:
-        raw = f.read()
-    return f"data:image/png;base64,{base64.b64encode(raw).decode('utf-8')}"
+    with stage_timer("image_echo"):
+        with open(filepath, "rb") as f:
+            return image_data_url(f.read())
+
+
+def _hash_image_file(filepath: str) -> str:
+    upload = g.get("upload")
+    if upload is not None and upload["path"] == filepath:
+        return upload["sha256"]
+    with stage_timer("image_hash"):
+        digest = hashlib.sha256()
+        with open(filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+def _requested_fields() -> Optional[frozenset]:
+    """Sparse fieldset from ``?fields=steps,title``; None means every field."""
+    raw = request.args.get("fields") or ""
+    fields = {part.strip() for part in raw.split(",") if part.strip()}
+    return frozenset(fields) | ALWAYS_INCLUDED_FIELDS if fields else None
+
+
+def _image_reference(filepath: str) -> Dict[str, Any]:
+    """Image fields for a guide response, per ``?image=echo|hash|none`` or RESPONSE_IMAGE_MODE.
+
+    Skips the file read entirely when the client did not ask for the field.
+    """
+    mode = (request.args.get("image") or RESPONSE_IMAGE_MODE).strip().lower()
+    fields = _requested_fields()
+    if mode == "echo" and (fields is None or "image" in fields):
+        return {"image": _build_image_data_url(filepath)}
+    if mode == "hash" and (fields is None or "image_sha256" in fields):
+        return {"image_sha256": _hash_image_file(filepath)}
+    return {}
+
+
+def _guide_response(guide: Guide, extra: Dict[str, Any], status: int = 200) -> Response:
+    """Serialize ``guide`` plus the handler's ``extra`` fields straight to the response body."""
+    with stage_timer("serialize"):
+        body = guide.to_json(extra, _requested_fields())
+    return app.response_class(body, status=status, mimetype="application/json")
+
+
+def _create_guide_session(
+    filepath: str, guide: Guide, note: str, usage: Optional[Dict[str, Any]]
+) -> Optional[str]:
+    upload = g.get("upload") or {}
+    try:
+        return _guide_sessions.create(
+            filepath,
+            guide.to_dict(),
+            note=note,
+            usage=usage,
+            image_sha256=upload.get("stored_sha256"),
+            image_format=upload.get("format"),
+            image_size=[upload["width"], upload["height"]] if "width" in upload else None,
+            image_scale=upload.get("scale", 1.0),
+        )
+    except Exception:
+        logger.exception("Failed to create guide session")
+        return None
 
 
-def _default_steps() -> List[Dict[str, Any]]:
+def _total_tokens(usage: Optional[Dict[str, Any]]) -> Optional[int]:
+    if not isinstance(usage, dict):
+        return None
+    total = usage.get("total_tokens")
+    if isinstance(total, int):
+        return total
+    parts = [usage.get("prompt_tokens"), usage.get("completion_tokens")]
+    return sum(parts) if all(isinstance(part, int) for part in parts) else None
+
+
+def _replay_response(entry: Any) -> Response:
+    response = app.response_class(entry.body, status=entry.status, headers=entry.headers)
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def idempotent(view: Callable[..., Any]) -> Callable[..., Any]:
+    """Honour ``Idempotency-Key`` on a POST endpoint.
+
+    The key is scoped to the path and bound to a hash of the body; reusing it
+    with a different body is a 422. 5xx responses are not stored, so a retry
+    after a server error does the work again.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        key = (request.headers.get(IDEMPOTENCY_HEADER) or "").strip()
+        if not IDEMPOTENCY_ENABLED or not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({"success": False, "error": "Idempotency-Key 过长。"}), 400
+
+        scope = f"{request.path}|{key}"
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        entry, owner = _idempotency.begin(scope, fingerprint)
+
+        if not owner:
+            if entry.fingerprint != fingerprint:
+                IDEMPOTENT_DUPLICATES.inc(endpoint=current_endpoint(), outcome="mismatch")
+                return jsonify({"success": False, "error": "Idempotency-Key 已用于不同的请求内容。"}), 422
+            outcome = "replayed" if entry.finished else "coalesced"
+            with stage_timer("idempotency_wait"):
+                entry.wait(IDEMPOTENCY_WAIT_SECONDS)
+            if entry.completed:
+                IDEMPOTENT_DUPLICATES.inc(endpoint=current_endpoint(), outcome=outcome)
+                return _replay_response(entry)
+            if not entry.finished:
+                return jsonify({"success": False, "error": "相同 Idempotency-Key 的请求仍在处理中。"}), 409
+            # The original failed and was abandoned; do the work as a fresh request.
+            entry, owner = _idempotency.begin(scope, fingerprint)
+            if not owner:
+                return jsonify({"success": False, "error": "相同 Idempotency-Key 的请求仍在处理中。"}), 409
+
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception:
+            _idempotency.abandon(scope, entry)
+            raise
+        if response.status_code >= 500 or response.is_streamed:
+            _idempotency.abandon(scope, entry)
+        else:
+            headers = [(name, value) for name, value in response.headers.items() if name.lower() == "content-type"]
+            _idempotency.complete(scope, entry, response.status_code, headers, response.get_data())
+        return response
+
+    return wrapper
+
+
+def _client_identity() -> Tuple[str, str]:
+    """(kind, id) of the caller for rate limiting and fair scheduling, cached per request."""
+    cached = g.get("client_identity")
+    if cached is not None:
+        return cached
+    forwarded = (request.headers.get(ROUTING_CLIENT_HEADER) or "").strip()
+    key = (request.headers.get(RATE_LIMIT_CLIENT_HEADER) or "").strip()
+    if forwarded and _from_peer():
+        # The entry node already resolved (and rate-limited) the original caller.
+        identity = (forwarded.split(":", 1)[0], forwarded)
+    elif key:
+        identity = ("key", f"key:{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}")
+    else:
+        address = request.remote_addr or "unknown"
+        if RATE_LIMIT_TRUST_FORWARDED:
+            address = (request.headers.get("X-Forwarded-For") or "").split(",")[0].strip() or address
+        identity = ("ip", f"ip:{address}")
+    g.client_identity = identity
+    return identity
+
+
+def _from_peer() -> bool:
+    """Whether this request was forwarded by another node of the routing ring."""
+    if _router is None:
+        return False
+    token = request.headers.get(ROUTING_TOKEN_HEADER)
+    return bool(token) and hmac.compare_digest(token.encode("utf-8"), ROUTING_SECRET.encode("utf-8"))
+
+
+def rate_limited(
+    name: str, error: str = "请求过于频繁，请稍后再试。"
+) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Per-client token bucket for an endpoint; every response carries ``X-RateLimit-*`` headers.
+
+    Applied outside ``idempotent`` so a 429 is never stored as the key's response.
+    """
+    limiter = _rate_limiters[name]
+
+    def decorator(view: Callable[..., Any]) -> Callable[..., Any]:
+        if limiter is None:
+            return view
+
+        @functools.wraps(view)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _from_peer():
+                return view(*args, **kwargs)
+            kind, client = _client_identity()
+            decision = limiter.take(client)
+            if decision.allowed:
+                response = app.make_response(view(*args, **kwargs))
+            else:
+                RATE_LIMITED.inc(endpoint=current_endpoint(), client_kind=kind)
+                response = app.make_response((jsonify({"success": False, "error": error}), 429))
+            response.headers.update(decision.headers())
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _routing_key(source: str, data: Dict[str, Any]) -> Optional[str]:
+    """Normalised cache identity of a generation request, or None when there is nothing to route on."""
+    if source == "image":
+        image = data.get("image")
+        if not isinstance(image, str) or not image:
+            return None
+        payload = image[image.find(",", 0, 256) + 1 :]
+        digest = hashlib.sha256(payload.encode("ascii", "ignore")).hexdigest()
+        return f"image|{digest}|{(data.get('note') or '').strip()}"
+    if source == "url":
+        url = (data.get("url") or "").strip()
+        if not url:
+            return None
+        parts = urlsplit(url)
+        return "url|" + urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", parts.query, ""))
+    text = " ".join(str(data.get("text") or "").split())
+    return f"text|{text}" if text else None
+
+
+def routed(source: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Forward the request to the ring node that owns its input, so its guide cache gets the hit.
+
+    Applied inside ``rate_limited`` (the entry node charges the caller once) and
+    outside ``idempotent`` (the owner keeps the key). A request that has already
+    taken ``ROUTING_MAX_HOPS`` hops, or whose owner cannot be reached, is
+    handled locally; an unreachable owner is also taken off the ring until its
+    health check passes again.
+    """
+
+    def decorator(view: Callable[..., Any]) -> Callable[..., Any]:
+        if _router is None:
+            return view
+
+        @functools.wraps(view)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            _router.start()
+            hops = request.headers.get(ROUTING_HOPS_HEADER, 0, type=int) if _from_peer() else 0
+            key = _routing_key(source, request.get_json(silent=True) or {})
+            owner = _router.owner(key) if key is not None else _router.self_url
+            if owner != _router.self_url and hops >= ROUTING_MAX_HOPS:
+                outcome = "hop_limit"
+            elif owner != _router.self_url:
+                response = _forward(owner, hops)
+                if response is not None:
+                    ROUTED_REQUESTS.inc(endpoint=current_endpoint(), outcome="forwarded")
+                    return response
+                _router.mark_down(owner)
+                outcome = "fallback"
+            else:
+                outcome = "local"
+            ROUTED_REQUESTS.inc(endpoint=current_endpoint(), outcome=outcome)
+            response = app.make_response(view(*args, **kwargs))
+            response.headers[ROUTING_NODE_HEADER] = _router.self_url
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _forward(owner: str, hops: int) -> Optional[Response]:
+    headers = {
+        "Content-Type": request.headers.get("Content-Type", "application/json"),
+        # The entry node compresses for the client; the hop between nodes stays plain.
+        "Accept-Encoding": "identity",
+        ROUTING_HOPS_HEADER: str(hops + 1),
+        ROUTING_CLIENT_HEADER: _client_identity()[1],
+        ROUTING_TOKEN_HEADER: ROUTING_SECRET,
+    }
+    for name in (IDEMPOTENCY_HEADER, RATE_LIMIT_CLIENT_HEADER, PROFILE_HEADER):
+        if request.headers.get(name):
+            headers[name] = request.headers[name]
+    url = f"{owner}{request.path}"
+    if request.query_string:
+        # Response options such as ?fields= and ?image= are applied by the owner.
+        url = f"{url}?{request.query_string.decode('latin-1')}"
+    try:
+        with stage_timer("route_forward"):
+            upstream = _routing_session.post(
+                url, data=request.get_data(), headers=headers, timeout=ROUTING_TIMEOUT_SECONDS
+            )
+    except requests.RequestException as exc:
+        logger.warning("Forwarding to %s failed, handling locally: %s", owner, exc)
+        return None
+    response = app.response_class(upstream.content, status=upstream.status_code)
+    for name in ("Content-Type", "Retry-After", "Idempotent-Replayed", ROUTING_NODE_HEADER):
+        if name in upstream.headers:
+            response.headers[name] = upstream.headers[name]
+    return response
+
+
+def fair_scheduled(view: Callable[..., Any]) -> Callable[..., Any]:
+    """Hold one of the process's upstream slots, shared fairly between clients, while ``view`` runs."""
+    if _scheduler is None:
+        return view
+
+    @functools.wraps(view)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        _, client = _client_identity()
+        started = time.perf_counter()
+        with stage_timer("fair_queue"):
+            outcome = _scheduler.acquire(client, FAIR_QUEUE_TIMEOUT_SECONDS)
+        FAIR_QUEUE_SECONDS.observe(time.perf_counter() - started, endpoint=current_endpoint(), outcome=outcome)
+        if outcome != "granted":
+            response = app.make_response((jsonify({"success": False, "error": "服务繁忙，请稍后再试。"}), 503))
+            response.headers["Retry-After"] = str(max(math.ceil(FAIR_QUEUE_TIMEOUT_SECONDS / 10), 1))
+            return response
+        try:
+            return view(*args, **kwargs)
+        finally:
+            _scheduler.release(client)
+
+    return wrapper
+
+
+def _default_steps() -> List[Step]:
     return [
+        Step(1, "点击页面右上角的“登录”按钮，进入登录流程。", 650, 50, 100, 40, "#ff0000"),
+        Step(2, "在用户名输入框中填写你的账号信息。", 300, 200, 200, 40, "#00aa00"),
+        Step(3, "在密码输入框中输入密码，并确认输入无误。", 300, 260, 200, 40, "#0000ff"),
+        Step(4, "点击“确认登录”按钮，等待页面跳转完成。", 350, 350, 120, 45, "#ff8800"),
+    ]
+
+
+# Built-in guides per endpoint, returned when the AI service is unavailable or returns nothing.
+FALLBACK_GUIDES: Dict[str, Dict[str, Any]] = {
+    "image": {
+        "title": "操作引导（回退）",
+        "prerequisites": ("确认网络连接稳定。", "准备好账号与必要权限。"),
+        "common_mistakes": ("漏点关键按钮。", "提交前未检查输入信息。"),
+        "final_check": ("页面跳转成功。", "操作结果已生效。"),
+    },
+    "url": {
+        "title": "网址操作引导（回退）",
+        "prerequisites": ("确认网址可正常访问。", "等待页面加载完成后再操作。"),
+        "common_mistakes": ("页面未加载完成就开始点击，导致操作失败。",),
+        "final_check": ("已进入目标功能页面。",),
+    },
+    "text": {
+        "title": "文本任务引导（回退）",
+        "prerequisites": ("确认你有相关应用或网页的访问权限。",),
+        "common_mistakes": ("跳过确认步骤，导致结果不完整。",),
+        "final_check": ("目标任务已按描述完成。",),
+    },
+}
+
+
+def _fallback_guide(source: str, summary: str = "AI 服务暂不可用，以下为示例引导步骤。") -> Guide:
+    spec = FALLBACK_GUIDES[source]
+    return Guide(
+        _default_steps(),
+        title=spec["title"],
+        summary=summary,
+        prerequisites=list(spec["prerequisites"]),
+        common_mistakes=list(spec["common_mistakes"]),
+        final_check=list(spec["final_check"]),
+    )
+
+
+def _result_guide(ai_result: Dict[str, Any], title: str) -> Guide:
+    """The guide in an analysis result, or an empty one titled ``title`` when generation failed."""
+    guide = ai_result.get("guide")
+    if guide is None:
+        guide = Guide([], title=title, summary="请按以下步骤依次完成操作。")
+    return guide
+
+
+# Per endpoint: title of a guide that failed to generate, success message, prefix of a 500 error.
+GUIDE_ENDPOINTS: Dict[str, Dict[str, str]] = {
+    "image": {"title": "操作引导", "message": "图片分析完成。", "error": "服务端内部错误"},
+    "url": {"title": "网址操作引导", "message": "网址处理完成。", "error": "处理网址失败"},
+    "text": {"title": "文本任务引导", "message": "文本处理完成。", "error": "处理文本失败"},
+}
+
+
+def _stage_input_image(ctx: GuideContext) -> Optional[Any]:
+    data = request.get_json(silent=True) or {}
+    image_base64 = data.get("image")
+    ctx.note = (data.get("note") or "").strip()
+    if not image_base64:
+        return jsonify({"success": False, "error": "缺少图片 Base64 数据。"}), 400
+
+    try:
+        ctx.input = _save_base64_image(image_base64, uuid.uuid4().hex)
+    except InvalidImage as exc:
+        return jsonify({"success": False, "error": str(exc)}), 400
+    if not ctx.input:
+        return jsonify({"success": False, "error": "保存图片失败。"}), 500
+
+    _record_original_size(data)
+    ctx.extra = {
+        **_image_reference(ctx.input),
+        "image_size": {"width": g.upload["width"], "height": g.upload["height"]},
+    }
+    ctx.success_extra = {"note": ctx.note}
+    return None
+
+
+def _stage_input_url(ctx: GuideContext) -> Optional[Any]:
+    data = request.get_json(silent=True) or {}
+    ctx.input = (data.get("url") or "").strip()
+    if not ctx.input:
+        return jsonify({"success": False, "error": "缺少网址参数。"}), 400
+    ctx.extra = {"url": ctx.input}
+    return None
+
+
+def _stage_input_text(ctx: GuideContext) -> Optional[Any]:
+    data = request.get_json(silent=True) or {}
+    ctx.input = (data.get("text") or "").strip()
+    if not ctx.input:
+        return jsonify({"success": False, "error": "缺少文本描述。"}), 400
+    ctx.extra = {"text": ctx.input, "scenario": "general"}
+    return None
+
+
+def _stage_service(ctx: GuideContext) -> Optional[Any]:
+    service, ai_error = _get_ai_service()
+    if service is not None:
+        ctx.service = service
+        return None
+
+    logger.error("AI service unavailable in /api/process/%s: %s", ctx.source, ai_error)
+    if not ALLOW_MOCK_ON_AI_ERROR:
+        return jsonify({"success": False, "error": f"AI service unavailable: {ai_error}"}), 503
+    record_fallback("service_unavailable")
+    return _guide_response(
+        _fallback_guide(ctx.source),
         {
-            "step": 1,
-            "description": "点击页面右上角的“登录”按钮，进入登录流程。",
-            "rect": {"x": 650, "y": 50, "width": 100, "height": 40},
-            "color": "#ff0000",
-        },
-        {
-            "step": 2,
-            "description": "在用户名输入框中填写你的账号信息。",
-            "rect": {"x": 300, "y": 200, "width": 200, "height": 40},
-            "color": "#00aa00",
-        },
-        {
-            "step": 3,
-            "description": "在密码输入框中输入密码，并确认输入无误。",
-            "rect": {"x": 300, "y": 260, "width": 200, "height": 40},
-            "color": "#0000ff",
+            "success": True,
+            **ctx.extra,
+            "message": "AI 服务不可用，已返回回退说明。",
+            "ai_used": False,
+            "source": "mock",
+            "error": ai_error,
         },
+    )
+
+
+def _stage_cache_lookup(ctx: GuideContext) -> Optional[str]:
+    """On a shared guide cache hit, skip generation and go straight to ``fallback``.
+
+    The key covers the model and the compiled prompts, so changing either starts
+    a fresh keyspace instead of serving guides written for the old prompt.
+    """
+    cache = _get_guide_cache()
+    if cache is None:
+        return None
+    service = ctx.service
+    # The stored image, not the upload: cached rects are in the pixels the model saw.
+    parts = [g.upload["stored_sha256"], ctx.note] if ctx.source == "image" else [ctx.input]
+    ctx.cache_key = json.dumps(
+        [ctx.source, service.model, service._system_prompt(), service._guide_instructions(), *parts],
+        ensure_ascii=False,
+    )
+    cached = cache.get(ctx.cache_key, source=ctx.source)
+    if cached is None:
+        return None
+    guide = Guide.from_dict(json.loads(cached))
+    ctx.result = {"success": True, "guide": guide, "ai_used": True, "source": "ai", "error": None}
+    return "fallback"
+
+
+def _stage_analyze(ctx: GuideContext) -> None:
+    ctx.result = ctx.service.analyze(ctx.source, ctx.input, ctx.note)
+
+
+def _stage_cache_store(ctx: GuideContext) -> None:
+    cache = _get_guide_cache()
+    result = ctx.result
+    guide = result.get("guide")
+    if cache is None or ctx.cache_key is None or guide is None or not guide.steps:
+        return
+    if result.get("success") and result.get("ai_used"):
+        cache.put(ctx.cache_key, guide.to_json(), GUIDE_CACHE_TTL_SECONDS)
+
+
+def _stage_fallback(ctx: GuideContext) -> Optional[Response]:
+    """Answer a failed generation, or swap a guide without steps for the built-in one."""
+    result = ctx.result
+    ctx.guide = _result_guide(result, GUIDE_ENDPOINTS[ctx.source]["title"])
+    if not result.get("success"):
+        logger.error("AI analyze_%s failed: %s", ctx.source, result.get("error"))
+        return _guide_response(
+            ctx.guide,
+            {
+                "success": ALLOW_MOCK_ON_AI_ERROR,
+                **ctx.extra,
+                "message": "AI 调用失败。" if not ALLOW_MOCK_ON_AI_ERROR else "AI 生成失败，已返回回退说明。",
+                "ai_used": False,
+                "source": "mock" if ALLOW_MOCK_ON_AI_ERROR else "error",
+                "error": result.get("error"),
+            },
+            200 if ALLOW_MOCK_ON_AI_ERROR else 502,
+        )
+
+    if not ctx.guide.steps:
+        logger.warning("AI returned success but no steps.")
+        if ALLOW_MOCK_ON_AI_ERROR:
+            record_fallback("empty_steps")
+            ctx.guide = _fallback_guide(ctx.source, "AI 未返回有效步骤，已切换为回退说明。")
+            result["ai_used"] = False
+    return None
+
+
+def _stage_rescale(ctx: GuideContext) -> None:
+    """Map rectangles from the downscaled image the model saw back onto the upload."""
+    if ctx.result.get("ai_used") and g.upload["scale"] != 1.0:
+        ctx.guide.scale_rects(1 / g.upload["scale"])
+
+
+def _stage_session(ctx: GuideContext) -> None:
+    if ctx.result.get("ai_used") and GUIDE_SESSION_ENABLED:
+        # Moves the upload into the session; the cleanup after the pipeline then finds nothing to remove.
+        ctx.success_extra["session_id"] = _create_guide_session(
+            ctx.input, ctx.guide, ctx.note, ctx.result.get("usage")
+        )
+
+
+def _stage_respond(ctx: GuideContext) -> Response:
+    ai_used = bool(ctx.result.get("ai_used"))
+    return _guide_response(
+        ctx.guide,
         {
-            "step": 4,
-            "description": "点击“确认登录”按钮，等待页面跳转完成。",
-            "rect": {"x": 350, "y": 350, "width": 120, "height": 45},
-            "color": "#ff8800",
+            "success": True,
+            **ctx.extra,
+            "message": GUIDE_ENDPOINTS[ctx.source]["message"],
+            "ai_used": ai_used,
+            "source": "ai" if ai_used else "mock",
+            "error": ctx.result.get("error"),
+            **ctx.success_extra,
         },
-    ]
+    )
+
+
+def _guide_pipeline(source: str, input_stage: Callable[[GuideContext], Any]) -> Pipeline:
+    return Pipeline(
+        source,
+        [
+            ("input", input_stage),
+            ("service", _stage_service),
+            ("cache_lookup", _stage_cache_lookup),
+            ("analyze", _stage_analyze),
+            ("cache_store", _stage_cache_store),
+            ("fallback", _stage_fallback),
+            ("respond", _stage_respond),
+        ],
+    )
+
+
+# One pipeline per generation endpoint; the service runs its own prompt/upstream/parse stages inside ``analyze``.
+GUIDE_PIPELINES: Dict[str, Pipeline] = {
+    "image": _guide_pipeline("image", _stage_input_image)
+    .insert_after("fallback", "rescale", _stage_rescale)
+    .insert_after("rescale", "session", _stage_session),
+    "url": _guide_pipeline("url", _stage_input_url),
+    "text": _guide_pipeline("text", _stage_input_text),
+}
+
+
+def _run_guide_pipeline(source: str) -> Any:
+    ctx = GuideContext(source)
+    try:
+        return GUIDE_PIPELINES[source].run(ctx)
+    except Exception as exc:  # pragma: no cover - last-line guard
+        logger.exception("Error in /api/process/%s", source)
+        return jsonify({"success": False, "error": f"{GUIDE_ENDPOINTS[source]['error']}: {exc}"}), 500
+    finally:
+        if source == "image" and ctx.input and os.path.exists(ctx.input):
+            try:
+                os.remove(ctx.input)
+            except Exception:
+                logger.exception("Failed to cleanup temp image: %s", ctx.input)
+
+
+@app.before_request
+def _begin_request_metrics():
+    g.request_started = time.perf_counter()
+    g.metrics_tokens = begin_request(request.url_rule.rule if request.url_rule else "unmatched")
+    if _profiler is not None:
+        g.profile_ident = _profiler.start()
+
+
+@app.after_request
+def _observe_request_latency(response: Response) -> Response:
+    started = g.get("request_started")
+    if started is not None:
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            endpoint=current_endpoint(),
+            status=str(response.status_code),
+        )
+    return response
+
+
+@app.after_request
+def _capture_slow_request_profile(response: Response) -> Response:
+    ident = g.pop("profile_ident", None)
+    if ident is None or _profiler is None or _profile_store is None:
+        return response
+
+    stacks = _profiler.stop(ident)
+    duration = time.perf_counter() - g.request_started
+    forced = _parse_bool(request.headers.get(PROFILE_HEADER), False)
+    if not stacks or (duration < PROFILER_SLOW_SECONDS and not forced):
+        return response
+
+    try:
+        profile_id = _profile_store.save(
+            {
+                "method": request.method,
+                "path": request.path,
+                "endpoint": current_endpoint(),
+                "status": response.status_code,
+                "duration_ms": round(duration * 1000, 3),
+                "trigger": "header" if forced else "slow",
+                "captured_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+                "sample_interval_ms": round(_profiler.interval_seconds * 1000, 3),
+                "samples": sum(stacks.values()),
+                "stages": [{"stage": name, "ms": round(seconds * 1000, 3)} for name, seconds in current_timings()],
+                "stacks": stacks,
+            }
+        )
+        response.headers["X-GuideBot-Profile-Id"] = profile_id
+    except Exception:
+        logger.exception("Failed to store request profile")
+    return response
+
+
+@app.after_request
+def _compress_response(response: Response) -> Response:
+    """Negotiate gzip/br for /api/* bodies.
+
+    Registered last so it runs first among the after-request hooks and its cost
+    is included in the request latency. Responses carrying a ``precompressed``
+    attribute (a ``PrecompressedBody`` from a cache) reuse its stored variants.
+    """
+    if not COMPRESSION_ENABLED or not request.path.startswith("/api/"):
+        return response
+    if response.direct_passthrough or response.is_streamed or "Content-Encoding" in response.headers:
+        return response
+    if response.status_code in (204, 206, 304) or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    precompressed = getattr(response, "precompressed", None)
+    data = precompressed.data if precompressed is not None else response.get_data()
+    encoding = negotiate(request.headers.get("Accept-Encoding")) if len(data) >= COMPRESSION_MIN_BYTES else None
+    if encoding is None:
+        record_response_bytes(len(data), len(data), "identity")
+        return response
+
+    if precompressed is not None:
+        body = precompressed.variant(encoding, COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_QUALITY)
+    else:
+        body = compress_observed(data, encoding, COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_QUALITY)
+    if len(body) >= len(data):
+        record_response_bytes(len(data), len(data), "identity")
+        return response
+
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # The encoded bytes differ from the identity representation. Stored
+        # variants are byte-stable, so they keep a strong per-encoding tag.
+        if precompressed is not None:
+            response.set_etag(encoded_etag(etag, encoding))
+        else:
+            response.set_etag(etag, weak=True)
+    record_response_bytes(len(data), len(body), encoding)
+    return response
+
+
+@app.teardown_request
+def _end_request_metrics(exc: Optional[BaseException]) -> None:
+    ident = g.pop("profile_ident", None)
+    if ident is not None and _profiler is not None:
+        _profiler.stop(ident)
+
+    tokens = g.pop("metrics_tokens", None)
+    if tokens is None:
+        return
+    try:
+        end_request(tokens)
+    except ValueError:
+        # Token created in a different context (e.g. streamed response); nothing to restore.
+        pass
 
 
 @app.route("/api/health", methods=["GET"])
 def health_check():
     service, ai_error = _get_ai_service()
     ai_ready = service is not None and not ai_error
+    prober = _get_prober()
 
     return jsonify(
         {
@@ -131,371 +1215,338 @@ def health_check():
                 "allow_mock_fallback": ALLOW_MOCK_ON_AI_ERROR,
                 "error": ai_error,
             },
+            "startup": dict(_readiness),
+            "upstream": prober.snapshot() if prober is not None else None,
+            "key_pool": service.key_pool.snapshot() if service is not None else None,
+            "lanes": service.lanes.snapshot() if service is not None else None,
+            "guide_cache": _guide_cache.stats() if _guide_cache is not None else None,
+            "renderer": _renderer.stats() if _renderer is not None else None,
+            "page_fetch": service.page_fetcher.stats() if service is not None and service.page_fetcher else None,
+            "scheduler": _scheduler.snapshot() if _scheduler is not None else None,
+            "routing": _router.snapshot() if _router is not None else None,
             "endpoints": [
                 "/api/health",
+                "/api/ready",
                 "/api/process/image",
                 "/api/process/url",
                 "/api/process/text",
+                "/api/process/refine",
+                "/api/sessions/<session_id>/render",
+                "/api/renders/<render_id>/<name>.<format>",
                 "/api/community/guides",
+                "/api/community/guides/<share_id>",
                 "/api/community/share",
                 "/api/test/ai",
+                "/api/metrics",
             ],
         }
     )
 
 
+@app.route("/api/ready", methods=["GET"])
+def readiness_check():
+    status_code = 200 if _readiness["ready"] else 503
+    return jsonify(dict(_readiness)), status_code
+
+
 @app.route("/api/process/image", methods=["POST"])
+@rate_limited("image")
+@routed("image")
+@idempotent
+@fair_scheduled
 def process_image():
-    filepath: Optional[str] = None
+    return _run_guide_pipeline("image")
+
+
+@app.route("/api/process/refine", methods=["POST"])
+@rate_limited("refine")
+@idempotent
+@fair_scheduled
+def refine_guide():
+    if _guide_sessions is None:
+        return jsonify({"success": False, "error": "引导会话未启用。"}), 404
 
     try:
         data = request.get_json(silent=True) or {}
-        image_base64 = data.get("image")
-        user_note = (data.get("note") or "").strip()
-
-        if not image_base64:
-            return jsonify({"success": False, "error": "缺少图片 Base64 数据。"}), 400
+        session_id = (data.get("session_id") or "").strip()
+        instruction = (data.get("instruction") or data.get("note") or "").strip()
 
-        filename = f"{uuid.uuid4().hex}.png"
-        filepath = _save_base64_image(image_base64, filename)
+        if not session_id or not instruction:
+            return jsonify({"success": False, "error": "缺少 session_id 或调整要求。"}), 400
 
-        if not filepath:
-            return jsonify({"success": False, "error": "保存图片失败。"}), 500
+        session = _guide_sessions.get(session_id)
+        if session is None:
+            return jsonify({"success": False, "error": "引导会话不存在或已过期，请重新上传截图。"}), 404
 
+        previous = session["guide"]
         service, ai_error = _get_ai_service()
         if service is None:
-            logger.error("AI service unavailable: %s", ai_error)
-            if not ALLOW_MOCK_ON_AI_ERROR:
-                return jsonify({"success": False, "error": f"AI service unavailable: {ai_error}"}), 503
-
-            return jsonify(
-                {
-                    "success": True,
-                    "steps": _default_steps(),
-                    "title": "操作引导（回退）",
-                    "summary": "AI 服务暂不可用，以下为示例引导步骤。",
-                    "estimated_time": "约3分钟",
-                    "difficulty": "初级",
-                    "prerequisites": ["确认网络连接稳定。", "准备好账号与必要权限。"],
-                    "common_mistakes": ["漏点关键按钮。", "提交前未检查输入信息。"],
-                    "final_check": ["页面跳转成功。", "操作结果已生效。"],
-                    "image": _build_image_data_url(filepath),
-                    "message": "AI 服务不可用，已返回回退说明。",
-                    "ai_used": False,
-                    "source": "mock",
-                    "error": ai_error,
-                }
+            ai_result: Dict[str, Any] = {"success": False, "error": f"AI service unavailable: {ai_error}"}
+        else:
+            # Session rects are in original-screenshot pixels; the stored image may be smaller.
+            ai_result = service.refine_image_guide(
+                session["image_path"], previous, instruction, float(session.get("image_scale") or 1.0)
             )
 
-        ai_result = service.analyze_image(filepath, user_note=user_note)
-        steps = ai_result.get("steps") or []
-        title = ai_result.get("title") or "操作引导"
-        summary = ai_result.get("summary") or "请按以下步骤依次完成操作。"
-        estimated_time = ai_result.get("estimated_time") or "约3分钟"
-        difficulty = ai_result.get("difficulty") or "初级"
-        prerequisites = ai_result.get("prerequisites") or []
-        common_mistakes = ai_result.get("common_mistakes") or []
-        final_check = ai_result.get("final_check") or []
-        ai_used = bool(ai_result.get("ai_used"))
-        source = "ai" if ai_used else "mock"
-
         if not ai_result.get("success"):
-            logger.error("AI analyze_image failed: %s", ai_result.get("error"))
-            status_code = 502 if not ALLOW_MOCK_ON_AI_ERROR else 200
-            return jsonify(
+            logger.error("AI refine failed: %s", ai_result.get("error"))
+            if not ALLOW_MOCK_ON_AI_ERROR:
+                return jsonify({"success": False, "error": ai_result.get("error")}), 502
+            record_fallback("refine_failed")
+            return _guide_response(
+                Guide.from_dict(previous),
                 {
-                    "success": ALLOW_MOCK_ON_AI_ERROR,
-                    "steps": steps if ALLOW_MOCK_ON_AI_ERROR else [],
-                    "title": title,
-                    "summary": summary,
-                    "estimated_time": estimated_time,
-                    "difficulty": difficulty,
-                    "prerequisites": prerequisites,
-                    "common_mistakes": common_mistakes,
-                    "final_check": final_check,
-                    "image": _build_image_data_url(filepath),
-                    "message": "AI 调用失败。" if not ALLOW_MOCK_ON_AI_ERROR else "AI 生成失败，已返回回退说明。",
+                    "success": True,
+                    "session_id": session_id,
+                    "refined_steps": [],
+                    "message": "AI 调整失败，已返回上一版引导。",
                     "ai_used": False,
-                    "source": "mock" if ALLOW_MOCK_ON_AI_ERROR else "error",
+                    "source": "session",
                     "error": ai_result.get("error"),
-                }
-            ), status_code
-
-        if not steps:
-            logger.warning("AI returned success but no steps.")
-            if ALLOW_MOCK_ON_AI_ERROR:
-                steps = _default_steps()
-                title = "操作引导（回退）"
-                summary = "AI 未返回有效步骤，已切换为回退说明。"
-                estimated_time = "约3分钟"
-                difficulty = "初级"
-                prerequisites = ["确认网络连接稳定。", "准备好账号与必要权限。"]
-                common_mistakes = ["漏点关键按钮。", "提交前未检查输入信息。"]
-                final_check = ["页面跳转成功。", "操作结果已生效。"]
-                ai_used = False
-                source = "mock"
+                    "note": instruction,
+                },
+            )
 
-        return jsonify(
+        guide = {key: ai_result[key] for key in GUIDE_FIELDS if key in ai_result}
+        # The client skipped re-uploading the screenshot as a base64 data URL.
+        mime_type = IMAGE_MIME_TYPES.get(session.get("image_format") or "png", "image/png")
+        upload_bytes_saved = 4 * ((session["image_bytes"] + 2) // 3) + len(f"data:{mime_type};base64,")
+        previous_tokens = _total_tokens(session.get("usage"))
+        refine_tokens = _total_tokens(ai_result.get("usage"))
+        tokens_saved = previous_tokens - refine_tokens if previous_tokens and refine_tokens else None
+        REFINE_SAVINGS.inc(upload_bytes_saved, kind="upload_bytes")
+        if tokens_saved and tokens_saved > 0:
+            REFINE_SAVINGS.inc(tokens_saved, kind="tokens")
+
+        session.update(
+            guide=guide,
+            note=instruction,
+            refinements=int(session.get("refinements") or 0) + 1,
+        )
+        _guide_sessions.update(session_id, session)
+
+        return _guide_response(
+            Guide.from_dict(guide),
             {
                 "success": True,
-                "steps": steps,
-                "title": title,
-                "summary": summary,
-                "estimated_time": estimated_time,
-                "difficulty": difficulty,
-                "prerequisites": prerequisites,
-                "common_mistakes": common_mistakes,
-                "final_check": final_check,
-                "image": _build_image_data_url(filepath),
-                "message": "图片分析完成。",
-                "ai_used": ai_used,
-                "source": source,
-                "error": ai_result.get("error"),
-                "note": user_note,
-            }
+                "session_id": session_id,
+                "refined_steps": ai_result.get("refined_steps") or [],
+                "savings": {"upload_bytes": upload_bytes_saved, "tokens": tokens_saved},
+                "message": "引导已按要求调整。",
+                "ai_used": True,
+                "source": "ai",
+                "error": None,
+                "note": instruction,
+            },
         )
 
     except Exception as exc:  # pragma: no cover - last-line guard
-        logger.exception("Unexpected error in /api/process/image")
+        logger.exception("Unexpected error in /api/process/refine")
         return jsonify({"success": False, "error": f"服务端内部错误: {exc}"}), 500
-    finally:
-        if filepath and os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-            except Exception:
-                logger.exception("Failed to cleanup temp image: %s", filepath)
 
 
-@app.route("/api/process/url", methods=["POST"])
-def process_url():
-    try:
-        data = request.get_json(silent=True) or {}
-        url = (data.get("url") or "").strip()
+@app.route("/api/sessions/<session_id>/render", methods=["GET"])
+def render_session(session_id: str):
+    """Where the annotated images of a session's current guide live.
 
-        if not url:
-            return jsonify({"success": False, "error": "缺少网址参数。"}), 400
+    The manifest follows the session (a refine changes it); the image URLs it
+    lists are content-addressed and never change.
+    """
+    if _guide_sessions is None:
+        return jsonify({"success": False, "error": "引导会话未启用。"}), 404
+    renderer = _get_renderer()
+    if renderer is None:
+        return jsonify({"success": False, "error": "服务端渲染未启用（需要安装 Pillow）。"}), 501
+    fmt = (request.args.get("format") or RENDER_FORMAT).strip().lower()
+    if fmt not in RENDER_FORMATS:
+        return jsonify({"success": False, "error": "不支持的图片格式，仅支持 png/webp。"}), 400
 
-        service, ai_error = _get_ai_service()
-        if service is None:
-            logger.error("AI service unavailable in /api/process/url: %s", ai_error)
-            if not ALLOW_MOCK_ON_AI_ERROR:
-                return jsonify({"success": False, "error": f"AI service unavailable: {ai_error}"}), 503
-            return jsonify(
-                {
-                    "success": True,
-                    "steps": _default_steps(),
-                    "title": "网址操作引导（回退）",
-                    "summary": "AI 服务暂不可用，以下为示例引导步骤。",
-                    "estimated_time": "约3分钟",
-                    "difficulty": "初级",
-                    "prerequisites": ["确认网址可正常访问。", "等待页面加载完成后再操作。"],
-                    "common_mistakes": ["页面未加载完成就开始点击，导致操作失败。"],
-                    "final_check": ["已进入目标功能页面。"],
-                    "url": url,
-                    "message": "AI 服务不可用，已返回回退说明。",
-                    "ai_used": False,
-                    "source": "mock",
-                    "error": ai_error,
-                }
-            )
+    session = _guide_sessions.get(session_id)
+    if session is None:
+        return jsonify({"success": False, "error": "引导会话不存在或已过期，请重新上传截图。"}), 404
 
-        ai_result = service.analyze_url(url)
-        steps = ai_result.get("steps") or []
-        title = ai_result.get("title") or "网址操作引导"
-        summary = ai_result.get("summary") or "请按以下步骤依次完成操作。"
-        estimated_time = ai_result.get("estimated_time") or "约3分钟"
-        difficulty = ai_result.get("difficulty") or "初级"
-        prerequisites = ai_result.get("prerequisites") or []
-        common_mistakes = ai_result.get("common_mistakes") or []
-        final_check = ai_result.get("final_check") or []
-        ai_used = bool(ai_result.get("ai_used"))
-        source = "ai" if ai_used else "mock"
+    try:
+        render_id = renderer.prepare(
+            session["image_path"],
+            session["guide"].get("steps") or [],
+            session.get("image_sha256") or _hash_image_file(session["image_path"]),
+            session.get("image_size"),
+        )
+        layout = renderer.describe(render_id)
+    except Exception as exc:
+        logger.exception("Error in /api/sessions/<session_id>/render")
+        return jsonify({"success": False, "error": f"渲染失败: {exc}"}), 500
+    if layout is None:
+        return jsonify({"success": False, "error": "渲染结果已被清理，请重试。"}), 503
 
-        if not ai_result.get("success"):
-            logger.error("AI analyze_url failed: %s", ai_result.get("error"))
-            status_code = 502 if not ALLOW_MOCK_ON_AI_ERROR else 200
-            return jsonify(
-                {
-                    "success": ALLOW_MOCK_ON_AI_ERROR,
-                    "steps": steps if ALLOW_MOCK_ON_AI_ERROR else [],
-                    "title": title,
-                    "summary": summary,
-                    "estimated_time": estimated_time,
-                    "difficulty": difficulty,
-                    "prerequisites": prerequisites,
-                    "common_mistakes": common_mistakes,
-                    "final_check": final_check,
-                    "url": url,
-                    "message": "AI 调用失败。" if not ALLOW_MOCK_ON_AI_ERROR else "AI 生成失败，已返回回退说明。",
-                    "ai_used": False,
-                    "source": "mock" if ALLOW_MOCK_ON_AI_ERROR else "error",
-                    "error": ai_result.get("error"),
-                }
-            ), status_code
+    base = f"/api/renders/{render_id}"
+    return jsonify(
+        {
+            "success": True,
+            "session_id": session_id,
+            "render_id": render_id,
+            "format": fmt,
+            "width": layout["width"],
+            "height": layout["height"],
+            "scale": layout["scale"],
+            "full": f"{base}/full.{fmt}",
+            "sprite": {"url": f"{base}/sprite.{fmt}", **layout["sprite"]},
+            "steps": [
+                {"step": step["step"], "url": f"{base}/step-{step['step']}.{fmt}", **step}
+                for step in layout["steps"]
+            ],
+        }
+    )
 
-        return jsonify(
-            {
-                "success": True,
-                "steps": steps,
-                "title": title,
-                "summary": summary,
-                "estimated_time": estimated_time,
-                "difficulty": difficulty,
-                "prerequisites": prerequisites,
-                "common_mistakes": common_mistakes,
-                "final_check": final_check,
-                "url": url,
-                "message": "网址处理完成。",
-                "ai_used": ai_used,
-                "source": source,
-                "error": ai_result.get("error"),
-            }
-        )
 
-    except Exception as exc:
-        logger.exception("Error in /api/process/url")
-        return jsonify({"success": False, "error": f"处理网址失败: {exc}"}), 500
+@app.route("/api/renders/<render_id>/<filename>", methods=["GET"])
+def get_render(render_id: str, filename: str):
+    name, _, fmt = filename.rpartition(".")
+    if not is_render_id(render_id) or fmt not in RENDER_FORMATS:
+        return jsonify({"success": False, "error": "渲染结果不存在。"}), 404
+    renderer = _get_renderer()
+    if renderer is None:
+        return jsonify({"success": False, "error": "服务端渲染未启用（需要安装 Pillow）。"}), 501
 
+    # The id hashes everything drawn, so any tag for this URL is still current.
+    etag = f"{render_id}-{name}-{fmt}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
 
-@app.route("/api/process/text", methods=["POST"])
-def process_text():
     try:
-        data = request.get_json(silent=True) or {}
-        text = (data.get("text") or "").strip()
-
-        if not text:
-            return jsonify({"success": False, "error": "缺少文本描述。"}), 400
+        path = renderer.output(render_id, name, fmt)
+    except Exception as exc:
+        logger.exception("Error in /api/renders/<render_id>/<filename>")
+        return jsonify({"success": False, "error": f"渲染失败: {exc}"}), 500
+    if path is None:
+        return jsonify({"success": False, "error": "渲染结果不存在或已过期，请重新获取清单。"}), 404
 
-        service, ai_error = _get_ai_service()
-        if service is None:
-            logger.error("AI service unavailable in /api/process/text: %s", ai_error)
-            if not ALLOW_MOCK_ON_AI_ERROR:
-                return jsonify({"success": False, "error": f"AI service unavailable: {ai_error}"}), 503
-            return jsonify(
-                {
-                    "success": True,
-                    "steps": _default_steps(),
-                    "title": "文本任务引导（回退）",
-                    "summary": "AI 服务暂不可用，以下为示例引导步骤。",
-                    "estimated_time": "约3分钟",
-                    "difficulty": "初级",
-                    "prerequisites": ["确认你有相关应用或网页的访问权限。"],
-                    "common_mistakes": ["跳过确认步骤，导致结果不完整。"],
-                    "final_check": ["目标任务已按描述完成。"],
-                    "text": text,
-                    "scenario": "general",
-                    "message": "AI 服务不可用，已返回回退说明。",
-                    "ai_used": False,
-                    "source": "mock",
-                    "error": ai_error,
-                }
-            )
+    response = send_file(path, mimetype=RENDER_FORMATS[fmt][1], conditional=False, etag=False)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
 
-        ai_result = service.analyze_text(text)
-        steps = ai_result.get("steps") or []
-        title = ai_result.get("title") or "文本任务引导"
-        summary = ai_result.get("summary") or "请按以下步骤依次完成操作。"
-        estimated_time = ai_result.get("estimated_time") or "约3分钟"
-        difficulty = ai_result.get("difficulty") or "初级"
-        prerequisites = ai_result.get("prerequisites") or []
-        common_mistakes = ai_result.get("common_mistakes") or []
-        final_check = ai_result.get("final_check") or []
-        ai_used = bool(ai_result.get("ai_used"))
-        source = "ai" if ai_used else "mock"
 
-        if not ai_result.get("success"):
-            logger.error("AI analyze_text failed: %s", ai_result.get("error"))
-            status_code = 502 if not ALLOW_MOCK_ON_AI_ERROR else 200
-            return jsonify(
-                {
-                    "success": ALLOW_MOCK_ON_AI_ERROR,
-                    "steps": steps if ALLOW_MOCK_ON_AI_ERROR else [],
-                    "title": title,
-                    "summary": summary,
-                    "estimated_time": estimated_time,
-                    "difficulty": difficulty,
-                    "prerequisites": prerequisites,
-                    "common_mistakes": common_mistakes,
-                    "final_check": final_check,
-                    "text": text,
-                    "scenario": "general",
-                    "message": "AI 调用失败。" if not ALLOW_MOCK_ON_AI_ERROR else "AI 生成失败，已返回回退说明。",
-                    "ai_used": False,
-                    "source": "mock" if ALLOW_MOCK_ON_AI_ERROR else "error",
-                    "error": ai_result.get("error"),
-                }
-            ), status_code
+@app.route("/api/process/url", methods=["POST"])
+@rate_limited("url")
+@routed("url")
+@idempotent
+@fair_scheduled
+def process_url():
+    return _run_guide_pipeline("url")
 
-        return jsonify(
-            {
-                "success": True,
-                "steps": steps,
-                "title": title,
-                "summary": summary,
-                "estimated_time": estimated_time,
-                "difficulty": difficulty,
-                "prerequisites": prerequisites,
-                "common_mistakes": common_mistakes,
-                "final_check": final_check,
-                "text": text,
-                "scenario": "general",
-                "message": "文本处理完成。",
-                "ai_used": ai_used,
-                "source": source,
-                "error": ai_result.get("error"),
-            }
-        )
 
-    except Exception as exc:
-        logger.exception("Error in /api/process/text")
-        return jsonify({"success": False, "error": f"处理文本失败: {exc}"}), 500
+@app.route("/api/process/text", methods=["POST"])
+@rate_limited("text")
+@routed("text")
+@idempotent
+@fair_scheduled
+def process_text():
+    return _run_guide_pipeline("text")
 
 
 @app.route("/api/community/guides", methods=["GET"])
 def get_community_guides():
-    guides = [
-        {
-            "id": 1,
-            "title": "WeChat Moments Quick Guide",
-            "author": "UserA",
-            "likes": 42,
-            "steps": 3,
-            "created_at": "2026-01-15",
-            "scenario": "social",
-        },
-        {
-            "id": 2,
-            "title": "Course Selection Steps",
-            "author": "UserB",
-            "likes": 28,
-            "steps": 4,
-            "created_at": "2026-01-20",
-            "scenario": "education",
-        },
-    ]
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), COMMUNITY_PAGE_SIZE_MAX)
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid limit."}), 400
 
-    return jsonify(
+    try:
+        store = _get_community_store()
+        # Any write bumps the revision, so (revision, query) identifies the page.
+        revision = store.revision()
+        etag = hashlib.sha1(f"{revision}|{request.query_string.decode('latin-1')}".encode("utf-8")).hexdigest()
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        guides, next_cursor = store.list(
+            scenario=(request.args.get("scenario") or "").strip() or None,
+            sort=request.args.get("sort", "recent"),
+            limit=limit,
+            cursor=request.args.get("cursor") or None,
+            query=(request.args.get("q") or "").strip() or None,
+        )
+    except ValueError as exc:
+        return jsonify({"success": False, "error": str(exc)}), 400
+    except Exception as exc:
+        logger.exception("Error in /api/community/guides")
+        return jsonify({"success": False, "error": f"Failed to list guides: {exc}"}), 500
+
+    response = jsonify(
         {
             "success": True,
             "guides": guides,
-            "total": len(guides),
+            "count": len(guides),
+            "next_cursor": next_cursor,
             "message": "Community guides.",
         }
     )
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.route("/api/community/guides/<share_id>", methods=["GET"])
+def get_shared_guide(share_id: str):
+    if len(share_id) != SHARE_ID_LENGTH or share_id.strip("0123456789abcdef"):
+        return jsonify({"success": False, "error": "Guide not found."}), 404
+
+    # The id is the content hash: a client holding any tag for it is up to date.
+    if any(request.if_none_match.contains_weak(tag) for tag in etag_variants(share_id)):
+        response = Response(status=304)
+        response.set_etag(share_id)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    body = _snapshot_cache.get(share_id)
+    if body is None:
+        try:
+            snapshot = _get_community_store().snapshot(share_id)
+        except Exception as exc:
+            logger.exception("Error in /api/community/guides/<share_id>")
+            return jsonify({"success": False, "error": f"Failed to load guide: {exc}"}), 500
+        if snapshot is None:
+            return jsonify({"success": False, "error": "Guide not found."}), 404
+        # Serialized once; the stored canonical JSON is spliced in as-is.
+        body = PrecompressedBody(f'{{"success":true,"share_id":"{share_id}","guide":{snapshot}}}\n'.encode("utf-8"))
+        _snapshot_cache.put(share_id, body)
+
+    response = app.response_class(body.data, mimetype="application/json")
+    response.precompressed = body
+    response.set_etag(share_id)
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
 
 
 @app.route("/api/community/share", methods=["POST"])
+@rate_limited("share", error="Too many requests, please retry later.")
 def share_to_community():
     try:
         data = request.get_json(silent=True) or {}
         if "title" not in data or "steps" not in data:
             return jsonify({"success": False, "error": "Missing title or steps."}), 400
+        if not isinstance(data["steps"], list):
+            return jsonify({"success": False, "error": "steps must be a list."}), 400
 
+        guide = {
+            key: data[key]
+            for key in ("title", "summary", "steps", "scenario", "author", "estimated_time", "difficulty")
+            if key in data
+        }
+        record = _get_community_store().add(guide)
         return jsonify(
             {
                 "success": True,
-                "message": "Shared successfully.",
-                "share_id": uuid.uuid4().hex,
+                "message": "Shared successfully." if record["created"] else "Already shared.",
+                "share_id": record["share_id"],
+                "id": record["id"],
+                "url": f"/api/community/guides/{record['share_id']}",
             }
         )
 
@@ -516,11 +1567,78 @@ def test_ai_connection():
             }
         ), 503
 
-    result = service.test_connection()
+    if _parse_bool(request.args.get("live"), False):
+        # Explicit opt-in: a real completion call that spends quota and blocks this thread.
+        result = service.test_connection()
+    else:
+        prober = _get_prober()
+        result = prober.snapshot() if prober is not None else {"success": False, "status": "pending"}
+
     status_code = 200 if result.get("success") else 503
     return jsonify(result), status_code
 
 
+@app.route("/api/metrics", methods=["GET"])
+def metrics():
+    return Response(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def debug_only(view: Callable[..., Any]) -> Callable[..., Any]:
+    """Refuse ``view`` (403) unless the caller has ``PROFILER_TOKEN``, or is local when none is set.
+
+    A request that came through a proxy is not treated as local even from
+    127.0.0.1, since the proxy may be relaying anyone.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if PROFILER_TOKEN:
+            token = request.headers.get(PROFILER_TOKEN_HEADER) or ""
+            allowed = bool(token) and hmac.compare_digest(token.encode("utf-8"), PROFILER_TOKEN.encode("utf-8"))
+        else:
+            try:
+                allowed = ipaddress.ip_address(request.remote_addr or "").is_loopback
+            except ValueError:
+                allowed = False
+            allowed = allowed and not any(
+                name in request.headers for name in ("X-Forwarded-For", "X-Real-IP", "Forwarded")
+            )
+        if not allowed:
+            return jsonify({"success": False, "error": "无权访问性能分析记录。"}), 403
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+@app.route("/api/debug/profiles", methods=["GET"])
+@debug_only
+def list_profiles():
+    if _profile_store is None:
+        return jsonify({"success": False, "error": "性能分析未启用（PROFILER_ENABLED）。"}), 404
+
+    profiles = _profile_store.list()
+    return jsonify({"success": True, "profiles": profiles, "total": len(profiles)})
+
+
+@app.route("/api/debug/profiles/<profile_id>", methods=["GET"])
+@debug_only
+def download_profile(profile_id: str):
+    if _profile_store is None:
+        return jsonify({"success": False, "error": "性能分析未启用（PROFILER_ENABLED）。"}), 404
+
+    record = _profile_store.load(profile_id)
+    if record is None:
+        return jsonify({"success": False, "error": "未找到该性能分析记录。"}), 404
+
+    if request.args.get("format") == "collapsed":
+        return Response(
+            render_collapsed(record.get("stacks") or {}),
+            content_type="text/plain; charset=utf-8",
+            headers={"Content-Disposition": f"attachment; filename={profile_id}.collapsed.txt"},
+        )
+    return jsonify({"success": True, "profile": record})
+
+
 @app.route("/api/info", methods=["GET"])
 def api_info():
     return jsonify(
@@ -531,14 +1649,21 @@ def api_info():
             "endpoints": {
                 "GET": [
                     "/api/health",
+                    "/api/ready",
                     "/api/community/guides",
+                    "/api/community/guides/<share_id>",
+                    "/api/sessions/<session_id>/render",
+                    "/api/renders/<render_id>/<name>.<format>",
                     "/api/test/ai",
                     "/api/info",
+                    "/api/metrics",
+                    "/api/debug/profiles",
                 ],
                 "POST": [
                     "/api/process/image",
                     "/api/process/url",
                     "/api/process/text",
+                    "/api/process/refine",
                     "/api/community/share",
                 ],
             },
@@ -547,5 +1672,6 @@ def api_info():
 
 
 if __name__ == "__main__":
-    logger.info("Starting GuideBot backend on http://localhost:5000")
+    logger.info("Starting GuideBot backend on http://localhost:5000 (development server; use serve.py in production)")
+    threading.Thread(target=warm_up, name="guidebot-warmup", daemon=True).start()
     app.run(debug=False, port=5000, host="0.0.0.0", use_reloader=False)
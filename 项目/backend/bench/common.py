@@ -0,0 +1,165 @@
+"""Helpers shared by the benchmark and load-test scripts in this directory."""
+
+from __future__ import annotations
+
+import base64
+import math
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import time
+import tracemalloc
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_png(width: int, height: int, seed: int = 0) -> bytes:
+    """Encode a noisy RGB PNG, roughly the size of a real screenshot of that resolution."""
+    rng = random.Random(seed)
+    row_bytes = width * 3
+    raw = bytearray()
+    flat_row = bytes([0xF0, 0xF0, 0xF0]) * width
+    for _ in range(height):
+        raw.append(0)
+        # Mix flat background rows with noisy "content" rows so zlib lands near real screenshots.
+        raw.extend(rng.randbytes(row_bytes) if rng.random() < 0.5 else flat_row)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(bytes(raw), 6)) + chunk(b"IEND", b"")
+
+
+def png_data_url(png: bytes) -> str:
+    return f"data:image/png;base64,{base64.b64encode(png).decode('ascii')}"
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(math.ceil(pct / 100.0 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def latency_summary(values: Sequence[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(max(values) * 1000, 2) if values else 0.0,
+    }
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_http(url: str, timeout_seconds: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout_seconds
+    last_error: Optional[Exception] = None
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1.0)
+            return
+        except requests.RequestException as exc:
+            last_error = exc
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout_seconds}s: {last_error}")
+
+
+def dev_server_command(port: int) -> List[str]:
+    """Run ``app.app`` on Werkzeug's threaded dev server, as ``python app.py`` does."""
+    code = (
+        "from werkzeug.serving import run_simple; import app; "
+        f"run_simple('127.0.0.1', {port}, app.app, threaded=True)"
+    )
+    return [sys.executable, "-c", code]
+
+
+def spawn_backend(command: List[str], port: int, env: Dict[str, str]) -> subprocess.Popen:
+    """Start a GuideBot backend subprocess from the backend directory and wait until it answers.
+
+    Per-client limits are off unless ``env`` turns them on: every benchmark
+    request comes from one address and would otherwise be throttled.
+    """
+    full_env = dict(os.environ)
+    full_env.update({"RATE_LIMIT_ENABLED": "false", "FAIR_SCHEDULER_ENABLED": "false"})
+    full_env.update(env)
+    proc = subprocess.Popen(
+        command,
+        cwd=BACKEND_DIR,
+        env=full_env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_http(f"http://127.0.0.1:{port}/api/info")
+    except Exception:
+        proc.kill()
+        raise
+    return proc
+
+
+def stop_backend(proc: subprocess.Popen, timeout_seconds: float = 10.0) -> None:
+    proc.terminate()
+    try:
+        proc.wait(timeout=timeout_seconds)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def measure_ops(func: Callable[[], Any], min_seconds: float = 0.2, repeats: int = 5) -> float:
+    """Best-of-``repeats`` calls per second, with the loop count calibrated to ``min_seconds``."""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds or loops >= 1 << 24:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, min(int(min_seconds / elapsed) + 1, 16))
+    best = elapsed
+    for _ in range(repeats - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, time.perf_counter() - started)
+    return loops / best if best > 0 else float("inf")
+
+
+def measure_alloc(func: Callable[[], Any], calls: int = 50) -> Dict[str, float]:
+    """Average traced allocation per call: peak bytes held and blocks left behind."""
+    func()
+    tracemalloc.start()
+    try:
+        peak_total = 0
+        tracemalloc.clear_traces()
+        before_blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+        results = []
+        for _ in range(calls):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            results.append(func())
+            _, peak = tracemalloc.get_traced_memory()
+            peak_total += peak - current
+        after_blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    finally:
+        tracemalloc.stop()
+    return {
+        "peak_bytes": round(peak_total / calls, 1),
+        "retained_blocks": round((after_blocks - before_blocks) / calls, 2),
+    }
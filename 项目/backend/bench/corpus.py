@@ -0,0 +1,66 @@
+"""Representative model outputs for the parsing/normalization micro-benchmarks.
+
+The shapes mirror what ``_parse_ai_response`` sees in practice: bare JSON,
+Markdown-fenced JSON, JSON followed by chatty prose, output cut off by
+``max_tokens`` and OpenAI "content parts" lists.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List
+
+
+def guide(step_count: int = 5) -> Dict[str, Any]:
+    steps: List[Dict[str, Any]] = []
+    for index in range(1, step_count + 1):
+        steps.append(
+            {
+                "step": index,
+                "title": f"打开设置第{index}项",
+                "description": f"在页面右上角找到“设置”图标并点击，进入第{index}个配置区域，确认标题栏显示对应名称后继续。",
+                "purpose": "进入正确的配置入口，避免误改其他选项。",
+                "expected_result": "页面切换到设置详情，显示可编辑的表单。",
+                "tip": "可以使用快捷键 Ctrl+, 直接打开设置。",
+                "warning": "修改前建议先截图保存原配置。",
+                "rect": {"x": 620 - index * 40, "y": 40 + index * 60, "width": 140, "height": 44},
+                "color": "#ff0000",
+            }
+        )
+    return {
+        "title": "修改账户通知设置",
+        "summary": "本指引帮助你在账户设置中调整通知方式。适合第一次使用该产品的用户，完成后只会收到重要提醒。",
+        "estimated_time": "约5分钟",
+        "difficulty": "初级",
+        "prerequisites": ["已登录账号。", "网络连接稳定。"],
+        "steps": steps,
+        "common_mistakes": ["修改后忘记点击保存。", "误关闭了安全提醒。"],
+        "final_check": ["通知设置页显示新配置。", "收到一条测试通知。"],
+    }
+
+
+def legacy_step_list() -> List[Dict[str, Any]]:
+    """Older prompt style: a bare array using alternate field names."""
+    return [
+        {"name": "Open settings", "action": "Click the gear icon", "target": "top right", "result": "Settings open"},
+        {"step_title": "选择通知", "instruction": "点击左侧“通知”菜单", "note": "位于第三项"},
+        {"title": "保存", "content": "点击页面底部的保存按钮", "risk": "未保存会丢失修改"},
+    ]
+
+
+def build_corpus() -> Dict[str, Any]:
+    clean = json.dumps(guide(), ensure_ascii=False)
+    pretty = json.dumps(guide(), ensure_ascii=False, indent=2)
+    return {
+        "clean": clean,
+        "fenced": f"```json\n{pretty}\n```",
+        "trailing_prose": f"好的，以下是为你生成的操作引导：\n{clean}\n\n希望这些步骤对你有帮助，如有问题随时告诉我！",
+        "truncated": clean[: int(len(clean) * 0.8)],
+        "content_parts": [
+            {"type": "text", "text": "```json"},
+            {"type": "text", "text": pretty},
+            {"type": "text", "text": "```"},
+        ],
+        "legacy_array": json.dumps(legacy_step_list(), ensure_ascii=False),
+        "large": json.dumps(guide(step_count=12), ensure_ascii=False),
+    }
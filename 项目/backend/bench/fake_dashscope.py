@@ -0,0 +1,423 @@
+"""Local stand-in for the DashScope OpenAI-compatible ``/chat/completions`` API.
+
+Serves well-formed guide JSON by default and can inject latency, 429/5xx
+responses, truncated HTTP bodies, malformed model output and SSE streaming, plus
+per-API-key rate limits and invalid keys, so GuideBot can be exercised without
+network access or API quota:
+
+    python -m bench.fake_dashscope --port 8001 --latency lognormal:0.8,0.4 --rate-429 0.05
+    DASHSCOPE_BASE_URL=http://127.0.0.1:8001/v1 DASHSCOPE_API_KEY=fake python app.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """Build a latency sampler (seconds) from ``kind:args``.
+
+    ``fixed:0.5``, ``uniform:0.2,1.5``, ``normal:0.8,0.2``, ``lognormal:0.8,0.4``
+    (median seconds, sigma) and ``exp:0.6`` (mean seconds) are supported.
+    """
+    kind, _, raw_args = (spec or "fixed:0").partition(":")
+    args = [float(item) for item in raw_args.split(",") if item.strip()] or [0.0]
+    kind = kind.strip().lower()
+
+    if kind == "fixed":
+        return lambda rng: max(args[0], 0.0)
+    if kind == "uniform":
+        low, high = args[0], args[1] if len(args) > 1 else args[0]
+        return lambda rng: max(rng.uniform(low, high), 0.0)
+    if kind == "normal":
+        mean, stddev = args[0], args[1] if len(args) > 1 else 0.0
+        return lambda rng: max(rng.gauss(mean, stddev), 0.0)
+    if kind == "lognormal":
+        median, sigma = args[0], args[1] if len(args) > 1 else 0.5
+        mu = math.log(max(median, 1e-6))
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    if kind == "exp":
+        mean = max(args[0], 1e-6)
+        return lambda rng: rng.expovariate(1.0 / mean)
+    raise ValueError(f"unknown latency distribution: {spec}")
+
+
+class FakeUpstreamConfig:
+    def __init__(
+        self,
+        latency: str = "fixed:0",
+        rate_429: float = 0.0,
+        rate_5xx: float = 0.0,
+        rate_truncated: float = 0.0,
+        rate_malformed: float = 0.0,
+        retry_after_seconds: float = 1.0,
+        stream_chunk_delay_seconds: float = 0.01,
+        seed: Optional[int] = None,
+        per_key_rps: float = 0.0,
+        per_key_burst: int = 1,
+        invalid_keys: Sequence[str] = (),
+    ):
+        self.latency = latency
+        self.sample_latency = parse_latency(latency)
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.rate_truncated = rate_truncated
+        self.rate_malformed = rate_malformed
+        self.retry_after_seconds = retry_after_seconds
+        self.stream_chunk_delay_seconds = stream_chunk_delay_seconds
+        self.seed = seed
+        # Token bucket per Authorization key (0 = unlimited), like DashScope's per-key QPS quota.
+        self.per_key_rps = per_key_rps
+        self.per_key_burst = max(per_key_burst, 1)
+        self.invalid_keys = frozenset(invalid_keys)
+
+
+def _guide_for(prompt: str, rng: random.Random) -> Dict[str, Any]:
+    step_count = rng.randint(4, 6)
+    steps: List[Dict[str, Any]] = []
+    for index in range(1, step_count + 1):
+        steps.append(
+            {
+                "step": index,
+                "title": f"第{index}步：定位操作入口",
+                "description": f"在页面中找到第{index}个关键按钮并点击，确认界面出现对应的下一步内容后再继续操作。",
+                "purpose": "确保流程按顺序推进，避免遗漏关键环节。",
+                "expected_result": "页面出现新的输入区域或确认提示。",
+                "tip": "如果找不到按钮，可以先向下滚动页面。",
+                "warning": "提交前请核对输入内容。",
+                "rect": {
+                    "x": rng.randint(0, 700),
+                    "y": rng.randint(0, 500),
+                    "width": rng.randint(60, 240),
+                    "height": rng.randint(24, 60),
+                },
+                "color": rng.choice(["#ff0000", "#00aa00", "#0000ff", "#ff8800"]),
+            }
+        )
+    return {
+        "title": "本地模拟操作引导",
+        "summary": f"这是由本地模拟上游生成的引导，输入长度 {len(prompt)} 字。按步骤完成即可验证流程。",
+        "estimated_time": "约5分钟",
+        "difficulty": "初级",
+        "prerequisites": ["确认网络连接稳定。", "准备好登录账号。"],
+        "steps": steps,
+        "common_mistakes": ["跳过确认步骤。", "输入信息后未提交。"],
+        "final_check": ["目标页面已打开。", "操作结果已生效。"],
+    }
+
+
+def _refinement_for(prompt: str, rng: random.Random) -> Dict[str, Any]:
+    """Answer a refine prompt the way the real model is asked to: only the affected steps."""
+    step = _guide_for(prompt, rng)["steps"][0]
+    step.update(
+        step=rng.randint(1, 3),
+        title="按新要求调整的步骤",
+        description="按照用户的新要求，改为点击页面中的对应选项，并确认界面已切换到所选方式后再继续。",
+    )
+    return {"steps": [step], "removed_steps": []}
+
+
+def _prompt_text(payload: Dict[str, Any]) -> str:
+    parts: List[str] = []
+    for message in payload.get("messages") or []:
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(str(item.get("text", "")) for item in content if isinstance(item, dict))
+    return "\n".join(parts)
+
+
+class FakeDashScopeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: Tuple[str, int], config: FakeUpstreamConfig):
+        super().__init__(address, _FakeDashScopeHandler)
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.rng_lock = threading.Lock()
+        self.stats: Dict[str, int] = {}
+        self.key_stats: Dict[str, Dict[str, int]] = {}
+        self.stats_lock = threading.Lock()
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, outcome: str, key: Optional[str] = None) -> None:
+        with self.stats_lock:
+            self.stats[outcome] = self.stats.get(outcome, 0) + 1
+            if key is not None:
+                per_key = self.key_stats.setdefault(key, {})
+                per_key[outcome] = per_key.get(outcome, 0) + 1
+
+    def take_token(self, key: str) -> float:
+        """Consume one request from ``key``'s bucket; returns 0, or seconds until a token is free."""
+        rate = self.config.per_key_rps
+        if rate <= 0:
+            return 0.0
+        burst = float(self.config.per_key_burst)
+        now = time.monotonic()
+        with self.stats_lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1.0:
+                self._buckets[key] = (tokens - 1.0, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (1.0 - tokens) / rate
+
+    def roll(self) -> Tuple[str, float, random.Random]:
+        """Pick an outcome and latency; returns a per-request RNG for content."""
+        cfg = self.config
+        with self.rng_lock:
+            draw = self.rng.random()
+            latency = cfg.sample_latency(self.rng)
+            local_rng = random.Random(self.rng.random())
+
+        outcome = "ok"
+        for name, rate in (
+            ("429", cfg.rate_429),
+            ("5xx", cfg.rate_5xx),
+            ("truncated", cfg.rate_truncated),
+            ("malformed", cfg.rate_malformed),
+        ):
+            if draw < rate:
+                outcome = name
+                break
+            draw -= rate
+        return outcome, latency, local_rng
+
+
+class _FakeDashScopeHandler(BaseHTTPRequestHandler):
+    server: FakeDashScopeServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002 - stdlib signature
+        return
+
+    def _send_json(self, status: int, body: bytes, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, b'{"object":"list","data":[{"id":"qwen-vl-max","object":"model"}]}')
+            return
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.server.stats_lock:
+                body = json.dumps(dict(self.server.stats, keys=self.server.key_stats)).encode("utf-8")
+            self._send_json(200, body)
+            return
+        self._send_json(404, b'{"error":"not found"}')
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, b'{"error":"not found"}')
+            return
+        try:
+            payload = json.loads(raw or b"{}")
+        except ValueError:
+            self.server.count("bad_request")
+            self._send_json(400, b'{"error":{"message":"invalid json"}}')
+            return
+
+        cfg = self.server.config
+        api_key = (self.headers.get("Authorization") or "").partition(" ")[2].strip()
+        if api_key in cfg.invalid_keys:
+            self.server.count("401", api_key)
+            self._send_json(401, b'{"error":{"code":"InvalidApiKey","message":"Invalid API-key provided."}}')
+            return
+        wait = self.server.take_token(api_key)
+        if wait > 0:
+            self.server.count("429_key", api_key)
+            self._send_json(
+                429,
+                b'{"error":{"code":"Throttling.RateQuota","message":"Requests rate limit exceeded for this key"}}',
+                {"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+            return
+
+        outcome, latency, rng = self.server.roll()
+        self.server.count(outcome, api_key)
+        stream = bool(payload.get("stream"))
+
+        if not stream or outcome in {"429", "5xx"}:
+            time.sleep(latency)
+
+        if outcome == "429":
+            self._send_json(
+                429,
+                b'{"error":{"code":"Throttling.RateQuota","message":"Requests rate limit exceeded"}}',
+                {"Retry-After": f"{cfg.retry_after_seconds:g}"},
+            )
+            return
+        if outcome == "5xx":
+            status = rng.choice([500, 502, 503])
+            self._send_json(status, b'{"error":{"code":"InternalError","message":"fake upstream failure"}}')
+            return
+
+        prompt = _prompt_text(payload)
+        if outcome == "malformed":
+            content = "好的，下面是为你生成的操作引导：\n```json\n{\"title\": \"未完成的引导\", \"steps\": [{\"step\": 1, \"description\": \"点击"
+        elif "removed_steps" in prompt:
+            content = json.dumps(_refinement_for(prompt, rng), ensure_ascii=False)
+        else:
+            content = json.dumps(_guide_for(prompt, rng), ensure_ascii=False)
+
+        usage = {
+            "prompt_tokens": max(len(prompt) // 2, 1),
+            "completion_tokens": max(len(content) // 2, 1),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:16]}"
+        model = payload.get("model") or "qwen-vl-max"
+
+        if stream:
+            self._stream(completion_id, model, content, usage, latency, cfg.stream_chunk_delay_seconds)
+            return
+
+        body = json.dumps(
+            {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                ],
+                "usage": usage,
+            },
+            ensure_ascii=False,
+        ).encode("utf-8")
+
+        if outcome == "truncated":
+            # Advertise the full length but close after half of the body.
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[: len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+
+        self._send_json(200, body)
+
+    def _stream(
+        self,
+        completion_id: str,
+        model: str,
+        content: str,
+        usage: Dict[str, int],
+        first_token_seconds: float,
+        chunk_delay_seconds: float,
+    ) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        time.sleep(first_token_seconds)
+        for offset in range(0, len(content), 32):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": content[offset : offset + 32]}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if chunk_delay_seconds:
+                time.sleep(chunk_delay_seconds)
+
+        final = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+        self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+
+def start_fake_server(
+    config: FakeUpstreamConfig, host: str = "127.0.0.1", port: int = 0
+) -> Tuple[FakeDashScopeServer, threading.Thread]:
+    """Start the stand-in on a daemon thread; ``port=0`` picks a free port."""
+    server = FakeDashScopeServer((host, port), config)
+    thread = threading.Thread(target=server.serve_forever, name="fake-dashscope", daemon=True)
+    thread.start()
+    return server, thread
+
+
+def add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency", default="lognormal:0.8,0.4", help="fixed:S | uniform:A,B | normal:M,SD | lognormal:MEDIAN,SIGMA | exp:MEAN")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="fraction of requests answered with 500/502/503")
+    parser.add_argument("--rate-truncated", type=float, default=0.0, help="fraction of 200 bodies cut in half")
+    parser.add_argument("--rate-malformed", type=float, default=0.0, help="fraction of 200s whose content is not valid guide JSON")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429")
+    parser.add_argument("--stream-chunk-delay", type=float, default=0.01, help="seconds between SSE chunks")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--per-key-rps", type=float, default=0.0, help="requests/sec allowed per API key (0 = unlimited)")
+    parser.add_argument("--per-key-burst", type=int, default=1, help="bucket size for --per-key-rps")
+    parser.add_argument("--invalid-keys", default="", help="comma-separated API keys answered with 401")
+
+
+def config_from_args(args: argparse.Namespace) -> FakeUpstreamConfig:
+    return FakeUpstreamConfig(
+        latency=args.latency,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        rate_truncated=args.rate_truncated,
+        rate_malformed=args.rate_malformed,
+        retry_after_seconds=args.retry_after,
+        stream_chunk_delay_seconds=args.stream_chunk_delay,
+        seed=args.seed,
+        per_key_rps=args.per_key_rps,
+        per_key_burst=args.per_key_burst,
+        invalid_keys=[item.strip() for item in args.invalid_keys.split(",") if item.strip()],
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeDashScopeServer((args.host, args.port), config_from_args(args))
+    print(f"Fake DashScope listening on {server.base_url} (latency={args.latency})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Per-response cost of building and serializing a guide: nested dicts versus ``Guide``/``Step``.
+
+``dicts`` replays what the handlers did before the typed model: normalize
+every step into a dict, copy each guide field into a response payload dict,
+then encode it (orjson when installed, as ``_TimedJSONProvider`` does).
+``typed`` normalizes into ``Guide``/``Step`` in one pass and serializes with
+``Guide.to_json``. Both run over the same decoded model reply, for a
+standard and a large guide, with and without orjson:
+
+    python -m bench.guide_encode
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bench.common import measure_alloc, measure_ops
+from bench.corpus import guide
+from utils import guide_model
+from utils.guide_model import GUIDE_FIELDS, Guide, build_chinese_description, get_text_field, normalize_string_list
+
+EXTRA = {
+    "success": True,
+    "image_sha256": "0" * 64,
+    "message": "图片分析完成。",
+    "ai_used": True,
+    "source": "ai",
+    "error": None,
+    "note": "",
+}
+
+
+def legacy_normalize_guide(data: Dict[str, Any]) -> Dict[str, Any]:
+    """The dict-based ``_normalize_guide``/``_normalize_steps`` the typed model replaced."""
+    steps: List[Dict[str, Any]] = []
+    for index, item in enumerate(data.get("steps", []), start=1):
+        rect = item.get("rect") or {}
+        step_num = item.get("step") if isinstance(item.get("step"), int) else index
+        color = item.get("color")
+        if not isinstance(color, str) or not color.strip():
+            color = "#ff0000"
+        steps.append(
+            {
+                "step": step_num,
+                "title": get_text_field(item, ["title", "name", "step_title"]) or f"步骤 {step_num}",
+                "description": build_chinese_description(item, step_num),
+                "purpose": get_text_field(item, ["purpose", "goal", "reason"]),
+                "expected_result": get_text_field(item, ["expected_result", "result", "outcome"]),
+                "tip": get_text_field(item, ["tip", "note"]),
+                "warning": get_text_field(item, ["warning", "risk", "caution"]),
+                "rect": {
+                    "x": int(rect.get("x", 0) or 0),
+                    "y": int(rect.get("y", 0) or 0),
+                    "width": int(rect.get("width", 120) or 120),
+                    "height": int(rect.get("height", 40) or 40),
+                },
+                "color": color.strip(),
+            }
+        )
+    guide_dict: Dict[str, Any] = {"steps": steps}
+    for field in ("title", "summary", "estimated_time", "difficulty"):
+        value = data.get(field)
+        guide_dict[field] = value.strip() if isinstance(value, str) and value.strip() else None
+    for field in ("prerequisites", "common_mistakes", "final_check"):
+        guide_dict[field] = normalize_string_list(data.get(field))
+    return guide_dict
+
+
+def dict_pipeline(raw: Dict[str, Any], use_orjson: bool) -> bytes:
+    normalized = legacy_normalize_guide(raw)
+    # _guide_from_content copied the normalized guide into the result dict...
+    result = {field: normalized.get(field) for field in GUIDE_FIELDS}
+    result.update(success=True, ai_used=True, source="ai", error=None)
+    # ...and the handler copied every field again into the response payload.
+    payload = {
+        "success": True,
+        "steps": result.get("steps") or [],
+        "title": result.get("title") or "操作引导",
+        "summary": result.get("summary") or "请按以下步骤依次完成操作。",
+        "estimated_time": result.get("estimated_time") or "约3分钟",
+        "difficulty": result.get("difficulty") or "初级",
+        "prerequisites": result.get("prerequisites") or [],
+        "common_mistakes": result.get("common_mistakes") or [],
+        "final_check": result.get("final_check") or [],
+        **EXTRA,
+    }
+    if use_orjson:
+        return guide_model.orjson.dumps(payload, option=guide_model.orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(payload, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def typed_pipeline(raw: Dict[str, Any]) -> bytes:
+    return Guide.from_raw(raw).to_json(EXTRA)
+
+
+def build_cases() -> List[Tuple[str, Callable[[], Any], Optional[Any]]]:
+    cases: List[Tuple[str, Callable[[], Any], Optional[Any]]] = []
+    orjson_modes = [True, False] if guide_model.orjson is not None else [False]
+    for size_name, raw in (("standard", guide()), ("large", guide(step_count=12))):
+        for use_orjson in orjson_modes:
+            encoder = "orjson" if use_orjson else "stdlib"
+            # ``typed`` picks its encoder from the module global, so swap it per case.
+            module_orjson = guide_model.orjson if use_orjson else None
+            cases.append((f"dicts[{size_name},{encoder}]", lambda raw=raw, o=use_orjson: dict_pipeline(raw, o), None))
+            cases.append((f"typed[{size_name},{encoder}]", lambda raw=raw: typed_pipeline(raw), module_orjson))
+    return cases
+
+
+def run(min_seconds: float, repeats: int) -> Dict[str, Dict[str, float]]:
+    results: Dict[str, Dict[str, float]] = {}
+    saved = guide_model.orjson
+    try:
+        for name, func, module_orjson in build_cases():
+            guide_model.orjson = module_orjson if name.startswith("typed") else saved
+            ops = measure_ops(func, min_seconds=min_seconds, repeats=repeats)
+            results[name] = dict(us_per_response=round(1e6 / ops, 2), bytes=len(func()), **measure_alloc(func))
+    finally:
+        guide_model.orjson = saved
+    return results
+
+
+def format_results(results: Dict[str, Dict[str, float]]) -> str:
+    lines = [f"{'case':<28}{'us/resp':>10}{'bytes':>8}{'peak B':>10}{'blocks':>9}"]
+    for name, row in results.items():
+        lines.append(
+            f"{name:<28}{row['us_per_response']:>10.2f}{row['bytes']:>8}"
+            f"{row['peak_bytes']:>10.0f}{row['retained_blocks']:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Guide normalize+serialize cost: dicts vs typed model")
+    parser.add_argument("--min-seconds", type=float, default=0.2)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = run(args.min_seconds, args.repeats)
+    print(json.dumps(results, indent=2) if args.json else format_results(results))
+
+
+if __name__ == "__main__":
+    main()
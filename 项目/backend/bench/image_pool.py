@@ -0,0 +1,85 @@
+"""Per-endpoint latency with upload decoding on the request threads versus in the image process pool.
+
+Starts one fake upstream and, for each mode, a backend with
+``IMAGE_POOL_WORKERS=0`` (``inline``) or sized from the CPU count (``pool``),
+then drives a mix of large screenshot uploads and cheap text/url requests at a
+fixed rate. Text and url latency show how much the image work stalls everyone
+else through the GIL:
+
+    python -m bench.image_pool --rps 20 --duration 20 --image-size 2560x1600 --mix image:1,text:2,url:1
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from typing import Any, Dict
+
+from bench.common import dev_server_command, free_port, spawn_backend, stop_backend
+from bench.fake_dashscope import add_config_arguments, config_from_args, start_fake_server
+from bench.loadtest import format_report, parse_mix, run_load
+
+MODES = ("inline", "pool")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Upload decoding inline vs in the image process pool")
+    parser.add_argument("--rps", type=float, default=20.0)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--mix", default="image:1,text:2,url:1")
+    parser.add_argument("--max-in-flight", type=int, default=128)
+    parser.add_argument("--image-size", default="2560x1600")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="pool size for the 'pool' mode")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--json", action="store_true")
+    add_config_arguments(parser)
+    parser.set_defaults(latency="fixed:0.3")
+    args = parser.parse_args()
+
+    width, height = (int(part) for part in args.image_size.lower().split("x"))
+    upstream, _ = start_fake_server(config_from_args(args))
+    base_env = {
+        "DASHSCOPE_BASE_URL": upstream.base_url,
+        "DASHSCOPE_API_KEY": "fake-key",
+        "AI_CASSETTE_MODE": "off",
+        # Every request goes through the lanes; keep them out of the comparison.
+        "AI_LANE_IMAGE_SLOTS": "256",
+        "AI_LANE_TEXT_SLOTS": "256",
+        "AI_LANE_URL_SLOTS": "256",
+        "RESPONSE_IMAGE_MODE": "hash",
+    }
+
+    reports: Dict[str, Any] = {}
+    try:
+        for mode in [item.strip() for item in args.modes.split(",") if item.strip()]:
+            if mode not in MODES:
+                raise SystemExit(f"unknown mode: {mode}")
+            port = free_port()
+            env = dict(base_env, IMAGE_POOL_WORKERS="0" if mode == "inline" else str(args.workers))
+            proc = spawn_backend(dev_server_command(port), port, env)
+            try:
+                reports[mode] = run_load(
+                    f"http://127.0.0.1:{port}",
+                    args.rps,
+                    args.duration,
+                    parse_mix(args.mix),
+                    max_in_flight=args.max_in_flight,
+                    image_size=(width, height),
+                )
+            finally:
+                stop_backend(proc, timeout_seconds=30)
+    finally:
+        upstream.shutdown()
+
+    if args.json:
+        print(json.dumps(reports, ensure_ascii=False, indent=2))
+        return
+    for mode, report in reports.items():
+        print(f"== {mode} ==")
+        print(format_report(report))
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Upstream throughput with one API key versus a pool of keys.
+
+Runs ``QwenVLService.analyze_text`` from ``--threads`` closed-loop workers
+against the local fake upstream, which rate-limits every key to
+``--per-key-rps``. Each configuration gets a fresh service whose
+``DASHSCOPE_API_KEYS`` holds 1, then ``--keys`` keys (plus an invalid one
+with ``--with-invalid-key``, to show it being disabled after its first 401):
+
+    python -m bench.key_pool --keys 4 --per-key-rps 5 --threads 16 --duration 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List
+
+from bench.common import latency_summary
+from bench.fake_dashscope import FakeUpstreamConfig, start_fake_server
+
+INVALID_KEY = "bench-invalid-key-0000"
+
+
+def run_config(base_url: str, keys: List[str], args: argparse.Namespace) -> Dict[str, Any]:
+    os.environ.update(
+        {
+            "DASHSCOPE_BASE_URL": base_url,
+            "DASHSCOPE_API_KEY": "",
+            "DASHSCOPE_API_KEYS": ",".join(keys),
+            "AI_ALLOW_MOCK_FALLBACK": "false",
+            "AI_REQUEST_RETRIES": str(args.retries),
+            "AI_REQUEST_RETRY_BACKOFF_SECONDS": "0.1",
+            "AI_CASSETTE_MODE": "off",
+        }
+    )
+    from utils.ai_service import QwenVLService
+
+    service = QwenVLService()
+    latencies: List[float] = []
+    outcomes: Dict[str, int] = {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def worker(index: int) -> None:
+        local: List[float] = []
+        local_outcomes: Dict[str, int] = {}
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            result = service.analyze_text(f"如何在设置中修改密码 #{index}")
+            outcome = "ok" if result.get("success") else "failed"
+            local_outcomes[outcome] = local_outcomes.get(outcome, 0) + 1
+            if outcome == "ok":
+                local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+            for key, value in local_outcomes.items():
+                outcomes[key] = outcomes.get(key, 0) + value
+
+    started = time.monotonic()
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(args.threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.monotonic() - started
+    return dict(
+        latency_summary(latencies),
+        ok_per_second=round(outcomes.get("ok", 0) / elapsed, 2),
+        outcomes=outcomes,
+        keys=service.key_pool.snapshot(),
+    )
+
+
+def format_report(reports: Dict[str, Dict[str, Any]]) -> str:
+    lines: List[str] = []
+    for name, row in reports.items():
+        lines.append(
+            f"== {name}: {row['ok_per_second']:.2f} ok/s, p50 {row['p50_ms']:.0f} ms, "
+            f"p95 {row['p95_ms']:.0f} ms, outcomes {json.dumps(row['outcomes'])}"
+        )
+        lines.append(f"   upstream: {json.dumps(row['upstream'])}")
+        for key in row["keys"]:
+            lines.append(
+                f"   {key['key']:<18}{key['state']:<14}requests={key['requests']:<6}"
+                f"throttled={key['throttled']:<6}errors={key['errors']:<4}{key['disabled_reason'] or ''}"
+            )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Single API key vs key pool under per-key rate limits")
+    parser.add_argument("--keys", type=int, default=4)
+    parser.add_argument("--per-key-rps", type=float, default=5.0)
+    parser.add_argument("--per-key-burst", type=int, default=2)
+    parser.add_argument("--latency", default="fixed:0.2")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--with-invalid-key", action="store_true")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    config = FakeUpstreamConfig(
+        latency=args.latency,
+        per_key_rps=args.per_key_rps,
+        per_key_burst=args.per_key_burst,
+        invalid_keys=[INVALID_KEY],
+        seed=7,
+    )
+    pool_keys = [f"bench-key-{index:04d}-abcd" for index in range(args.keys)]
+    if args.with_invalid_key:
+        pool_keys.insert(0, INVALID_KEY)
+    configs = {"single_key": pool_keys[-1:], f"pool_{len(pool_keys)}": pool_keys}
+
+    reports: Dict[str, Dict[str, Any]] = {}
+    for name, keys in configs.items():
+        # A fresh upstream per run so token buckets and counters start full and at zero.
+        upstream, _ = start_fake_server(config)
+        try:
+            report = run_config(upstream.base_url, keys, args)
+            with upstream.stats_lock:
+                report["upstream"] = dict(upstream.stats)
+            reports[name] = report
+        finally:
+            upstream.shutdown()
+            upstream.server_close()
+
+    print(json.dumps(reports, ensure_ascii=False, indent=2) if args.json else format_report(reports))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""Open-loop load generator for the ``/api/process/*`` endpoints.
+
+Requests are scheduled at a fixed rate regardless of how fast earlier ones
+finish, and latency is measured from the scheduled send time, so queueing
+inside GuideBot shows up in the percentiles instead of silently lowering the
+offered load.
+
+Against a running backend:
+
+    python -m bench.loadtest --target http://127.0.0.1:5000 --rps 5 --duration 30
+
+Fully offline, with a local fake upstream and a backend subprocess:
+
+    python -m bench.loadtest --local --rps 20 --duration 30 --latency lognormal:0.8,0.4 --rate-429 0.05
+
+Replaying recorded production responses (see ``AI_CASSETTE_MODE``) instead of the fake upstream:
+
+    python -m bench.loadtest --local --cassette cassettes --latency-scale 0.5 --rps 20 --duration 30
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from bench.common import (
+    dev_server_command,
+    free_port,
+    latency_summary,
+    make_png,
+    png_data_url,
+    spawn_backend,
+    stop_backend,
+)
+from bench.fake_dashscope import add_config_arguments, config_from_args, start_fake_server
+
+ENDPOINTS = ("image", "text", "url")
+
+
+def parse_mix(spec: str) -> List[Tuple[str, int]]:
+    """``image:1,text:2,url:1`` -> weighted endpoint list."""
+    mix: List[Tuple[str, int]] = []
+    for item in spec.split(","):
+        name, _, weight = item.strip().partition(":")
+        if name not in ENDPOINTS:
+            raise ValueError(f"unknown endpoint in mix: {name}")
+        mix.append((name, int(weight or 1)))
+    return mix
+
+
+def build_payloads(image_size: Tuple[int, int]) -> Dict[str, Dict[str, Any]]:
+    return {
+        "image": {"image": png_data_url(make_png(*image_size)), "note": "我想完成登录，下一步点哪里？"},
+        "text": {"text": "微信怎么发朋友圈"},
+        "url": {"url": "https://example.com/account/settings"},
+    }
+
+
+class _Results:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {name: [] for name in ENDPOINTS}
+        self.counts: Dict[str, Dict[str, int]] = {
+            name: {"sent": 0, "ok": 0, "errors": 0, "fallbacks": 0} for name in ENDPOINTS
+        }
+        self.error_kinds: Dict[str, int] = {}
+
+    def record(self, endpoint: str, latency: float, error: Optional[str], fallback: bool) -> None:
+        with self.lock:
+            counts = self.counts[endpoint]
+            self.latencies[endpoint].append(latency)
+            if error:
+                counts["errors"] += 1
+                self.error_kinds[error] = self.error_kinds.get(error, 0) + 1
+            else:
+                counts["ok"] += 1
+                if fallback:
+                    counts["fallbacks"] += 1
+
+
+def _send(
+    session: requests.Session,
+    target: str,
+    endpoint: str,
+    payload: Dict[str, Any],
+    scheduled_at: float,
+    timeout_seconds: float,
+    results: _Results,
+) -> None:
+    error: Optional[str] = None
+    fallback = False
+    try:
+        response = session.post(f"{target}/api/process/{endpoint}", json=payload, timeout=timeout_seconds)
+        if response.status_code >= 400:
+            error = f"http_{response.status_code}"
+        else:
+            body = response.json()
+            if not body.get("success"):
+                error = "success_false"
+            fallback = body.get("source") != "ai"
+    except requests.RequestException as exc:
+        error = type(exc).__name__
+    except ValueError:
+        error = "invalid_json"
+    results.record(endpoint, time.perf_counter() - scheduled_at, error, fallback)
+
+
+def run_load(
+    target: str,
+    rps: float,
+    duration_seconds: float,
+    mix: List[Tuple[str, int]],
+    max_in_flight: int = 64,
+    timeout_seconds: float = 120.0,
+    image_size: Tuple[int, int] = (1080, 720),
+) -> Dict[str, Any]:
+    """Drive ``target`` at ``rps`` for ``duration_seconds`` and return a report dict."""
+    payloads = build_payloads(image_size)
+    schedule: List[str] = [name for name, weight in mix for _ in range(weight)]
+    results = _Results()
+    local = threading.local()
+
+    def session() -> requests.Session:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def task(endpoint: str, scheduled_at: float) -> None:
+        _send(session(), target, endpoint, payloads[endpoint], scheduled_at, timeout_seconds, results)
+
+    interval = 1.0 / rps
+    total = int(rps * duration_seconds)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        for index in range(total):
+            scheduled_at = started + index * interval
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            endpoint = schedule[index % len(schedule)]
+            with results.lock:
+                results.counts[endpoint]["sent"] += 1
+            pool.submit(task, endpoint, scheduled_at)
+    elapsed = time.perf_counter() - started
+
+    report: Dict[str, Any] = {
+        "target": target,
+        "offered_rps": rps,
+        "duration_s": round(elapsed, 2),
+        "endpoints": {},
+        "error_kinds": dict(results.error_kinds),
+    }
+    all_latencies: List[float] = []
+    totals = {"sent": 0, "ok": 0, "errors": 0, "fallbacks": 0}
+    for name in ENDPOINTS:
+        counts = results.counts[name]
+        if not counts["sent"]:
+            continue
+        all_latencies.extend(results.latencies[name])
+        for key in totals:
+            totals[key] += counts[key]
+        report["endpoints"][name] = dict(
+            counts,
+            throughput_rps=round(counts["ok"] / elapsed, 2),
+            error_rate=round(counts["errors"] / counts["sent"], 4),
+            fallback_rate=round(counts["fallbacks"] / max(counts["ok"], 1), 4),
+            **latency_summary(results.latencies[name]),
+        )
+    report["overall"] = dict(
+        totals,
+        throughput_rps=round(totals["ok"] / elapsed, 2),
+        error_rate=round(totals["errors"] / max(totals["sent"], 1), 4),
+        fallback_rate=round(totals["fallbacks"] / max(totals["ok"], 1), 4),
+        **latency_summary(all_latencies),
+    )
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    header = f"{'endpoint':<10}{'sent':>7}{'ok':>7}{'rps':>8}{'p50ms':>10}{'p95ms':>10}{'p99ms':>10}{'err%':>8}{'fb%':>8}"
+    lines = [f"target={report['target']} offered={report['offered_rps']} rps duration={report['duration_s']}s", header]
+    rows = list(report["endpoints"].items()) + [("overall", report["overall"])]
+    for name, row in rows:
+        lines.append(
+            f"{name:<10}{row['sent']:>7}{row['ok']:>7}{row['throughput_rps']:>8}"
+            f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}"
+            f"{row['error_rate'] * 100:>8.2f}{row['fallback_rate'] * 100:>8.2f}"
+        )
+    if report["error_kinds"]:
+        lines.append("errors: " + ", ".join(f"{k}={v}" for k, v in sorted(report["error_kinds"].items())))
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="GuideBot /api/process/* load generator")
+    parser.add_argument("--target", default="http://127.0.0.1:5000", help="GuideBot base URL (ignored with --local)")
+    parser.add_argument("--local", action="store_true", help="start a fake upstream and a backend subprocess")
+    parser.add_argument("--rps", type=float, default=5.0)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--mix", default="image:1,text:1,url:1")
+    parser.add_argument("--max-in-flight", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--image-size", default="1080x720")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--cassette", help="with --local, replay recordings from this directory instead of faking")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplier for replayed upstream latency")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    width, height = (int(part) for part in args.image_size.lower().split("x"))
+    target = args.target.rstrip("/")
+    upstream = None
+    backend = None
+    if args.local:
+        env = {"DASHSCOPE_API_KEY": "fake-key", "AI_REQUEST_RETRY_BACKOFF_SECONDS": "0.2"}
+        if args.cassette:
+            # Synthetic inputs never hash-match real recordings, so replay non-strictly.
+            env.update(
+                {
+                    "DASHSCOPE_BASE_URL": "http://127.0.0.1:9/v1",
+                    "AI_CASSETTE_MODE": "replay",
+                    "AI_CASSETTE_DIR": os.path.abspath(args.cassette),
+                    "AI_CASSETTE_STRICT": "false",
+                    "AI_CASSETTE_LATENCY_SCALE": str(args.latency_scale),
+                }
+            )
+        else:
+            upstream, _ = start_fake_server(config_from_args(args))
+            env["DASHSCOPE_BASE_URL"] = upstream.base_url
+        port = free_port()
+        backend = spawn_backend(dev_server_command(port), port, env)
+        target = f"http://127.0.0.1:{port}"
+
+    try:
+        report = run_load(
+            target,
+            args.rps,
+            args.duration,
+            parse_mix(args.mix),
+            max_in_flight=args.max_in_flight,
+            timeout_seconds=args.timeout,
+            image_size=(width, height),
+        )
+        if upstream is not None:
+            report["upstream_outcomes"] = dict(upstream.stats)
+    finally:
+        if backend is not None:
+            stop_backend(backend)
+        if upstream is not None:
+            upstream.shutdown()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2) if args.json else format_report(report))
+    if not args.json and report.get("upstream_outcomes"):
+        print("upstream: " + ", ".join(f"{k}={v}" for k, v in sorted(report["upstream_outcomes"].items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Micro-benchmarks for the response parsing and normalization hot path.
+
+Reports ops/sec and traced allocation per call for ``_parse_ai_response``,
+``_normalize_guide``, ``_normalize_steps`` and ``_build_chinese_description``
+over the corpus in ``bench/corpus.py``. Save a baseline on the reference
+revision, then compare; the run exits non-zero if any case loses more than
+``--threshold`` of its baseline throughput:
+
+    python -m bench.microbench --save-baseline /tmp/microbench.json
+    python -m bench.microbench --baseline /tmp/microbench.json --threshold 0.15
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from typing import Any, Callable, Dict, List, Tuple
+
+from bench.common import measure_alloc, measure_ops
+from bench.corpus import build_corpus, guide, legacy_step_list
+from utils.ai_service import QwenVLService
+
+
+def build_cases(service: QwenVLService) -> List[Tuple[str, Callable[[], Any]]]:
+    cases: List[Tuple[str, Callable[[], Any]]] = []
+    for name, content in build_corpus().items():
+        cases.append((f"parse_ai_response[{name}]", lambda content=content: service._parse_ai_response(content)))
+
+    raw_guide = guide()
+    raw_large = guide(step_count=12)
+    legacy = legacy_step_list()
+    cases.extend(
+        [
+            ("normalize_guide[standard]", lambda: service._normalize_guide(raw_guide)),
+            ("normalize_guide[large]", lambda: service._normalize_guide(raw_large)),
+            ("normalize_steps[standard]", lambda: service._normalize_steps(raw_guide["steps"])),
+            ("normalize_steps[legacy]", lambda: service._normalize_steps(legacy)),
+            ("build_chinese_description[standard]", lambda: service._build_chinese_description(raw_guide["steps"][0], 1)),
+            ("build_chinese_description[legacy]", lambda: service._build_chinese_description(legacy[0], 1)),
+        ]
+    )
+    return cases
+
+
+def run(min_seconds: float, repeats: int) -> Dict[str, Dict[str, float]]:
+    service = QwenVLService(api_key="bench")
+    results: Dict[str, Dict[str, float]] = {}
+    for name, func in build_cases(service):
+        ops = measure_ops(func, min_seconds=min_seconds, repeats=repeats)
+        results[name] = dict(ops_per_sec=round(ops, 1), **measure_alloc(func))
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], threshold: float
+) -> List[str]:
+    regressions: List[str] = []
+    for name, row in results.items():
+        base = baseline.get(name)
+        if not base or not base.get("ops_per_sec"):
+            continue
+        ratio = row["ops_per_sec"] / base["ops_per_sec"]
+        row["vs_baseline"] = round(ratio, 3)
+        if ratio < 1.0 - threshold:
+            regressions.append(f"{name}: {row['ops_per_sec']:.0f} ops/s vs baseline {base['ops_per_sec']:.0f} ({ratio:.2%})")
+    return regressions
+
+
+def format_results(results: Dict[str, Dict[str, float]]) -> str:
+    lines = [f"{'case':<42}{'ops/s':>12}{'peak B':>10}{'blocks':>9}{'vs base':>9}"]
+    for name, row in results.items():
+        ratio = row.get("vs_baseline")
+        lines.append(
+            f"{name:<42}{row['ops_per_sec']:>12.0f}{row['peak_bytes']:>10.0f}{row['retained_blocks']:>9.1f}"
+            f"{(f'{ratio:.2f}x' if ratio is not None else '-'):>9}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Parsing/normalization micro-benchmarks")
+    parser.add_argument("--min-seconds", type=float, default=0.2, help="minimum timed duration per repeat")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed throughput loss before failing")
+    parser.add_argument("--save-baseline", help="write results to this path")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = run(args.min_seconds, args.repeats)
+    regressions: List[str] = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    print(json.dumps(results, indent=2) if args.json else format_results(results))
+    if regressions:
+        print(f"\nThroughput regressions beyond {args.threshold:.0%}:", file=sys.stderr)
+        for line in regressions:
+            print(f"  {line}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
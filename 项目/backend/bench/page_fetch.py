@@ -0,0 +1,156 @@
+"""Page fetch and distill cost for URL guides, against a local HTTP server.
+
+Serves a synthetic product page (inline scripts and styles, navigation,
+buttons, a sign-in form, a long footer) that honours If-None-Match and
+If-Modified-Since, then measures ``PageFetcher.outline`` per cache state:
+
+- ``cold``: a fresh fetcher each call (full download and distill)
+- ``fresh``: served from the outline cache without touching the server
+- ``revalidate``: ``fresh_seconds=0``, so every call is a conditional GET answered by 304
+
+It also reports the page size against the outline that reaches the prompt,
+and how many 200 and 304 responses the server sent.
+
+    python -m bench.page_fetch --iterations 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+from bench.common import latency_summary
+from utils.page_fetch import PageFetcher
+
+ETAG = '"bench-page-v1"'
+LAST_MODIFIED = "Mon, 05 Oct 2026 08:00:00 GMT"
+
+
+def build_page(sections: int = 40) -> bytes:
+    parts: List[str] = [
+        "<!doctype html><html><head><meta charset='utf-8'><title>账户设置 - 示例商城</title>",
+        "<meta name='description' content='管理账户资料、收货地址与安全设置'>",
+        "<style>" + "".join(f".c{i}{{margin:{i}px;padding:{i}px}}" for i in range(400)) + "</style>",
+        "<script>" + "var analytics=[];" * 800 + "</script></head><body>",
+        "<nav>" + "".join(f"<a href='/category/{i}'>分类 {i}</a>" for i in range(30)) + "</nav>",
+        "<h1>账户设置</h1>",
+        "<form method='post' action='/login'><label for='u'>用户名</label><input id='u' name='username'>",
+        "<label for='p'>密码</label><input id='p' name='password' type='password'>",
+        "<button type='submit'>登录</button></form>",
+    ]
+    for index in range(sections):
+        parts.append(
+            f"<section><h2>设置项 {index}</h2><p>{'说明文字。' * 60}</p>"
+            f"<a href='/settings/{index}'>编辑</a><button>保存 {index}</button></section>"
+        )
+    parts.append("<footer>" + "<p>版权所有 示例商城</p>" * 100 + "</footer></body></html>")
+    return "".join(parts).encode("utf-8")
+
+
+class _PageServer:
+    def __init__(self, body: bytes):
+        self.counts = {"200": 0, "304": 0}
+        counts = self.counts
+        lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:  # noqa: N802 - http.server API
+                not_modified = self.headers.get("If-None-Match") == ETAG or (
+                    self.headers.get("If-None-Match") is None
+                    and self.headers.get("If-Modified-Since") == LAST_MODIFIED
+                )
+                with lock:
+                    counts["304" if not_modified else "200"] += 1
+                self.send_response(304 if not_modified else 200)
+                self.send_header("ETag", ETAG)
+                self.send_header("Last-Modified", LAST_MODIFIED)
+                if not_modified:
+                    self.end_headers()
+                    return
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/account/settings"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "_PageServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _timed(func, iterations: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - started)
+    return latency_summary(latencies)
+
+
+def run(iterations: int, sections: int) -> Dict[str, Any]:
+    body = build_page(sections)
+    with _PageServer(body) as server:
+        outline = PageFetcher(allow_private=True).outline(server.url)
+
+        def cold() -> None:
+            PageFetcher(allow_private=True, pool_size=1).outline(server.url)
+
+        fresh_fetcher = PageFetcher(allow_private=True, fresh_seconds=3600)
+        fresh_fetcher.outline(server.url)
+        revalidating = PageFetcher(allow_private=True, fresh_seconds=0)
+        revalidating.outline(server.url)
+
+        server.counts.update({"200": 0, "304": 0})
+        results: Dict[str, Any] = {
+            "page_bytes": len(body),
+            "outline_chars": len(outline),
+            "cold": _timed(cold, iterations),
+        }
+        results["cold_responses"] = dict(server.counts)
+        server.counts.update({"200": 0, "304": 0})
+        results["fresh"] = _timed(lambda: fresh_fetcher.outline(server.url), iterations)
+        results["revalidate"] = _timed(lambda: revalidating.outline(server.url), iterations)
+        results["cached_responses"] = dict(server.counts)
+    return results
+
+
+def format_results(results: Dict[str, Any]) -> str:
+    lines = [
+        f"page {results['page_bytes']} bytes -> outline {results['outline_chars']} chars",
+        f"{'case':<12}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}",
+    ]
+    for case in ("cold", "fresh", "revalidate"):
+        row = results[case]
+        lines.append(f"{case:<12}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['max_ms']:>10.2f}")
+    lines.append(f"server responses, cold: {results['cold_responses']}")
+    lines.append(f"server responses, fresh + revalidate: {results['cached_responses']}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="PageFetcher cost per cache state against a local server")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--sections", type=int, default=40)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = run(args.iterations, args.sections)
+    print(json.dumps(results, indent=2) if args.json else format_results(results))
+
+
+if __name__ == "__main__":
+    main()
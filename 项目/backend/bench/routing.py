@@ -0,0 +1,187 @@
+"""Guide-cache locality across several local nodes, with and without consistent-hash routing.
+
+Starts ``--nodes`` backends on their own ports, each with its own guide-cache
+file (as separate hosts would have), in front of the local fake upstream.
+Clients send ``--requests`` text requests drawn from ``--distinct`` inputs to
+random nodes. Without routing every node warms its own cache, so each input
+reaches the upstream up to once per node; with routing each input has one
+owner and reaches it once. The routed run then stops one node and sends the
+same mix again to show its keys moving to the survivors. Before that, one
+``?fields=steps,title`` request per node checks that forwarded requests keep
+their query string (the run exits non-zero if one does not):
+
+    python -m bench.routing --nodes 3 --distinct 30 --requests 300
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+import requests
+
+from bench.common import free_port, latency_summary, spawn_backend, stop_backend
+from bench.fake_dashscope import FakeUpstreamConfig, start_fake_server
+
+
+def node_command(port: int) -> List[str]:
+    """The threaded dev server, warmed up first: peers only take a node into the ring once it is ready."""
+    code = (
+        "from werkzeug.serving import run_simple; import app; app.warm_up(); "
+        f"run_simple('127.0.0.1', {port}, app.app, threaded=True)"
+    )
+    return [sys.executable, "-c", code]
+
+
+def upstream_calls(upstream: Any) -> int:
+    with upstream.stats_lock:
+        return sum(upstream.stats.values())
+
+
+def send_mix(urls: List[str], args: argparse.Namespace, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    jobs = [(rng.choice(urls), rng.randrange(args.distinct)) for _ in range(args.requests)]
+    latencies: List[float] = []
+    served_by: Dict[str, int] = {}
+    failures = 0
+    lock = threading.Lock()
+
+    def worker(offset: int) -> None:
+        nonlocal failures
+        session = requests.Session()
+        for url, topic in jobs[offset :: args.threads]:
+            started = time.perf_counter()
+            try:
+                response = session.post(
+                    f"{url}/api/process/text", json={"text": f"如何在系统设置里完成第 {topic} 项配置"}, timeout=60
+                )
+                ok = response.status_code == 200
+                node = response.headers.get("X-GuideBot-Node", url)
+            except requests.RequestException:
+                ok, node = False, "error"
+            with lock:
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                    served_by[node] = served_by.get(node, 0) + 1
+                else:
+                    failures += 1
+
+    threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return dict(latency_summary(latencies), failures=failures, served_by=dict(sorted(served_by.items())))
+
+
+def check_query_forwarding(urls: List[str]) -> Dict[str, Any]:
+    """The same filtered request sent to every node: forwarded or not, the owner must apply ``?fields=``."""
+    forwarded = 0
+    mismatched: List[str] = []
+    with requests.Session() as session:
+        for url in urls:
+            response = session.post(
+                f"{url}/api/process/text?fields=steps,title", json={"text": "如何检查转发的查询参数"}, timeout=60
+            )
+            if response.headers.get("X-GuideBot-Node", url) != url:
+                forwarded += 1
+            keys = set(response.json()) if response.status_code == 200 else set()
+            if "steps" not in keys or "summary" in keys:
+                mismatched.append(url)
+    return {"checked": len(urls), "forwarded": forwarded, "mismatched": mismatched}
+
+
+def run_cluster(upstream: Any, args: argparse.Namespace, routing: bool) -> Dict[str, Any]:
+    ports = [free_port() for _ in range(args.nodes)]
+    urls = [f"http://127.0.0.1:{port}" for port in ports]
+    report: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory(prefix="guidebot-routing-") as tmp:
+        procs = []
+        try:
+            for index, port in enumerate(ports):
+                env = {
+                    "DASHSCOPE_BASE_URL": upstream.base_url,
+                    "DASHSCOPE_API_KEY": "bench-key",
+                    "AI_ALLOW_MOCK_FALLBACK": "false",
+                    "AI_CASSETTE_MODE": "off",
+                    "GUIDE_CACHE_PATH": f"{tmp}/node{index}.bin",
+                    "GUIDE_SESSION_DIR": f"{tmp}/sessions{index}",
+                    "IMAGE_POOL_WORKERS": "0",
+                    "ROUTING_HEALTH_INTERVAL_SECONDS": "1",
+                }
+                if routing:
+                    env.update(
+                        {"ROUTING_PEERS": ",".join(urls), "ROUTING_SELF": urls[index], "ROUTING_SECRET": "bench-secret"}
+                    )
+                procs.append(spawn_backend(node_command(port), port, env))
+
+            before = upstream_calls(upstream)
+            report["all_nodes"] = send_mix(urls, args, seed=1)
+            report["all_nodes"]["upstream_calls"] = upstream_calls(upstream) - before
+            if routing:
+                report["query_forwarding"] = check_query_forwarding(urls)
+
+            if routing and args.nodes > 1:
+                stop_backend(procs[-1])
+                before = upstream_calls(upstream)
+                # The survivors must take over the stopped node's share of the ring.
+                report["one_node_down"] = send_mix(urls[:-1], args, seed=2)
+                report["one_node_down"]["upstream_calls"] = upstream_calls(upstream) - before
+        finally:
+            for proc in procs:
+                if proc.poll() is None:
+                    stop_backend(proc)
+    return report
+
+
+def format_report(reports: Dict[str, Dict[str, Any]]) -> str:
+    lines: List[str] = []
+    for name, phases in reports.items():
+        for phase, row in phases.items():
+            if phase == "query_forwarding":
+                lines.append(
+                    f"== {name} / query string: {row['forwarded']} of {row['checked']} requests forwarded, "
+                    f"mismatched: {row['mismatched'] or 'none'}"
+                )
+                continue
+            lines.append(
+                f"== {name} / {phase}: upstream calls {row['upstream_calls']}, p50 {row['p50_ms']:.0f} ms, "
+                f"p95 {row['p95_ms']:.0f} ms, failures {row['failures']}"
+            )
+            lines.append(f"   served by: {json.dumps(row['served_by'])}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Guide-cache hits across nodes with and without routing")
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--distinct", type=int, default=30)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latency", default="fixed:0.2")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    upstream, _ = start_fake_server(FakeUpstreamConfig(latency=args.latency, seed=7))
+    try:
+        reports = {
+            "unrouted": run_cluster(upstream, args, routing=False),
+            "routed": run_cluster(upstream, args, routing=True),
+        }
+    finally:
+        upstream.shutdown()
+        upstream.server_close()
+
+    print(json.dumps(reports, ensure_ascii=False, indent=2) if args.json else format_report(reports))
+    if reports["routed"].get("query_forwarding", {}).get("mismatched"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Compare the Werkzeug dev server (``python app.py``) with ``serve.py`` under identical load.
+
+Both backends talk to the same local fake upstream, so the difference is only
+the serving layer:
+
+    python -m bench.serve_compare --rps 40 --duration 30 --latency lognormal:1.5,0.4
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, List
+
+from bench.common import dev_server_command, free_port, spawn_backend, stop_backend
+from bench.fake_dashscope import add_config_arguments, config_from_args, start_fake_server
+from bench.loadtest import format_report, parse_mix, run_load
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Dev server vs serve.py under the same load")
+    parser.add_argument("--rps", type=float, default=20.0)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--mix", default="image:1,text:1,url:1")
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--image-size", default="1080x720")
+    parser.add_argument("--servers", default="dev,serve", help="comma-separated subset of dev,serve")
+    parser.add_argument("--server-impl", default="", help="SERVER_IMPL for serve.py (gunicorn/waitress)")
+    parser.add_argument("--json", action="store_true")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    width, height = (int(part) for part in args.image_size.lower().split("x"))
+    upstream, _ = start_fake_server(config_from_args(args))
+    base_env = {
+        "DASHSCOPE_BASE_URL": upstream.base_url,
+        "DASHSCOPE_API_KEY": "fake-key",
+        "AI_REQUEST_RETRY_BACKOFF_SECONDS": "0.2",
+    }
+
+    reports: Dict[str, Any] = {}
+    try:
+        for name in [item.strip() for item in args.servers.split(",") if item.strip()]:
+            port = free_port()
+            env = dict(base_env)
+            if name == "dev":
+                command: List[str] = dev_server_command(port)
+            elif name == "serve":
+                command = [sys.executable, "serve.py"]
+                env.update({"SERVER_HOST": "127.0.0.1", "SERVER_PORT": str(port)})
+                if args.server_impl:
+                    env["SERVER_IMPL"] = args.server_impl
+            else:
+                raise SystemExit(f"unknown server: {name}")
+
+            proc = spawn_backend(command, port, env)
+            try:
+                reports[name] = run_load(
+                    f"http://127.0.0.1:{port}",
+                    args.rps,
+                    args.duration,
+                    parse_mix(args.mix),
+                    max_in_flight=args.max_in_flight,
+                    image_size=(width, height),
+                )
+            finally:
+                stop_backend(proc, timeout_seconds=30)
+    finally:
+        upstream.shutdown()
+
+    if args.json:
+        print(json.dumps(reports, ensure_ascii=False, indent=2))
+        return
+    for name, report in reports.items():
+        print(f"== {name} ==")
+        print(format_report(report))
+        print()
+
+
+if __name__ == "__main__":
+    main()
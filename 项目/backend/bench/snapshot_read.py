@@ -0,0 +1,167 @@
+"""Read throughput of shared-guide snapshots (``GET /api/community/guides/<share_id>``).
+
+Starts a backend on a throwaway database, shares ``--guides`` guides, then
+drives closed-loop readers against each access pattern:
+
+- ``list``: the paginated list endpoint, for comparison (a query per request)
+- ``cold``: snapshot reads with a one-entry snapshot cache (a database read each time)
+- ``hot``: snapshot reads served from the in-process cache
+- ``hot_gzip``: as ``hot`` with ``Accept-Encoding: gzip`` (stored variant, no recompression)
+- ``revalidate``: conditional reads with ``If-None-Match`` answered by 304
+
+    python -m bench.snapshot_read --threads 8 --duration 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+from bench.common import dev_server_command, free_port, latency_summary, spawn_backend, stop_backend
+from bench.corpus import guide
+
+PATTERNS = ("list", "cold", "hot", "hot_gzip", "revalidate")
+
+
+def _share_guides(base_url: str, count: int) -> List[Dict[str, Any]]:
+    shared: List[Dict[str, Any]] = []
+    with requests.Session() as session:
+        for index in range(count):
+            payload = dict(guide(step_count=6), title=f"bench guide {index}", scenario="general")
+            response = session.post(f"{base_url}/api/community/share", json=payload, timeout=10)
+            response.raise_for_status()
+            shared.append(response.json())
+    return shared
+
+
+def _drive(
+    base_url: str,
+    threads: int,
+    duration: float,
+    make_request: Callable[[requests.Session, random.Random], requests.Response],
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    sent_bytes = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(seed: int) -> None:
+        rng = random.Random(seed)
+        local: List[float] = []
+        local_status: Dict[str, int] = {}
+        local_bytes = 0
+        with requests.Session() as session:
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                response = make_request(session, rng)
+                local.append(time.perf_counter() - started)
+                local_status[str(response.status_code)] = local_status.get(str(response.status_code), 0) + 1
+                # Content-Length is the encoded (on-the-wire) size; 304s carry no body.
+                local_bytes += int(response.headers.get("Content-Length") or 0)
+        with lock:
+            latencies.extend(local)
+            for key, value in local_status.items():
+                statuses[key] = statuses.get(key, 0) + value
+            sent_bytes[0] += local_bytes
+
+    started = time.monotonic()
+    pool = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.monotonic() - started
+    return dict(
+        latency_summary(latencies),
+        rps=round(len(latencies) / elapsed, 1),
+        statuses=statuses,
+        wire_bytes_per_response=round(sent_bytes[0] / max(len(latencies), 1), 1),
+    )
+
+
+def run_pattern(
+    pattern: str, args: argparse.Namespace, shared: Optional[List[Dict[str, Any]]], db_path: str
+) -> Dict[str, Any]:
+    port = free_port()
+    env = {
+        "COMMUNITY_DB_PATH": db_path,
+        "DASHSCOPE_API_KEY": "",
+        "SNAPSHOT_CACHE_SIZE": "1" if pattern == "cold" else "100000",
+    }
+    proc = spawn_backend(dev_server_command(port), port, env)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        if shared is None:
+            shared = _share_guides(base_url, args.guides)
+        urls = [f"{base_url}{item['url']}" for item in shared]
+        etags: Dict[str, str] = {}
+        for url in urls:  # warm the cache (and collect tags) for the hot patterns
+            response = requests.get(url, timeout=10)
+            etags[url] = response.headers.get("ETag", "")
+
+        identity = {"Accept-Encoding": "identity"}
+
+        def request_once(session: requests.Session, rng: random.Random) -> requests.Response:
+            url = rng.choice(urls)
+            if pattern == "list":
+                return session.get(f"{base_url}/api/community/guides?limit=20", headers=identity, timeout=10)
+            if pattern == "hot_gzip":
+                return session.get(url, headers={"Accept-Encoding": "gzip"}, timeout=10)
+            if pattern == "revalidate":
+                return session.get(url, headers=dict(identity, **{"If-None-Match": etags[url]}), timeout=10)
+            return session.get(url, headers=identity, timeout=10)
+
+        report = _drive(base_url, args.threads, args.duration, request_once)
+        report["shared"] = shared
+        return report
+    finally:
+        stop_backend(proc)
+
+
+def format_report(reports: Dict[str, Dict[str, Any]]) -> str:
+    lines = [f"{'pattern':<12}{'rps':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'bytes':>10}  statuses"]
+    for name, row in reports.items():
+        lines.append(
+            f"{name:<12}{row['rps']:>10.1f}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}"
+            f"{row['wire_bytes_per_response']:>10.0f}  {json.dumps(row['statuses'])}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Shared-guide snapshot read throughput")
+    parser.add_argument("--guides", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--patterns", default=",".join(PATTERNS))
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    patterns = [item.strip() for item in args.patterns.split(",") if item.strip()]
+    unknown = set(patterns) - set(PATTERNS)
+    if unknown:
+        sys.exit(f"unknown patterns: {', '.join(sorted(unknown))}")
+
+    reports: Dict[str, Dict[str, Any]] = {}
+    shared: Optional[List[Dict[str, Any]]] = None
+    with tempfile.TemporaryDirectory(prefix="guidebot-snapshots-") as tmp:
+        db_path = f"{tmp}/community.db"
+        for pattern in patterns:
+            report = run_pattern(pattern, args, shared, db_path)
+            shared = report.pop("shared")
+            reports[pattern] = report
+
+    print(json.dumps(reports, indent=2) if args.json else format_report(reports))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Production entry point for the GuideBot backend.
+
+``python app.py`` runs Werkzeug's development server. Use this instead:
+
+    python serve.py
+
+On Linux/macOS it runs Gunicorn with threaded workers (``gthread``; ``gevent``
+if installed and selected), preloads the app and the AI service in the master
+before forking, and drains in-flight generations on SIGTERM. On Windows, where
+Gunicorn is unavailable, it falls back to Waitress with the same drain
+behaviour. All settings come from ``SERVER_*`` environment variables.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger("guidebot.serve")
+
+
+def _parse_int(value: Optional[str], default: int) -> int:
+    if value is None:
+        return default
+    try:
+        parsed = int(value.strip())
+        return parsed if parsed > 0 else default
+    except Exception:
+        return default
+
+
+def _request_budget_seconds() -> int:
+    """Worst-case time for one generation: every attempt times out, plus backoff."""
+    timeout = _parse_int(os.getenv("AI_REQUEST_TIMEOUT_SECONDS"), 90)
+    attempts = _parse_int(os.getenv("AI_REQUEST_RETRIES"), 1) + 1
+    return timeout * attempts + 15
+
+
+def build_options() -> Dict[str, Any]:
+    cpu_count = os.cpu_count() or 1
+    budget = _request_budget_seconds()
+    return {
+        "host": os.getenv("SERVER_HOST", "0.0.0.0"),
+        "port": _parse_int(os.getenv("SERVER_PORT"), 5000),
+        # Requests spend almost all their time waiting on the upstream, so a few
+        # processes with many threads each beat one process per core.
+        "workers": _parse_int(os.getenv("SERVER_WORKERS"), max(2, min(cpu_count, 4))),
+        "threads": _parse_int(os.getenv("SERVER_THREADS"), 32),
+        "worker_class": os.getenv("SERVER_WORKER_CLASS", "gthread"),
+        "worker_connections": _parse_int(os.getenv("SERVER_WORKER_CONNECTIONS"), 256),
+        # Longer than typical load-balancer idle timeouts (60s) so the LB closes first.
+        "keepalive": _parse_int(os.getenv("SERVER_KEEPALIVE_SECONDS"), 75),
+        "timeout": _parse_int(os.getenv("SERVER_TIMEOUT_SECONDS"), budget + 30),
+        "graceful_timeout": _parse_int(os.getenv("SERVER_GRACEFUL_TIMEOUT_SECONDS"), budget),
+        # Recycle workers after this many requests (0 = never).
+        "max_requests": _parse_int(os.getenv("SERVER_MAX_REQUESTS"), 0),
+        "backlog": _parse_int(os.getenv("SERVER_BACKLOG"), 2048),
+    }
+
+
+def _load_app() -> Any:
+    """Import the Flask app and build the AI service once, before any fork.
+
+    Only network-free work happens here; upstream connections are opened per
+    worker in ``_start_worker_warm_up`` so no socket is shared across a fork.
+    """
+    import app as app_module
+
+    started = time.perf_counter()
+    service, error = app_module._get_ai_service()
+    if service is None:
+        logger.warning("AI service preload failed: %s", error)
+    else:
+        service.compile_prompts()
+        logger.info("AI service preloaded in %.1f ms", (time.perf_counter() - started) * 1000)
+    return app_module.app
+
+
+def _start_worker_warm_up(forked: bool) -> None:
+    import app as app_module
+
+    if forked:
+        app_module.reset_startup_clock()
+        service, _ = app_module._get_ai_service()
+        if service is not None:
+            service.reset_session()
+    threading.Thread(target=app_module.warm_up, name="guidebot-warmup", daemon=True).start()
+
+
+def run_gunicorn(options: Dict[str, Any]) -> None:
+    from gunicorn.app.base import BaseApplication
+
+    class GuideBotApplication(BaseApplication):
+        def __init__(self, settings: Dict[str, Any]):
+            self.settings = settings
+            super().__init__()
+
+        def load_config(self) -> None:
+            for key, value in self.settings.items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self) -> Any:
+            return _load_app()
+
+    settings = {
+        "bind": f"{options['host']}:{options['port']}",
+        "workers": options["workers"],
+        "threads": options["threads"],
+        "worker_class": options["worker_class"],
+        "worker_connections": options["worker_connections"],
+        "keepalive": options["keepalive"],
+        "timeout": options["timeout"],
+        "graceful_timeout": options["graceful_timeout"],
+        "max_requests": options["max_requests"],
+        "max_requests_jitter": max(options["max_requests"] // 10, 0),
+        "backlog": options["backlog"],
+        "preload_app": True,
+        "post_fork": lambda server, worker: _start_worker_warm_up(forked=True),
+        "accesslog": "-" if os.getenv("SERVER_ACCESS_LOG") else None,
+    }
+    GuideBotApplication(settings).run()
+
+
+class _DrainingMiddleware:
+    """Counts in-flight requests and refuses new ones once draining starts."""
+
+    def __init__(self, wsgi_app: Callable[..., Iterable[bytes]]):
+        self.wsgi_app = wsgi_app
+        self.in_flight = 0
+        self.draining = False
+        self._lock = threading.Lock()
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable[..., Any]) -> Iterable[bytes]:
+        with self._lock:
+            if self.draining:
+                start_response("503 Service Unavailable", [("Content-Type", "text/plain"), ("Connection", "close")])
+                return [b"draining"]
+            self.in_flight += 1
+        try:
+            # GuideBot responses are small buffered JSON bodies; materialise them so
+            # the in-flight count covers the whole response.
+            return list(self.wsgi_app(environ, start_response))
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def run_waitress(options: Dict[str, Any]) -> None:
+    from waitress.server import create_server
+
+    middleware = _DrainingMiddleware(_load_app())
+    _start_worker_warm_up(forked=False)
+    server = create_server(
+        middleware,
+        host=options["host"],
+        port=options["port"],
+        threads=options["workers"] * options["threads"],
+        channel_timeout=options["timeout"],
+        connection_limit=options["worker_connections"] * options["workers"],
+        backlog=options["backlog"],
+    )
+
+    def drain_and_close() -> None:
+        deadline = time.monotonic() + options["graceful_timeout"]
+        while middleware.in_flight and time.monotonic() < deadline:
+            time.sleep(0.1)
+        logger.info("Drained; %d request(s) still in flight at shutdown", middleware.in_flight)
+        server.close()
+
+    def on_sigterm(signum: int, frame: Any) -> None:
+        if middleware.draining:
+            return
+        logger.info("SIGTERM received; draining %d in-flight request(s)", middleware.in_flight)
+        middleware.draining = True
+        threading.Thread(target=drain_and_close, name="guidebot-drain", daemon=True).start()
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    if hasattr(signal, "SIGBREAK"):
+        signal.signal(signal.SIGBREAK, on_sigterm)
+    logger.info("Starting GuideBot (waitress) on http://%s:%s", options["host"], options["port"])
+    try:
+        server.run()
+    except (OSError, ValueError):
+        # asyncore raises once the listening socket is closed during drain.
+        pass
+
+
+def main() -> None:
+    options = build_options()
+    server = os.getenv("SERVER_IMPL", "").strip().lower()
+    if not server:
+        server = "waitress" if sys.platform.startswith("win") else "gunicorn"
+
+    if server == "gunicorn":
+        run_gunicorn(options)
+    elif server == "waitress":
+        run_waitress(options)
+    else:
+        raise SystemExit(f"Unknown SERVER_IMPL: {server}")
+
+
+if __name__ == "__main__":
+    main()
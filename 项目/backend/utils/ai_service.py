@@ -4,10 +4,33 @@ import base64
 import json
 import os
 import re
+import threading
 import time
-from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from .cassette import Cassette, create_cassette
+from .guide_model import Guide, Step, build_chinese_description, get_text_field, normalize_string_list
+from .image_prep import image_data_url
+from .key_pool import KEY_ROTATE_STATUSES, KeyPool
+from .lanes import LaneScheduler
+from .metrics import (
+    UPSTREAM_RESPONSES,
+    UPSTREAM_RETRIES,
+    UPSTREAM_TOKENS,
+    record_fallback,
+    stage_timer,
+)
+from .page_fetch import PageFetcher, PageFetchError
+from .pipeline import GuideContext, Pipeline
+
+_MARKDOWN_FENCE_RE = re.compile(r"```(?:json)?\s*([\s\S]*?)\s*```")
+_JSON_ARRAY_RE = re.compile(r"\[[\s\S]*\]")
+_JSON_OBJECT_RE = re.compile(r"\{[\s\S]*\}")
+_EMPTY_INPUT_ERRORS = {"text": "文本为空，无法生成引导", "url": "网址为空，无法生成引导"}
 
 
 def _load_env_if_available() -> None:
@@ -22,10 +45,21 @@ def _load_env_if_available() -> None:
 
 
 class QwenVLService:
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, cassette: Optional[Cassette] = None):
         _load_env_if_available()
 
-        self.api_key = (api_key or os.getenv("DASHSCOPE_API_KEY") or "").strip()
+        if api_key:
+            keys = [api_key]
+        else:
+            # DASHSCOPE_API_KEYS (comma-separated) spreads load over several keys' rate limits.
+            keys = [item for item in (os.getenv("DASHSCOPE_API_KEYS") or "").split(",") if item.strip()]
+            keys = keys or [os.getenv("DASHSCOPE_API_KEY") or ""]
+        self.key_pool = KeyPool(
+            keys,
+            default_cooldown_seconds=self._parse_float(os.getenv("AI_KEY_COOLDOWN_SECONDS"), 1.0),
+            max_wait_seconds=self._parse_float(os.getenv("AI_KEY_MAX_WAIT_SECONDS"), 10.0),
+        )
+        self.api_key = keys[0].strip()
         self.base_url = (
             os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1").rstrip("/")
         )
@@ -37,6 +71,59 @@ class QwenVLService:
         self.image_max_tokens = self._parse_int(os.getenv("AI_IMAGE_MAX_TOKENS"), 1800)
         self.text_max_tokens = self._parse_int(os.getenv("AI_TEXT_MAX_TOKENS"), 1300)
         self.url_max_tokens = self._parse_int(os.getenv("AI_URL_MAX_TOKENS"), 1300)
+        self.refine_max_tokens = self._parse_int(os.getenv("AI_REFINE_MAX_TOKENS"), 900)
+        self.http_pool_size = self._parse_int(os.getenv("AI_HTTP_POOL_SIZE"), 32)
+        self.prewarm_connections_count = self._parse_int(os.getenv("AI_PREWARM_CONNECTIONS"), 4)
+        # Separate upstream concurrency per source type, so a burst of screenshots
+        # (large payloads, long generations) cannot queue quick text/url guides behind it.
+        self.lanes = LaneScheduler(
+            {
+                "image": self._parse_int(os.getenv("AI_LANE_IMAGE_SLOTS"), 6),
+                "text": self._parse_int(os.getenv("AI_LANE_TEXT_SLOTS"), 3),
+                "url": self._parse_int(os.getenv("AI_LANE_URL_SLOTS"), 3),
+            },
+            {
+                lane: self._parse_int(value, 0)
+                for lane, value in (
+                    ("image", os.getenv("AI_LANE_IMAGE_BORROW")),
+                    ("text", os.getenv("AI_LANE_TEXT_BORROW")),
+                    ("url", os.getenv("AI_LANE_URL_BORROW")),
+                )
+                if value is not None
+            },
+        )
+        self.lane_queue_timeout_seconds = self._parse_float(os.getenv("AI_LANE_QUEUE_TIMEOUT_SECONDS"), 60.0)
+        self.session = self._build_session()
+        self._prompt_cache: Dict[str, str] = {}
+        self._prompt_lock = threading.Lock()
+        self.cassette = cassette or create_cassette(
+            os.getenv("AI_CASSETTE_MODE"),
+            os.getenv("AI_CASSETTE_DIR"),
+            latency_scale=self._parse_float(os.getenv("AI_CASSETTE_LATENCY_SCALE"), 1.0),
+            strict=self._parse_bool(os.getenv("AI_CASSETTE_STRICT"), True),
+        )
+        # URL guides read the page itself: a distilled outline of its headings, links, buttons and forms.
+        self.page_fetcher: Optional[PageFetcher] = None
+        if self._parse_bool(os.getenv("PAGE_FETCH_ENABLED"), True):
+            self.page_fetcher = PageFetcher(
+                timeout_seconds=self._parse_float(os.getenv("PAGE_FETCH_TIMEOUT_SECONDS"), 5.0),
+                max_bytes=self._parse_int(os.getenv("PAGE_FETCH_MAX_BYTES"), 1024 * 1024),
+                max_outline_chars=self._parse_int(os.getenv("PAGE_FETCH_MAX_OUTLINE_CHARS"), 3000),
+                cache_entries=self._parse_int(os.getenv("PAGE_FETCH_CACHE_ENTRIES"), 256),
+                fresh_seconds=self._parse_float(os.getenv("PAGE_FETCH_FRESH_SECONDS"), 300.0),
+                allow_private=self._parse_bool(os.getenv("PAGE_FETCH_ALLOW_PRIVATE"), False),
+            )
+        # fetch -> prompt -> upstream -> parse -> validate; any stage may answer early with an error/mock result.
+        self.pipeline = Pipeline(
+            "analyze",
+            [
+                ("fetch", self._stage_fetch),
+                ("prompt", self._stage_prompt),
+                ("upstream_call", self._stage_upstream),
+                ("parse", self._stage_parse),
+                ("validate", self._stage_validate),
+            ],
+        )
 
     @staticmethod
     def _parse_bool(value: Optional[str], default: bool = True) -> bool:
@@ -64,10 +151,67 @@ class QwenVLService:
         except Exception:
             return default
 
+    def _build_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(self.http_pool_size, 1))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def reset_session(self) -> None:
+        """Drop pooled connections, e.g. in a worker forked from a process that used them."""
+        old_session = self.session
+        self.session = self._build_session()
+        old_session.close()
+
+    def compile_prompts(self) -> None:
+        self._guide_instructions()
+
+    def prewarm_connections(self, count: Optional[int] = None) -> int:
+        """Open up to ``count`` pooled keep-alive connections (DNS + TCP + TLS) to the upstream.
+
+        Uses an authenticated ``GET /models`` which costs no completion quota; any
+        HTTP response leaves a reusable connection in the pool. Returns how many
+        requests got a response.
+        """
+        count = self.prewarm_connections_count if count is None else count
+        if count <= 0 or not self.api_key or (self.cassette is not None and self.cassette.mode == "replay"):
+            return 0
+
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+
+        def touch(_: int) -> bool:
+            try:
+                response = self.session.get(f"{self.base_url}/models", headers=headers, timeout=5)
+                response.content  # read the body so the connection returns to the pool
+                return True
+            except requests.RequestException:
+                return False
+
+        with ThreadPoolExecutor(max_workers=count) as pool:
+            return sum(1 for ok in pool.map(touch, range(count)) if ok)
+
+    def warm_up(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        self.compile_prompts()
+        prompts_done = time.perf_counter()
+        connections = self.prewarm_connections()
+        finished = time.perf_counter()
+        return {
+            "prompts_ms": round((prompts_done - started) * 1000, 3),
+            "prewarm_ms": round((finished - prompts_done) * 1000, 3),
+            "prewarmed_connections": connections,
+        }
+
     def encode_image_to_base64(self, image_path: str) -> str:
         with open(image_path, "rb") as f:
             return base64.b64encode(f.read()).decode("utf-8")
 
+    def encode_image_data_url(self, image_path: str) -> str:
+        """The screenshot as a ``data:`` URL typed by its bytes (uploads may be PNG, JPEG, GIF or WebP)."""
+        with open(image_path, "rb") as f:
+            return image_data_url(f.read())
+
     def _system_prompt(self) -> str:
         return (
             "你是资深中文产品导师与信息架构师。"
@@ -102,7 +246,9 @@ class QwenVLService:
             "}"
         )
 
-    def _build_guide_prompt(self, source_type: str, source_text: Optional[str] = None) -> str:
+    def _build_guide_prompt(
+        self, source_type: str, source_text: Optional[str] = None, page: Optional[str] = None
+    ) -> str:
         context = ""
         if source_type == "image":
             context = "输入是截图，请结合可见UI元素推断操作流程。"
@@ -110,11 +256,22 @@ class QwenVLService:
                 context += f" 用户补充备注：{source_text}。请在不违背截图内容的前提下优先围绕该目标生成步骤。"
         elif source_type == "url":
             context = f"输入是网址：{source_text or ''}。请给出通用网页操作引导，并明确页面加载、导航定位、提交确认。"
+            if page:
+                context += (
+                    f"\n以下是该页面的结构摘要（标题、链接、按钮与表单）：\n{page}\n"
+                    "请优先使用摘要中真实存在的按钮、链接和输入项名称描述操作，不要编造页面上没有的元素。\n"
+                )
         elif source_type == "text":
             context = f"输入是任务描述：{source_text or ''}。请围绕该目标生成完整执行方案。"
 
-        return (
-            f"{context}"
+        return f"{context}{self._guide_instructions()}"
+
+    def _guide_instructions(self) -> str:
+        cached = self._prompt_cache.get("instructions")
+        if cached is not None:
+            return cached
+
+        instructions = (
             "只允许输出 JSON，不得输出任何额外说明、前后缀、Markdown。"
             f"JSON字段必须严格为：{self._guide_json_schema()}"
             "质量要求："
@@ -127,12 +284,50 @@ class QwenVLService:
             "7) summary、common_mistakes、final_check 必须具体，不能泛泛而谈。"
             "8) 若信息不充分，基于常见产品交互做合理假设，并在描述中给出保守操作路径。"
         )
+        with self._prompt_lock:
+            self._prompt_cache["instructions"] = instructions
+        return instructions
+
+    def _post_chat_completion(self, payload: Dict[str, Any], timeout: float) -> Any:
+        """POST with a pooled key; a throttled or rejected key is swapped for another usable one at once."""
+        url = f"{self.base_url}/chat/completions"
+        response = None
+        for _ in range(max(len(self.key_pool), 1)):
+            pooled = self.key_pool.acquire()
+            headers = {
+                "Authorization": f"Bearer {pooled.key}",
+                "Content-Type": "application/json",
+            }
+            started = time.perf_counter()
+            try:
+                if self.cassette is not None:
+                    response = self.cassette.post(
+                        url, headers=headers, payload=payload, timeout=timeout, session=self.session
+                    )
+                else:
+                    response = self.session.post(url, headers=headers, json=payload, timeout=timeout)
+            except Exception:
+                self.key_pool.release(pooled, None, time.perf_counter() - started)
+                raise
+            self.key_pool.release(
+                pooled, response.status_code, time.perf_counter() - started, response.headers.get("Retry-After")
+            )
+            if response.status_code not in KEY_ROTATE_STATUSES or not self.key_pool.has_available():
+                break
+            UPSTREAM_RETRIES.inc(reason=f"key_rotate_{response.status_code}")
+        return response
+
+    def _request_chat_completion(
+        self, messages: List[Dict[str, Any]], max_tokens: int = 1200, lane: str = "text"
+    ) -> Dict[str, Any]:
+        with stage_timer("lane_queue"):
+            self.lanes.acquire(lane, self.lane_queue_timeout_seconds)
+        try:
+            return self._request_chat_completion_in_lane(messages, max_tokens)
+        finally:
+            self.lanes.release(lane)
 
-    def _request_chat_completion(self, messages: List[Dict[str, Any]], max_tokens: int = 1200) -> Dict[str, Any]:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
+    def _request_chat_completion_in_lane(self, messages: List[Dict[str, Any]], max_tokens: int) -> Dict[str, Any]:
         payload = {
             "model": self.model,
             "messages": messages,
@@ -145,21 +340,22 @@ class QwenVLService:
         last_error = "AI 请求失败"
         for idx in range(attempts):
             try:
-                response = requests.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=payload,
-                    timeout=self.request_timeout_seconds,
-                )
+                with stage_timer("upstream"):
+                    response = self._post_chat_completion(payload, self.request_timeout_seconds)
+                UPSTREAM_RESPONSES.inc(status=str(response.status_code))
                 if response.status_code != 200:
                     last_error = f"AI API error {response.status_code}: {response.text[:300]}"
                     should_retry_status = response.status_code >= 500 or response.status_code == 429
                     if idx < attempts - 1 and should_retry_status:
-                        time.sleep(self.retry_backoff_seconds * (idx + 1))
+                        UPSTREAM_RETRIES.inc(reason=f"http_{response.status_code}")
+                        with stage_timer("retry_sleep"):
+                            time.sleep(self.retry_backoff_seconds * (idx + 1))
                         continue
                     return {"success": False, "error": last_error}
 
-                result = response.json()
+                with stage_timer("upstream_decode"):
+                    result = response.json()
+                self._record_usage(result)
                 content = self._extract_content(result)
                 if content is None:
                     return {
@@ -167,51 +363,166 @@ class QwenVLService:
                         "error": "AI 响应缺少必要字段（choices/message/content）",
                         "raw_response": json.dumps(result, ensure_ascii=False)[:1000],
                     }
-                return {"success": True, "content": content}
+                return {"success": True, "content": content, "usage": result.get("usage")}
             except requests.RequestException as exc:
+                UPSTREAM_RESPONSES.inc(status="exception")
                 last_error = f"AI 请求失败: {exc}"
                 if idx < attempts - 1:
-                    time.sleep(self.retry_backoff_seconds * (idx + 1))
+                    UPSTREAM_RETRIES.inc(reason=type(exc).__name__)
+                    with stage_timer("retry_sleep"):
+                        time.sleep(self.retry_backoff_seconds * (idx + 1))
                     continue
                 return {"success": False, "error": last_error}
 
         return {"success": False, "error": last_error}
 
-    def _guide_from_content(self, content: Any) -> Dict[str, Any]:
-        guide = self._parse_ai_response(content)
-        steps = guide.get("steps", [])
-        if not steps:
-            return {
-                "success": False,
-                "steps": [],
-                "error": "无法从 AI 响应中解析出有效步骤",
-                "raw_response": str(content)[:1000],
-            }
+    @staticmethod
+    def _record_usage(result: Dict[str, Any]) -> None:
+        usage = result.get("usage") if isinstance(result, dict) else None
+        if not isinstance(usage, dict):
+            return
+        for kind in ("prompt_tokens", "completion_tokens"):
+            value = usage.get(kind)
+            if isinstance(value, int) and value > 0:
+                UPSTREAM_TOKENS.inc(value, kind=kind.replace("_tokens", ""))
+
+    def _stage_fetch(self, ctx: GuideContext) -> None:
+        """Outline the page behind a URL; without one the model works from the URL alone, as before."""
+        url = (ctx.input or "").strip() if ctx.source == "url" else ""
+        if not url or self.page_fetcher is None or not self.api_key:
+            return
+        if self.cassette is not None and self.cassette.mode == "replay":
+            # The outline is part of the recorded request; replay stays offline and deterministic.
+            ctx.page = self.cassette.recorded_page(url)
+            return
+        try:
+            ctx.page = self.page_fetcher.outline(url)
+        except PageFetchError:
+            # Already counted in guidebot_page_fetches_total by outcome.
+            ctx.page = None
+        if self.cassette is not None:
+            self.cassette.record_page(url, ctx.page)
+
+    def _stage_prompt(self, ctx: GuideContext) -> Optional[Dict[str, Any]]:
+        if ctx.source == "image":
+            if not os.path.exists(ctx.input):
+                return self._error_or_mock(f"图片文件不存在: {ctx.input}")
+        else:
+            ctx.input = (ctx.input or "").strip()
+            if not ctx.input:
+                return self._error_or_mock(_EMPTY_INPUT_ERRORS[ctx.source])
+        if not self.api_key:
+            return self._error_or_mock("未配置 DASHSCOPE_API_KEY")
+
+        system = {"role": "system", "content": self._system_prompt()}
+        if ctx.source == "image":
+            with stage_timer("encode_image"):
+                image_url = self.encode_image_data_url(ctx.input)
+            prompt = self._build_guide_prompt(source_type="image", source_text=(ctx.note or "").strip())
+            user_content: Any = [
+                {"type": "image_url", "image_url": {"url": image_url}},
+                {"type": "text", "text": prompt},
+            ]
+            ctx.max_tokens = self.image_max_tokens
+        else:
+            user_content = self._build_guide_prompt(source_type=ctx.source, source_text=ctx.input, page=ctx.page)
+            ctx.max_tokens = self.text_max_tokens if ctx.source == "text" else self.url_max_tokens
+        ctx.messages = [system, {"role": "user", "content": user_content}]
+        return None
+
+    def _stage_upstream(self, ctx: GuideContext) -> Optional[Dict[str, Any]]:
+        req = self._request_chat_completion(messages=ctx.messages, max_tokens=ctx.max_tokens, lane=ctx.source)
+        if not req.get("success"):
+            return self._error_or_mock(req.get("error", "AI 请求失败"), req.get("raw_response"))
+        ctx.upstream = req
+        return None
+
+    def _stage_parse(self, ctx: GuideContext) -> None:
+        ctx.guide = self._parse_ai_response(ctx.upstream.get("content"))
+
+    def _stage_validate(self, ctx: GuideContext) -> Dict[str, Any]:
+        if ctx.guide is None:
+            return self._error_or_mock(
+                "无法从 AI 响应中解析出有效步骤", str(ctx.upstream.get("content"))[:1000]
+            )
         return {
             "success": True,
-            "steps": steps,
-            "title": guide.get("title"),
-            "summary": guide.get("summary"),
-            "estimated_time": guide.get("estimated_time"),
-            "difficulty": guide.get("difficulty"),
-            "prerequisites": guide.get("prerequisites"),
-            "common_mistakes": guide.get("common_mistakes"),
-            "final_check": guide.get("final_check"),
+            "guide": ctx.guide,
             "ai_used": True,
             "source": "ai",
             "error": None,
+            "usage": ctx.upstream.get("usage"),
         }
 
+    def analyze(self, source: str, source_input: str, note: str = "") -> Dict[str, Any]:
+        """Run ``source`` ("image" path, "text" or "url") through ``self.pipeline``; always returns a result dict."""
+        try:
+            return self.pipeline.run(GuideContext(source, source_input, note))
+        except requests.RequestException as exc:
+            return self._error_or_mock(f"AI 请求失败: {exc}")
+        except Exception as exc:
+            return self._error_or_mock(f"AI 分析异常: {exc}")
+
     def analyze_image(self, image_path: str, user_note: str = "") -> Dict[str, Any]:
-        if not os.path.exists(image_path):
-            return self._error_or_mock(f"图片文件不存在: {image_path}")
+        return self.analyze("image", image_path, user_note)
+
+    def _build_refine_prompt(self, previous_guide: Dict[str, Any], instruction: str, scale: float = 1.0) -> str:
+        # Only what the model needs to locate and rewrite steps; the full
+        # previous guide would cost more prompt tokens than the image.
+        steps = [Step.from_dict(step) for step in previous_guide.get("steps") or [] if isinstance(step, dict)]
+        if scale != 1.0:
+            for step in steps:
+                step.scale(scale)
+        outline = {
+            "title": previous_guide.get("title"),
+            "summary": previous_guide.get("summary"),
+            "steps": [
+                {
+                    "step": step.step,
+                    "title": step.title,
+                    "description": step.description,
+                    "rect": {"x": step.x, "y": step.y, "width": step.width, "height": step.height},
+                }
+                for step in steps
+            ],
+        }
+        return (
+            "输入是截图，以及基于该截图已生成的操作引导（JSON）："
+            f"{json.dumps(outline, ensure_ascii=False, separators=(',', ':'))}。"
+            f"用户的调整要求：{instruction}。"
+            "请只修改受该要求影响的步骤，不要重复输出未变化的步骤。"
+            "只允许输出 JSON，不得输出任何额外说明、前后缀、Markdown。"
+            "JSON字段为：{"
+            "\"title\":\"可选，标题需要变化时给出\","
+            "\"summary\":\"可选，总览需要变化时给出\","
+            "\"steps\":[需要替换或新增的完整步骤对象，字段同原引导，step 为替换或新增的编号],"
+            "\"removed_steps\":[需要删除的步骤编号]"
+            "}。全部使用简体中文，rect 必须对应截图中的真实位置。"
+        )
 
+    def refine_image_guide(
+        self, image_path: str, previous_guide: Dict[str, Any], instruction: str, scale: float = 1.0
+    ) -> Dict[str, Any]:
+        """Regenerate only the steps of ``previous_guide`` affected by ``instruction``.
+
+        ``scale`` is the stored image's size over the size the guide's rects
+        are expressed in (the session's ``image_scale``); rects go to the
+        model multiplied by it and come back divided by it.
+
+        Unlike ``analyze_image`` there is no mock fallback: on failure the caller
+        still has the previous guide to return.
+        """
+        instruction = (instruction or "").strip()
+        if not instruction:
+            return {"success": False, "error": "调整要求为空"}
+        if not os.path.exists(image_path):
+            return {"success": False, "error": f"图片文件不存在: {image_path}"}
         if not self.api_key:
-            return self._error_or_mock("未配置 DASHSCOPE_API_KEY")
+            return {"success": False, "error": "未配置 DASHSCOPE_API_KEY"}
 
         try:
-            image_base64 = self.encode_image_to_base64(image_path)
-            prompt = self._build_guide_prompt(source_type="image", source_text=(user_note or "").strip())
+            with stage_timer("encode_image"):
+                image_url = self.encode_image_data_url(image_path)
             req = self._request_chat_completion(
                 messages=[
                     {"role": "system", "content": self._system_prompt()},
@@ -220,79 +531,76 @@ class QwenVLService:
                         "content": [
                             {
                                 "type": "image_url",
-                                "image_url": {"url": f"data:image/png;base64,{image_base64}"},
+                                "image_url": {"url": image_url},
                             },
-                            {"type": "text", "text": prompt},
+                            {"type": "text", "text": self._build_refine_prompt(previous_guide, instruction, scale)},
                         ],
                     },
                 ],
-                max_tokens=self.image_max_tokens,
+                max_tokens=self.refine_max_tokens,
+                lane="image",
             )
             if not req.get("success"):
-                return self._error_or_mock(req.get("error", "AI 请求失败"), req.get("raw_response"))
-            parsed = self._guide_from_content(req.get("content"))
-            if not parsed.get("success"):
-                return self._error_or_mock(parsed.get("error", "AI 解析失败"), parsed.get("raw_response"))
-            return parsed
+                return {"success": False, "error": req.get("error", "AI 请求失败")}
 
-        except requests.RequestException as exc:
-            return self._error_or_mock(f"AI 请求失败: {exc}")
-        except Exception as exc:
-            return self._error_or_mock(f"AI 分析异常: {exc}")
-
-    def analyze_text(self, text: str) -> Dict[str, Any]:
-        text = (text or "").strip()
-        if not text:
-            return self._error_or_mock("文本为空，无法生成引导")
-        if not self.api_key:
-            return self._error_or_mock("未配置 DASHSCOPE_API_KEY")
+            with stage_timer("parse"):
+                candidates = self._json_candidates(req.get("content"))
+                delta = next((item for item in candidates if isinstance(item, dict)), None)
+            if delta is None:
+                return {
+                    "success": False,
+                    "error": "无法从 AI 响应中解析出调整结果",
+                    "raw_response": str(req.get("content"))[:1000],
+                }
 
-        try:
-            prompt = self._build_guide_prompt(source_type="text", source_text=text)
-            req = self._request_chat_completion(
-                messages=[
-                    {"role": "system", "content": self._system_prompt()},
-                    {"role": "user", "content": prompt},
-                ],
-                max_tokens=self.text_max_tokens,
+            changed_steps = self._normalize_steps(delta.get("steps"))
+            if scale != 1.0:
+                for step in changed_steps:
+                    step.scale(1 / scale)
+            changed = [step.to_dict() for step in changed_steps]
+            removed = {value for value in delta.get("removed_steps") or [] if isinstance(value, int)}
+            if not changed and not removed:
+                return {"success": False, "error": "AI 未返回需要调整的步骤"}
+
+            guide = dict(previous_guide)
+            guide["steps"] = self._merge_refined_steps(previous_guide.get("steps") or [], changed, removed)
+            for key in ("title", "summary"):
+                value = delta.get(key)
+                if isinstance(value, str) and value.strip():
+                    guide[key] = value.strip()
+            guide.update(
+                success=True,
+                ai_used=True,
+                source="ai",
+                error=None,
+                usage=req.get("usage"),
+                refined_steps=sorted({step["step"] for step in changed} | removed),
             )
-            if not req.get("success"):
-                return self._error_or_mock(req.get("error", "AI 请求失败"), req.get("raw_response"))
-            parsed = self._guide_from_content(req.get("content"))
-            if not parsed.get("success"):
-                return self._error_or_mock(parsed.get("error", "AI 解析失败"), parsed.get("raw_response"))
-            return parsed
+            return guide
         except requests.RequestException as exc:
-            return self._error_or_mock(f"AI 请求失败: {exc}")
+            return {"success": False, "error": f"AI 请求失败: {exc}"}
         except Exception as exc:
-            return self._error_or_mock(f"AI 分析异常: {exc}")
+            return {"success": False, "error": f"AI 调整异常: {exc}"}
 
-    def analyze_url(self, url: str) -> Dict[str, Any]:
-        url = (url or "").strip()
-        if not url:
-            return self._error_or_mock("网址为空，无法生成引导")
-        if not self.api_key:
-            return self._error_or_mock("未配置 DASHSCOPE_API_KEY")
+    @staticmethod
+    def _merge_refined_steps(
+        previous: List[Dict[str, Any]], changed: List[Dict[str, Any]], removed: set
+    ) -> List[Dict[str, Any]]:
+        by_number = {
+            step.get("step") if isinstance(step.get("step"), int) else index: step
+            for index, step in enumerate(previous, start=1)
+            if isinstance(step, dict)
+        }
+        for step in changed:
+            by_number[step["step"]] = step
+        merged = [by_number[number] for number in sorted(by_number) if number not in removed]
+        return [dict(step, step=index) for index, step in enumerate(merged, start=1)]
 
-        try:
-            prompt = self._build_guide_prompt(source_type="url", source_text=url)
-            req = self._request_chat_completion(
-                messages=[
-                    {"role": "system", "content": self._system_prompt()},
-                    {"role": "user", "content": prompt},
-                ],
-                max_tokens=self.url_max_tokens,
-            )
-            if not req.get("success"):
-                return self._error_or_mock(req.get("error", "AI 请求失败"), req.get("raw_response"))
-            parsed = self._guide_from_content(req.get("content"))
-            if not parsed.get("success"):
-                return self._error_or_mock(parsed.get("error", "AI 解析失败"), parsed.get("raw_response"))
-            return parsed
-        except requests.RequestException as exc:
-            return self._error_or_mock(f"AI 请求失败: {exc}")
-        except Exception as exc:
-            return self._error_or_mock(f"AI 分析异常: {exc}")
+    def analyze_text(self, text: str) -> Dict[str, Any]:
+        return self.analyze("text", text)
+
+    def analyze_url(self, url: str) -> Dict[str, Any]:
+        return self.analyze("url", url)
 
     def _extract_content(self, result: Dict[str, Any]) -> Optional[Any]:
         choices = result.get("choices")
@@ -305,7 +613,8 @@ class QwenVLService:
 
         return message.get("content")
 
-    def _parse_ai_response(self, content: Any) -> Dict[str, Any]:
+    def _json_candidates(self, content: Any) -> Iterator[Any]:
+        """Decoded JSON values found in a model reply, in the order they should be tried."""
         if isinstance(content, list):
             text_parts: List[str] = []
             for part in content:
@@ -314,188 +623,66 @@ class QwenVLService:
             content = "\n".join(text_parts)
 
         if not isinstance(content, str):
-            return {}
+            return
 
         text = content.strip()
 
-        markdown_match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", text)
+        markdown_match = _MARKDOWN_FENCE_RE.search(text)
         if markdown_match:
             text = markdown_match.group(1).strip()
 
         candidates = [text]
 
-        array_match = re.search(r"\[[\s\S]*\]", text)
+        array_match = _JSON_ARRAY_RE.search(text)
         if array_match:
             candidates.append(array_match.group(0).strip())
 
-        object_match = re.search(r"\{[\s\S]*\}", text)
+        object_match = _JSON_OBJECT_RE.search(text)
         if object_match:
             candidates.append(object_match.group(0).strip())
 
         for candidate in candidates:
             try:
-                parsed = json.loads(candidate)
+                yield json.loads(candidate)
             except json.JSONDecodeError:
                 continue
 
-            normalized = self._normalize_guide(parsed)
-            if normalized.get("steps"):
-                return normalized
-
-        return {}
-
-    def _normalize_guide(self, data: Any) -> Dict[str, Any]:
-        title = "操作引导"
-        summary = "请按以下步骤操作。"
-        estimated_time = "约3分钟"
-        difficulty = "初级"
-        prerequisites: List[str] = []
-        common_mistakes: List[str] = []
-        final_check: List[str] = []
-        raw_steps: Any = data
-
-        if isinstance(data, dict):
-            raw_steps = data.get("steps", [])
-            title_text = data.get("title")
-            summary_text = data.get("summary")
-            estimated_time_text = data.get("estimated_time")
-            difficulty_text = data.get("difficulty")
-            if isinstance(title_text, str) and title_text.strip():
-                title = title_text.strip()
-            if isinstance(summary_text, str) and summary_text.strip():
-                summary = summary_text.strip()
-            if isinstance(estimated_time_text, str) and estimated_time_text.strip():
-                estimated_time = estimated_time_text.strip()
-            if isinstance(difficulty_text, str) and difficulty_text.strip():
-                difficulty = difficulty_text.strip()
-
-            prerequisites = self._normalize_string_list(data.get("prerequisites"))
-            common_mistakes = self._normalize_string_list(data.get("common_mistakes"))
-            final_check = self._normalize_string_list(data.get("final_check"))
-
-        steps = self._normalize_steps(raw_steps)
-        if not prerequisites:
-            prerequisites = ["确认网络连接稳定。", "准备好登录账号或必要权限。"]
-        if not common_mistakes:
-            common_mistakes = ["跳过关键确认步骤，导致结果与预期不一致。"]
-        if not final_check:
-            final_check = ["确认目标操作已经成功完成。", "如结果异常，返回上一步重新检查输入。"]
-
-        return {
-            "title": title,
-            "summary": summary,
-            "estimated_time": estimated_time,
-            "difficulty": difficulty,
-            "prerequisites": prerequisites,
-            "steps": steps,
-            "common_mistakes": common_mistakes,
-            "final_check": final_check,
-        }
-
-    def _normalize_steps(self, raw_steps: Any) -> List[Dict[str, Any]]:
-        if not isinstance(raw_steps, list):
-            return []
-
-        steps: List[Dict[str, Any]] = []
-        for index, item in enumerate(raw_steps, start=1):
-            if not isinstance(item, dict):
-                continue
+    def _parse_ai_response(self, content: Any) -> Optional[Guide]:
+        for parsed in self._json_candidates(content):
+            guide = self._normalize_guide(parsed)
+            if guide.steps:
+                return guide
 
-            rect = item.get("rect") or {}
-            if not isinstance(rect, dict):
-                rect = {}
-
-            step_num = item.get("step")
-            if not isinstance(step_num, int):
-                step_num = index
-
-            step_title = self._get_text_field(item, ["title", "name", "step_title"]) or f"步骤 {step_num}"
-            description = self._build_chinese_description(item, step_num)
-            purpose = self._get_text_field(item, ["purpose", "goal", "reason"])
-            expected_result = self._get_text_field(item, ["expected_result", "result", "outcome"])
-            tip = self._get_text_field(item, ["tip", "note"])
-            warning = self._get_text_field(item, ["warning", "risk", "caution"])
-
-            color = item.get("color")
-            if not isinstance(color, str) or not color.strip():
-                color = "#ff0000"
-
-            normalized_rect = {
-                "x": int(rect.get("x", 0) or 0),
-                "y": int(rect.get("y", 0) or 0),
-                "width": int(rect.get("width", 120) or 120),
-                "height": int(rect.get("height", 40) or 40),
-            }
+        return None
 
-            steps.append(
-                {
-                    "step": step_num,
-                    "title": step_title,
-                    "description": description,
-                    "purpose": purpose,
-                    "expected_result": expected_result,
-                    "tip": tip,
-                    "warning": warning,
-                    "rect": normalized_rect,
-                    "color": color.strip(),
-                }
-            )
+    def _normalize_guide(self, data: Any) -> Guide:
+        return Guide.from_raw(data)
 
-        return steps
+    def _normalize_steps(self, raw_steps: Any) -> List[Step]:
+        return Guide.normalize_steps(raw_steps)
 
     def _normalize_string_list(self, value: Any) -> List[str]:
-        if not isinstance(value, list):
-            return []
-        output: List[str] = []
-        for item in value:
-            if isinstance(item, str) and item.strip():
-                output.append(item.strip())
-        return output[:6]
+        return normalize_string_list(value)
 
     def _get_text_field(self, item: Dict[str, Any], keys: List[str]) -> Optional[str]:
-        for key in keys:
-            value = item.get(key)
-            if isinstance(value, str) and value.strip():
-                return value.strip()
-        return None
+        return get_text_field(item, keys)
 
     def _build_chinese_description(self, item: Dict[str, Any], step_num: int) -> str:
-        primary = self._get_text_field(
-            item,
-            ["description", "action", "instruction", "content", "title"],
-        )
-        if not primary:
-            primary = f"完成第 {step_num} 步操作。"
-
-        extra_parts: List[str] = []
-        for key in ["target", "result", "tip", "note"]:
-            value = item.get(key)
-            if isinstance(value, str) and value.strip():
-                extra_parts.append(value.strip())
-
-        description = primary.strip().replace("\n", " ")
-        if extra_parts:
-            detail = "；".join(extra_parts[:2])
-            if detail not in description:
-                description = f"{description}（{detail}）"
-
-        if not re.search(r"[\u4e00-\u9fff]", description):
-            description = f"请执行该步骤：{description}"
-
-        return description
+        return build_chinese_description(item, step_num)
 
     def _error_or_mock(self, error: str, raw_response: Optional[str] = None) -> Dict[str, Any]:
         if self.allow_mock_fallback:
+            record_fallback("ai_error")
             return {
                 "success": True,
-                "steps": self._get_mock_steps(),
-                "title": "示例操作引导",
-                "summary": "当前使用回退说明，请按步骤依次操作。",
-                "estimated_time": "约3分钟",
-                "difficulty": "初级",
-                "prerequisites": ["确认网络状态正常。", "确保你在目标页面且有操作权限。"],
-                "common_mistakes": ["遗漏关键按钮点击。", "输入信息后未确认提交。"],
-                "final_check": ["目标页面已正确跳转。", "关键操作已生效。"],
+                "guide": Guide(
+                    self._get_mock_steps(),
+                    title="示例操作引导",
+                    summary="当前使用回退说明，请按步骤依次操作。",
+                    prerequisites=["确认网络状态正常。", "确保你在目标页面且有操作权限。"],
+                    common_mistakes=["遗漏关键按钮点击。", "输入信息后未确认提交。"],
+                    final_check=["目标页面已正确跳转。", "关键操作已生效。"],
+                ),
                 "ai_used": False,
                 "source": "mock",
                 "error": error,
@@ -504,39 +691,19 @@ class QwenVLService:
 
         return {
             "success": False,
-            "steps": [],
+            "guide": None,
             "ai_used": False,
             "source": "error",
             "error": error,
             "raw_response": raw_response,
         }
 
-    def _get_mock_steps(self) -> List[Dict[str, Any]]:
+    def _get_mock_steps(self) -> List[Step]:
         return [
-            {
-                "step": 1,
-                "description": "点击页面右上角的“登录”按钮，进入登录流程。",
-                "rect": {"x": 650, "y": 50, "width": 100, "height": 40},
-                "color": "#ff0000",
-            },
-            {
-                "step": 2,
-                "description": "在用户名输入框中填写你的账号信息。",
-                "rect": {"x": 300, "y": 200, "width": 200, "height": 40},
-                "color": "#00aa00",
-            },
-            {
-                "step": 3,
-                "description": "在密码输入框中输入密码，并确认没有输错。",
-                "rect": {"x": 300, "y": 260, "width": 200, "height": 40},
-                "color": "#0000ff",
-            },
-            {
-                "step": 4,
-                "description": "点击“确认登录”按钮，等待页面跳转完成。",
-                "rect": {"x": 350, "y": 350, "width": 120, "height": 45},
-                "color": "#ff8800",
-            },
+            Step(1, "点击页面右上角的“登录”按钮，进入登录流程。", 650, 50, 100, 40, "#ff0000"),
+            Step(2, "在用户名输入框中填写你的账号信息。", 300, 200, 200, 40, "#00aa00"),
+            Step(3, "在密码输入框中输入密码，并确认没有输错。", 300, 260, 200, 40, "#0000ff"),
+            Step(4, "点击“确认登录”按钮，等待页面跳转完成。", 350, 350, 120, 45, "#ff8800"),
         ]
 
     def test_connection(self) -> Dict[str, Any]:
@@ -548,11 +715,6 @@ class QwenVLService:
             }
 
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-            }
-
             payload = {
                 "model": self.model,
                 "messages": [
@@ -564,12 +726,7 @@ class QwenVLService:
                 "max_tokens": 16,
             }
 
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=15,
-            )
+            response = self._post_chat_completion(payload, 15)
 
             if response.status_code == 200:
                 return {
@@ -591,6 +748,45 @@ class QwenVLService:
                 "message": str(exc),
             }
 
+    def probe_upstream(self, timeout: float = 5.0) -> Dict[str, Any]:
+        """Cheap reachability check: an authenticated ``GET /models`` that costs no completion quota."""
+        if not self.api_key:
+            return {
+                "success": False,
+                "status": "missing_api_key",
+                "message": "请在环境变量或 .env 中配置 DASHSCOPE_API_KEY",
+            }
+        if self.cassette is not None and self.cassette.mode == "replay":
+            return {"success": True, "status": "replay", "model": self.model, "message": "上游回放模式，未访问网络"}
+
+        try:
+            pooled = self.key_pool.acquire(max_wait_seconds=0)
+            started = time.perf_counter()
+            try:
+                response = self.session.get(
+                    f"{self.base_url}/models",
+                    headers={"Authorization": f"Bearer {pooled.key}"},
+                    timeout=timeout,
+                )
+            except Exception:
+                self.key_pool.release(pooled, None, time.perf_counter() - started)
+                raise
+            self.key_pool.release(pooled, response.status_code, time.perf_counter() - started)
+            if response.status_code == 200:
+                return {"success": True, "status": "connected", "model": self.model, "message": "Qwen API 连接正常"}
+            # 401/403 mean the key is rejected; anything else means the upstream is unhealthy.
+            return {
+                "success": False,
+                "status": f"http_{response.status_code}",
+                "message": response.text[:300],
+            }
+        except Exception as exc:
+            return {
+                "success": False,
+                "status": "exception",
+                "message": str(exc),
+            }
+
 
 def create_ai_service() -> QwenVLService:
     return QwenVLService()
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import requests
+
+CASSETTE_MODES = {"off", "record", "replay"}
+
+
+def request_key(payload: Dict[str, Any]) -> str:
+    """Stable hash of an upstream request body; credentials are never part of it."""
+    canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class CassetteResponse:
+    """Minimal stand-in for ``requests.Response`` built from a recorded interaction."""
+
+    def __init__(self, status_code: int, text: str, headers: Optional[Dict[str, str]] = None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = requests.structures.CaseInsensitiveDict(headers or {})
+
+    def json(self) -> Any:
+        try:
+            return json.loads(self.text)
+        except ValueError as exc:
+            raise requests.exceptions.JSONDecodeError(str(exc), self.text, 0) from exc
+
+
+class Cassette:
+    """Records upstream chat-completion traffic to disk, or replays it without network.
+
+    Each distinct request is stored as ``<sha256>.json.gz`` holding every response
+    seen for it, so repeated identical requests replay in recorded order. Page
+    outlines fetched for URL guides are part of the prompt, so they are kept
+    too, under ``pages/``, and replayed instead of fetching the live page.
+    """
+
+    def __init__(self, directory: str, mode: str = "replay", latency_scale: float = 1.0, strict: bool = True):
+        if mode not in CASSETTE_MODES - {"off"}:
+            raise ValueError(f"unsupported cassette mode: {mode}")
+        self.directory = directory
+        self.mode = mode
+        self.latency_scale = max(latency_scale, 0.0)
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._cursors: Dict[str, int] = {}
+        self._cache: Dict[str, List[Dict[str, Any]]] = {}
+        self._any_cycle: Optional[itertools.cycle] = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json.gz")
+
+    def _read(self, key: str) -> List[Dict[str, Any]]:
+        try:
+            with gzip.open(self._path(key), "rt", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return []
+        return entries if isinstance(entries, list) else []
+
+    def _append(self, key: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            entries = self._read(key)
+            entries.append(entry)
+            tmp_path = self._path(key) + ".tmp"
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self._path(key))
+
+    def _page_path(self, url: str) -> str:
+        return os.path.join(self.directory, "pages", f"{request_key({'url': url})}.json.gz")
+
+    def record_page(self, url: str, outline: Optional[str]) -> None:
+        """Keep the outline sent with ``url`` (None when the fetch failed); the latest recording wins."""
+        path = self._page_path(url)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self._lock:
+                with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+                    json.dump({"url": url, "outline": outline, "recorded_at": int(time.time())}, f, ensure_ascii=False)
+                os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+    def recorded_page(self, url: str) -> Optional[str]:
+        """The outline recorded for ``url``, or None when there is none (the prompt then carries no outline)."""
+        try:
+            with gzip.open(self._page_path(url), "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        outline = entry.get("outline") if isinstance(entry, dict) else None
+        return outline if isinstance(outline, str) else None
+
+    def keys(self) -> List[str]:
+        return sorted(name[: -len(".json.gz")] for name in os.listdir(self.directory) if name.endswith(".json.gz"))
+
+    def _next_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entries = self._cache.get(key)
+            if entries is None:
+                entries = self._read(key)
+                self._cache[key] = entries
+            if entries:
+                cursor = self._cursors.get(key, 0)
+                self._cursors[key] = cursor + 1
+                return entries[cursor % len(entries)]
+            if self.strict:
+                return None
+            # Non-strict replay serves any recording, e.g. synthetic load against real response shapes.
+            if self._any_cycle is None:
+                recorded = [item for name in self.keys() for item in self._read(name)]
+                if not recorded:
+                    return None
+                self._any_cycle = itertools.cycle(recorded)
+            return next(self._any_cycle)
+
+    def post(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        payload: Dict[str, Any],
+        timeout: float,
+        session: Optional[requests.Session] = None,
+    ) -> Any:
+        key = request_key(payload)
+        if self.mode == "replay":
+            entry = self._next_entry(key)
+            if entry is None:
+                raise requests.ConnectionError(f"cassette miss for request {key[:12]}")
+            delay = float(entry.get("elapsed_seconds") or 0.0) * self.latency_scale
+            if delay:
+                time.sleep(min(delay, timeout))
+            return CassetteResponse(int(entry.get("status_code", 200)), entry.get("body", ""), entry.get("headers"))
+
+        started = time.perf_counter()
+        response = (session or requests).post(url, headers=headers, json=payload, timeout=timeout)
+        elapsed = time.perf_counter() - started
+        kept_headers = {
+            name: response.headers[name] for name in ("Content-Type", "Retry-After") if name in response.headers
+        }
+        try:
+            self._append(
+                key,
+                {
+                    "recorded_at": int(time.time()),
+                    "model": payload.get("model"),
+                    "max_tokens": payload.get("max_tokens"),
+                    "status_code": response.status_code,
+                    "headers": kept_headers,
+                    "elapsed_seconds": round(elapsed, 4),
+                    "body": response.text,
+                },
+            )
+        except OSError:
+            pass
+        return response
+
+
+def create_cassette(
+    mode: Optional[str],
+    directory: Optional[str],
+    latency_scale: float = 1.0,
+    strict: bool = True,
+) -> Optional[Cassette]:
+    mode = (mode or "off").strip().lower()
+    if mode == "off" or mode not in CASSETTE_MODES:
+        return None
+    default_dir = os.path.join(os.path.dirname(__file__), "..", "cassettes")
+    return Cassette(directory or default_dir, mode=mode, latency_scale=latency_scale, strict=strict)
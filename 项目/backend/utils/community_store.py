@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import base64
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+SORT_COLUMNS = {"recent": "created_at", "likes": "likes"}
+
+# Shared guides are addressed by a 128-bit prefix of the sha256 of their canonical JSON.
+SHARE_ID_LENGTH = 32
+
+# Trigram FTS needs at least three characters per query term; shorter queries
+# (common for Chinese: "登录", "支付") fall back to LIKE over the same columns.
+_FTS_MIN_QUERY_LENGTH = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS guides (
+    id INTEGER PRIMARY KEY,
+    share_id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    summary TEXT NOT NULL DEFAULT '',
+    steps_text TEXT NOT NULL DEFAULT '',
+    author TEXT NOT NULL DEFAULT '',
+    scenario TEXT NOT NULL DEFAULT 'general',
+    likes INTEGER NOT NULL DEFAULT 0,
+    step_count INTEGER NOT NULL DEFAULT 0,
+    created_at INTEGER NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_guides_created ON guides (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_guides_likes ON guides (likes DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_guides_scenario_created ON guides (scenario, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_guides_scenario_likes ON guides (scenario, likes DESC, id DESC);
+CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+INSERT OR IGNORE INTO store_meta (key, value) VALUES ('revision', 0);
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS guides_fts USING fts5(
+    title, summary, steps_text, content='guides', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS guides_fts_insert AFTER INSERT ON guides BEGIN
+    INSERT INTO guides_fts (rowid, title, summary, steps_text) VALUES (new.id, new.title, new.summary, new.steps_text);
+END;
+CREATE TRIGGER IF NOT EXISTS guides_fts_delete AFTER DELETE ON guides BEGIN
+    INSERT INTO guides_fts (guides_fts, rowid, title, summary, steps_text)
+    VALUES ('delete', old.id, old.title, old.summary, old.steps_text);
+END;
+CREATE TRIGGER IF NOT EXISTS guides_fts_update AFTER UPDATE OF title, summary, steps_text ON guides BEGIN
+    INSERT INTO guides_fts (guides_fts, rowid, title, summary, steps_text)
+    VALUES ('delete', old.id, old.title, old.summary, old.steps_text);
+    INSERT INTO guides_fts (rowid, title, summary, steps_text) VALUES (new.id, new.title, new.summary, new.steps_text);
+END;
+"""
+
+
+def encode_cursor(sort_value: int, row_id: int) -> str:
+    raw = json.dumps([sort_value, row_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    """Raises ValueError for anything that is not a cursor we issued."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return int(sort_value), int(row_id)
+    except Exception as exc:
+        raise ValueError(f"invalid cursor: {cursor!r}") from exc
+
+
+def canonical_json(guide: Dict[str, Any]) -> str:
+    return json.dumps(guide, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def content_id(body: str) -> str:
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()[:SHARE_ID_LENGTH]
+
+
+def _steps_text(steps: List[Any]) -> str:
+    parts: List[str] = []
+    for step in steps:
+        if isinstance(step, dict):
+            parts.extend(str(step.get(key) or "") for key in ("title", "description"))
+        else:
+            parts.append(str(step))
+    return "\n".join(part for part in parts if part)
+
+
+class CommunityStore:
+    """SQLite (WAL) store for shared guides.
+
+    One connection per thread; WAL lets readers in every worker process run
+    concurrently with the single writer. ``revision`` increases on every write
+    and is what list ETags are derived from.
+    """
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        conn.executescript(_SCHEMA)
+        try:
+            conn.executescript(_FTS_SCHEMA)
+            self.fts_enabled = True
+        except sqlite3.OperationalError:  # SQLite built without FTS5 or the trigram tokenizer
+            self.fts_enabled = False
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._local.conn = conn
+        return conn
+
+    def revision(self) -> int:
+        row = self._connection().execute("SELECT value FROM store_meta WHERE key = 'revision'").fetchone()
+        return int(row[0]) if row else 0
+
+    def add(self, guide: Dict[str, Any]) -> Dict[str, Any]:
+        """Store an immutable snapshot of ``guide`` under its content hash.
+
+        Sharing identical content again returns the existing record.
+        """
+        steps = guide.get("steps") or []
+        body = canonical_json(guide)
+        share_id = content_id(body)
+        conn = self._connection()
+        existing = conn.execute("SELECT id, created_at FROM guides WHERE share_id = ?", (share_id,)).fetchone()
+        if existing is not None:
+            return {"id": existing["id"], "share_id": share_id, "created_at": existing["created_at"], "created": False}
+
+        record = {
+            "share_id": share_id,
+            "title": str(guide.get("title") or "").strip(),
+            "summary": str(guide.get("summary") or "").strip(),
+            "steps_text": _steps_text(steps),
+            "author": str(guide.get("author") or "").strip(),
+            "scenario": str(guide.get("scenario") or "general").strip() or "general",
+            "step_count": len(steps),
+            "created_at": int(time.time() * 1000),
+            "body": body,
+        }
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO guides (share_id, title, summary, steps_text, author, scenario, step_count, created_at, body)"
+                " VALUES (:share_id, :title, :summary, :steps_text, :author, :scenario, :step_count, :created_at, :body)",
+                record,
+            )
+            created = cursor.rowcount > 0
+            if created:
+                conn.execute("UPDATE store_meta SET value = value + 1 WHERE key = 'revision'")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if not created:  # lost a race with a concurrent share of the same content
+            return self.add(guide)
+        return {"id": cursor.lastrowid, "share_id": share_id, "created_at": record["created_at"], "created": True}
+
+    def snapshot(self, share_id: str) -> Optional[str]:
+        """The canonical JSON stored for ``share_id``, exactly as it was hashed."""
+        row = self._connection().execute("SELECT body FROM guides WHERE share_id = ?", (share_id,)).fetchone()
+        return row["body"] if row else None
+
+    def list(
+        self,
+        scenario: Optional[str] = None,
+        sort: str = "recent",
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        query: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """One page ordered by ``sort`` (then id), newest/most-liked first.
+
+        Pagination is keyset-based: the returned cursor encodes the last row's
+        (sort value, id), so deep pages cost the same as the first one.
+        """
+        column = SORT_COLUMNS.get(sort)
+        if column is None:
+            raise ValueError(f"unsupported sort: {sort!r}")
+
+        clauses: List[str] = []
+        params: List[Any] = []
+        source = "guides"
+        if query:
+            if self.fts_enabled and len(query) >= _FTS_MIN_QUERY_LENGTH:
+                source = "guides JOIN guides_fts ON guides_fts.rowid = guides.id"
+                clauses.append("guides_fts MATCH ?")
+                params.append('"' + query.replace('"', '""') + '"')
+            else:
+                pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                clauses.append(
+                    "(guides.title LIKE ? ESCAPE '\\' OR guides.summary LIKE ? ESCAPE '\\'"
+                    " OR guides.steps_text LIKE ? ESCAPE '\\')"
+                )
+                params.extend([pattern] * 3)
+        if scenario:
+            clauses.append("guides.scenario = ?")
+            params.append(scenario)
+        if cursor:
+            sort_value, row_id = decode_cursor(cursor)
+            clauses.append(f"(guides.{column}, guides.id) < (?, ?)")
+            params.extend([sort_value, row_id])
+
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = (
+            "SELECT guides.id, guides.share_id, guides.title, guides.author, guides.summary, guides.scenario,"
+            f" guides.likes, guides.step_count, guides.created_at FROM {source}{where}"
+            f" ORDER BY guides.{column} DESC, guides.id DESC LIMIT ?"
+        )
+        rows = self._connection().execute(sql, params + [limit + 1]).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(last[column], last["id"])
+        return [self._summary(row) for row in rows], next_cursor
+
+    @staticmethod
+    def _summary(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "id": row["id"],
+            "share_id": row["share_id"],
+            "title": row["title"],
+            "author": row["author"],
+            "summary": row["summary"],
+            "likes": row["likes"],
+            "steps": row["step_count"],
+            "created_at": _iso(row["created_at"]),
+            "scenario": row["scenario"],
+        }
+
+
+def _iso(epoch_ms: int) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(epoch_ms / 1000))
+
+
+class SnapshotCache:
+    """Bounded LRU of serialized snapshots.
+
+    Snapshots are immutable, so entries never need invalidation; only misses
+    are never cached, since the content may be shared later.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max(max_entries, 1)
+        self._entries: "collections.OrderedDict[str, Any]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import gzip
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+from .metrics import COMPRESSION_RATIO, COMPRESSION_SECONDS, RESPONSE_BYTES, current_endpoint
+
+# Preference order when the client accepts several encodings with equal weight.
+PREFERRED_ENCODINGS: Tuple[str, ...] = ("br", "gzip") if brotli is not None else ("gzip",)
+
+COMPRESSIBLE_MIMETYPES = frozenset({"application/json", "text/plain", "text/html", "text/css", "application/javascript"})
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    weights: Dict[str, float] = {}
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        weights[name] = quality
+    return weights
+
+
+def negotiate(header: Optional[str], available: Sequence[str] = PREFERRED_ENCODINGS) -> Optional[str]:
+    """Pick the best encoding from ``available`` for an Accept-Encoding header, or None for identity."""
+    weights = parse_accept_encoding(header)
+    best: Optional[str] = None
+    best_quality = 0.0
+    for encoding in available:
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 5) -> bytes:
+    if encoding == "br":
+        if brotli is None:
+            raise ValueError("brotli is not installed")
+        return brotli.compress(data, quality=brotli_quality)
+    if encoding == "gzip":
+        # mtime=0 keeps the output deterministic for identical bodies.
+        return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+    raise ValueError(f"unsupported encoding: {encoding}")
+
+
+def compress_observed(data: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 5) -> bytes:
+    """``compress`` plus ratio, CPU time and byte metrics for the current endpoint."""
+    started = time.thread_time()
+    body = compress(data, encoding, gzip_level, brotli_quality)
+    endpoint = current_endpoint()
+    COMPRESSION_SECONDS.observe(time.thread_time() - started, endpoint=endpoint, encoding=encoding)
+    COMPRESSION_RATIO.observe(len(body) / len(data) if data else 1.0, endpoint=endpoint, encoding=encoding)
+    return body
+
+
+def record_response_bytes(original: int, sent: int, encoding: str) -> None:
+    endpoint = current_endpoint()
+    RESPONSE_BYTES.inc(original, endpoint=endpoint, encoding=encoding, kind="original")
+    RESPONSE_BYTES.inc(sent, endpoint=endpoint, encoding=encoding, kind="sent")
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    return f"{etag}-{encoding}"
+
+
+def etag_variants(etag: str) -> List[str]:
+    """The identity tag plus every per-encoding tag a client may echo back."""
+    return [etag] + [encoded_etag(etag, encoding) for encoding in PREFERRED_ENCODINGS]
+
+
+class PrecompressedBody:
+    """A response body that keeps its compressed variants alongside the raw bytes.
+
+    Caches store this object instead of raw bytes, so each encoding is produced
+    at most once per entry no matter how often the entry is served.
+    """
+
+    __slots__ = ("data", "_variants", "_lock")
+
+    def __init__(self, data: bytes, variants: Optional[Dict[str, bytes]] = None):
+        self.data = data
+        self._variants: Dict[str, bytes] = dict(variants or {})
+        self._lock = threading.Lock()
+
+    def variant(self, encoding: str, gzip_level: int = 6, brotli_quality: int = 5) -> bytes:
+        body = self._variants.get(encoding)
+        if body is not None:
+            return body
+        with self._lock:
+            body = self._variants.get(encoding)
+            if body is None:
+                body = compress_observed(self.data, encoding, gzip_level, brotli_quality)
+                self._variants[encoding] = body
+        return body
+
+    def encodings(self) -> List[str]:
+        return list(self._variants)
+
+    def size(self) -> int:
+        return len(self.data) + sum(len(body) for body in self._variants.values())
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # optional: no cross-process cache on Windows
+    fcntl = None
+
+from .metrics import GUIDE_CACHE_LOOKUPS, GUIDE_CACHE_STORES
+from .shared_file import open_shared_file
+
+_MAGIC = b"GBGC"
+_VERSION = 1
+# magic, version, sets, ways, slot_size
+_HEADER = struct.Struct("<4sIIII")
+_HEADER_SIZE = 64
+# Per set: the CLOCK hand.
+_SET_HEADER = struct.Struct("<I")
+_SET_HEADER_SIZE = 8
+# seq (odd while a writer is inside), key digest, expires_at, value length, value crc32.
+_SLOT = struct.Struct("<Q16sdII")
+_SEQ = struct.Struct("<Q")
+_REF_OFFSET = _SLOT.size  # one-byte CLOCK reference bit
+_SLOT_HEADER_SIZE = 48
+_EMPTY_DIGEST = b"\x00" * 16
+
+
+class SharedGuideCache:
+    """Guide results in a memory-mapped file shared by every worker process on the host.
+
+    The file is a fixed-size set-associative table: a key's digest picks a set
+    of ``ways`` slots, and a full set evicts by CLOCK (a reference bit per slot,
+    set on every hit). Readers take no lock: each slot carries a sequence
+    number that is odd while a writer is inside it, plus a CRC of the value,
+    and a read that races a write is treated as a miss. Writers serialise per
+    set with a byte-range lock on the file, so all workers share hits and the
+    contents outlive worker recycling. Values are zlib-compressed; anything
+    that does not fit in a slot is not cached.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024, slot_size: int = 16384, ways: int = 8):
+        if fcntl is None:
+            raise RuntimeError("SharedGuideCache needs fcntl (POSIX only)")
+        self.path = path
+        self.slot_size = max(slot_size, 1024)
+        self.ways = max(ways, 1)
+        self.sets = max(max_bytes // (self.slot_size * self.ways), 1)
+        self._set_bytes = _SET_HEADER_SIZE + self.ways * self.slot_size
+        self.size = _HEADER_SIZE + self.sets * self._set_bytes
+        self._write_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        expected = _HEADER.pack(_MAGIC, _VERSION, self.sets, self.ways, self.slot_size)
+        self._fd = open_shared_file(path, expected, self.size)
+        self._mm = mmap.mmap(self._fd, self.size)
+
+    @staticmethod
+    def digest(key: str) -> bytes:
+        return hashlib.sha256(key.encode("utf-8")).digest()[:16]
+
+    def _set_offset(self, digest: bytes) -> int:
+        return _HEADER_SIZE + (int.from_bytes(digest[:8], "little") % self.sets) * self._set_bytes
+
+    def _slot_offset(self, set_offset: int, way: int) -> int:
+        return set_offset + _SET_HEADER_SIZE + way * self.slot_size
+
+    def get(self, key: str, source: str = "") -> Optional[bytes]:
+        digest = self.digest(key)
+        set_offset = self._set_offset(digest)
+        mm = self._mm
+        for way in range(self.ways):
+            offset = self._slot_offset(set_offset, way)
+            seq, slot_digest, expires_at, length, crc = _SLOT.unpack_from(mm, offset)
+            if slot_digest != digest or seq & 1 or length > self.slot_size - _SLOT_HEADER_SIZE:
+                continue
+            if expires_at < time.time():
+                GUIDE_CACHE_LOOKUPS.inc(source=source, outcome="expired")
+                return None
+            start = offset + _SLOT_HEADER_SIZE
+            value = mm[start : start + length]
+            if _SEQ.unpack_from(mm, offset)[0] != seq or zlib.crc32(value) != crc:
+                GUIDE_CACHE_LOOKUPS.inc(source=source, outcome="torn")
+                return None
+            mm[offset + _REF_OFFSET] = 1
+            GUIDE_CACHE_LOOKUPS.inc(source=source, outcome="hit")
+            return zlib.decompress(value)
+        GUIDE_CACHE_LOOKUPS.inc(source=source, outcome="miss")
+        return None
+
+    def put(self, key: str, value: bytes, ttl_seconds: float) -> bool:
+        packed = zlib.compress(value, 6)
+        if len(packed) > self.slot_size - _SLOT_HEADER_SIZE:
+            GUIDE_CACHE_STORES.inc(outcome="too_large")
+            return False
+        digest = self.digest(key)
+        set_offset = self._set_offset(digest)
+        mm = self._mm
+        # Byte-range locks are per process, so threads of one worker also need the local lock.
+        with self._write_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, set_offset)
+            try:
+                way, evicted = self._choose_way(set_offset, digest)
+                offset = self._slot_offset(set_offset, way)
+                seq = _SEQ.unpack_from(mm, offset)[0]
+                _SEQ.pack_into(mm, offset, seq + 1)
+                start = offset + _SLOT_HEADER_SIZE
+                mm[start : start + len(packed)] = packed
+                _SLOT.pack_into(
+                    mm, offset, seq + 1, digest, time.time() + ttl_seconds, len(packed), zlib.crc32(packed)
+                )
+                mm[offset + _REF_OFFSET] = 1
+                _SEQ.pack_into(mm, offset, seq + 2)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, set_offset)
+        GUIDE_CACHE_STORES.inc(outcome="evicted" if evicted else "stored")
+        return True
+
+    def _choose_way(self, set_offset: int, digest: bytes) -> Tuple[int, bool]:
+        mm = self._mm
+        now = time.time()
+        free: Optional[int] = None
+        for way in range(self.ways):
+            _, slot_digest, expires_at, _, _ = _SLOT.unpack_from(mm, self._slot_offset(set_offset, way))
+            if slot_digest == digest:
+                return way, False
+            if free is None and (slot_digest == _EMPTY_DIGEST or expires_at < now):
+                free = way
+        if free is not None:
+            return free, False
+
+        # CLOCK: sweep from the hand, clearing reference bits, until an unreferenced slot turns up.
+        hand = _SET_HEADER.unpack_from(mm, set_offset)[0] % self.ways
+        while True:
+            ref_offset = self._slot_offset(set_offset, hand) + _REF_OFFSET
+            if mm[ref_offset]:
+                mm[ref_offset] = 0
+                hand = (hand + 1) % self.ways
+                continue
+            _SET_HEADER.pack_into(mm, set_offset, (hand + 1) % self.ways)
+            return hand, True
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        used = 0
+        for set_index in range(self.sets):
+            set_offset = _HEADER_SIZE + set_index * self._set_bytes
+            for way in range(self.ways):
+                _, slot_digest, expires_at, _, _ = _SLOT.unpack_from(self._mm, self._slot_offset(set_offset, way))
+                if slot_digest != _EMPTY_DIGEST and expires_at >= now:
+                    used += 1
+        return {"path": self.path, "bytes": self.size, "slots": self.sets * self.ways, "used": used}
+
+    def close(self) -> None:
+        self._mm.close()
+        os.close(self._fd)
@@ -0,0 +1,333 @@
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the pure-Python writer below
+    orjson = None
+
+_CJK_RE = re.compile(r"[\u4e00-\u9fff]")
+# C-accelerated where available; emits UTF-8-ready text rather than \\u escapes.
+_encode_str = json.encoder.encode_basestring
+
+GUIDE_FIELDS = (
+    "steps",
+    "title",
+    "summary",
+    "estimated_time",
+    "difficulty",
+    "prerequisites",
+    "common_mistakes",
+    "final_check",
+)
+
+DEFAULT_PREREQUISITES = ("确认网络连接稳定。", "准备好登录账号或必要权限。")
+DEFAULT_COMMON_MISTAKES = ("跳过关键确认步骤，导致结果与预期不一致。",)
+DEFAULT_FINAL_CHECK = ("确认目标操作已经成功完成。", "如结果异常，返回上一步重新检查输入。")
+
+
+def get_text_field(item: Dict[str, Any], keys: List[str]) -> Optional[str]:
+    for key in keys:
+        value = item.get(key)
+        if isinstance(value, str) and value.strip():
+            return value.strip()
+    return None
+
+
+def normalize_string_list(value: Any) -> List[str]:
+    if not isinstance(value, list):
+        return []
+    output: List[str] = []
+    for item in value:
+        if isinstance(item, str) and item.strip():
+            output.append(item.strip())
+    return output[:6]
+
+
+def _text_fields(item: Dict[str, Any]) -> Dict[str, str]:
+    """Every non-blank string field of ``item``, stripped once for all the lookups that follow."""
+    return {key: stripped for key, value in item.items() if isinstance(value, str) and (stripped := value.strip())}
+
+
+def _first(text: Dict[str, str], keys: Tuple[str, ...]) -> Optional[str]:
+    for key in keys:
+        value = text.get(key)
+        if value is not None:
+            return value
+    return None
+
+
+def build_chinese_description(item: Dict[str, Any], step_num: int) -> str:
+    return _describe(_text_fields(item), step_num)
+
+
+def _describe(text: Dict[str, str], step_num: int) -> str:
+    primary = _first(text, ("description", "action", "instruction", "content", "title"))
+    if not primary:
+        primary = f"完成第 {step_num} 步操作。"
+
+    extra_parts = [text[key] for key in ("target", "result", "tip", "note") if key in text]
+
+    description = primary.replace("\n", " ")
+    if extra_parts:
+        detail = "；".join(extra_parts[:2])
+        if detail not in description:
+            description = f"{description}（{detail}）"
+
+    if not _CJK_RE.search(description):
+        description = f"请执行该步骤：{description}"
+
+    return description
+
+
+def _json_text(value: Optional[str]) -> str:
+    return "null" if value is None else _encode_str(value)
+
+
+def _json_strings(values: List[str]) -> str:
+    return "[" + ",".join(map(_encode_str, values)) + "]"
+
+
+def _json_any(value: Any) -> str:
+    if isinstance(value, str):
+        return _encode_str(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class Step:
+    """One guide step; the rectangle is stored flat and nested again only on output."""
+
+    __slots__ = (
+        "step",
+        "title",
+        "description",
+        "purpose",
+        "expected_result",
+        "tip",
+        "warning",
+        "x",
+        "y",
+        "width",
+        "height",
+        "color",
+    )
+
+    def __init__(
+        self,
+        step: int,
+        description: str,
+        x: int = 0,
+        y: int = 0,
+        width: int = 120,
+        height: int = 40,
+        color: str = "#ff0000",
+        title: Optional[str] = None,
+        purpose: Optional[str] = None,
+        expected_result: Optional[str] = None,
+        tip: Optional[str] = None,
+        warning: Optional[str] = None,
+    ):
+        self.step = step
+        self.title = title
+        self.description = description
+        self.purpose = purpose
+        self.expected_result = expected_result
+        self.tip = tip
+        self.warning = warning
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.color = color
+
+    @classmethod
+    def from_raw(cls, item: Dict[str, Any], index: int) -> "Step":
+        """Normalize a step as the model wrote it (alternate field names included) in one pass."""
+        text = _text_fields(item)
+        rect = item.get("rect") or {}
+        if not isinstance(rect, dict):
+            rect = {}
+
+        step_num = item.get("step")
+        if not isinstance(step_num, int):
+            step_num = index
+
+        return cls(
+            step_num,
+            _describe(text, step_num),
+            int(rect.get("x", 0) or 0),
+            int(rect.get("y", 0) or 0),
+            int(rect.get("width", 120) or 120),
+            int(rect.get("height", 40) or 40),
+            text.get("color") or "#ff0000",
+            _first(text, ("title", "name", "step_title")) or f"步骤 {step_num}",
+            _first(text, ("purpose", "goal", "reason")),
+            _first(text, ("expected_result", "result", "outcome")),
+            _first(text, ("tip", "note")),
+            _first(text, ("warning", "risk", "caution")),
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Step":
+        """Rebuild a step this module wrote earlier (sessions, caches, built-in fallbacks)."""
+        rect = data.get("rect") or {}
+        return cls(
+            step=int(data.get("step") or 0),
+            title=data.get("title"),
+            description=data.get("description") or "",
+            purpose=data.get("purpose"),
+            expected_result=data.get("expected_result"),
+            tip=data.get("tip"),
+            warning=data.get("warning"),
+            x=int(rect.get("x", 0) or 0),
+            y=int(rect.get("y", 0) or 0),
+            width=int(rect.get("width", 120) or 120),
+            height=int(rect.get("height", 40) or 40),
+            color=data.get("color") or "#ff0000",
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "step": self.step,
+            "title": self.title,
+            "description": self.description,
+            "purpose": self.purpose,
+            "expected_result": self.expected_result,
+            "tip": self.tip,
+            "warning": self.warning,
+            "rect": {"x": self.x, "y": self.y, "width": self.width, "height": self.height},
+            "color": self.color,
+        }
+
+    def to_json(self) -> str:
+        return (
+            f'{{"step":{self.step},"title":{_json_text(self.title)},'
+            f'"description":{_encode_str(self.description)},"purpose":{_json_text(self.purpose)},'
+            f'"expected_result":{_json_text(self.expected_result)},"tip":{_json_text(self.tip)},'
+            f'"warning":{_json_text(self.warning)},'
+            f'"rect":{{"x":{self.x},"y":{self.y},"width":{self.width},"height":{self.height}}},'
+            f'"color":{_encode_str(self.color)}}}'
+        )
+
+    def scale(self, factor: float) -> None:
+        self.x = round(self.x * factor)
+        self.y = round(self.y * factor)
+        self.width = round(self.width * factor)
+        self.height = round(self.height * factor)
+
+
+class Guide:
+    """A normalized guide; handlers serialize it straight to JSON bytes with ``to_json``."""
+
+    __slots__ = GUIDE_FIELDS
+
+    def __init__(
+        self,
+        steps: List[Step],
+        title: str = "操作引导",
+        summary: str = "请按以下步骤操作。",
+        estimated_time: str = "约3分钟",
+        difficulty: str = "初级",
+        prerequisites: Optional[List[str]] = None,
+        common_mistakes: Optional[List[str]] = None,
+        final_check: Optional[List[str]] = None,
+    ):
+        self.steps = steps
+        self.title = title
+        self.summary = summary
+        self.estimated_time = estimated_time
+        self.difficulty = difficulty
+        self.prerequisites = prerequisites if prerequisites is not None else []
+        self.common_mistakes = common_mistakes if common_mistakes is not None else []
+        self.final_check = final_check if final_check is not None else []
+
+    @staticmethod
+    def normalize_steps(raw_steps: Any) -> List[Step]:
+        if not isinstance(raw_steps, list):
+            return []
+        return [Step.from_raw(item, index) for index, item in enumerate(raw_steps, start=1) if isinstance(item, dict)]
+
+    @classmethod
+    def from_raw(cls, data: Any) -> "Guide":
+        """Normalize a decoded model reply: a guide object, or a bare list of steps."""
+        guide = cls(cls.normalize_steps(data.get("steps", []) if isinstance(data, dict) else data))
+        if isinstance(data, dict):
+            for field in ("title", "summary", "estimated_time", "difficulty"):
+                value = data.get(field)
+                if isinstance(value, str) and value.strip():
+                    setattr(guide, field, value.strip())
+            guide.prerequisites = normalize_string_list(data.get("prerequisites"))
+            guide.common_mistakes = normalize_string_list(data.get("common_mistakes"))
+            guide.final_check = normalize_string_list(data.get("final_check"))
+        if not guide.prerequisites:
+            guide.prerequisites = list(DEFAULT_PREREQUISITES)
+        if not guide.common_mistakes:
+            guide.common_mistakes = list(DEFAULT_COMMON_MISTAKES)
+        if not guide.final_check:
+            guide.final_check = list(DEFAULT_FINAL_CHECK)
+        return guide
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Guide":
+        """Rebuild a guide this module wrote earlier; extra keys are ignored."""
+        guide = cls([Step.from_dict(step) for step in data.get("steps") or [] if isinstance(step, dict)])
+        for field in ("title", "summary", "estimated_time", "difficulty"):
+            if data.get(field):
+                setattr(guide, field, data[field])
+        for field in ("prerequisites", "common_mistakes", "final_check"):
+            setattr(guide, field, list(data.get(field) or []))
+        return guide
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "steps": [step.to_dict() for step in self.steps],
+            "title": self.title,
+            "summary": self.summary,
+            "estimated_time": self.estimated_time,
+            "difficulty": self.difficulty,
+            "prerequisites": list(self.prerequisites),
+            "common_mistakes": list(self.common_mistakes),
+            "final_check": list(self.final_check),
+        }
+
+    def scale_rects(self, factor: float) -> None:
+        for step in self.steps:
+            step.scale(factor)
+
+    def to_json(self, extra: Optional[Dict[str, Any]] = None, fields: Optional[frozenset] = None) -> bytes:
+        """UTF-8 JSON of the guide plus ``extra`` keys, limited to ``fields`` when given.
+
+        With orjson the slots are handed over as one flat dict (about 2.5x faster
+        than writing text in Python); without it the JSON is written field by
+        field, which still beats ``json.dumps`` over a dict copy.
+        """
+        if orjson is not None:
+            payload: Dict[str, Any] = {}
+            if fields is None or "steps" in fields:
+                payload["steps"] = [step.to_dict() for step in self.steps]
+            for field in GUIDE_FIELDS[1:]:
+                if fields is None or field in fields:
+                    payload[field] = getattr(self, field)
+            if extra:
+                for key, value in extra.items():
+                    if fields is None or key in fields:
+                        payload[key] = value
+            return orjson.dumps(payload, option=orjson.OPT_APPEND_NEWLINE)
+
+        parts: List[str] = []
+        if fields is None or "steps" in fields:
+            parts.append('"steps":[' + ",".join([step.to_json() for step in self.steps]) + "]")
+        for field in ("title", "summary", "estimated_time", "difficulty"):
+            if fields is None or field in fields:
+                parts.append(f'"{field}":{_json_text(getattr(self, field))}')
+        for field in ("prerequisites", "common_mistakes", "final_check"):
+            if fields is None or field in fields:
+                parts.append(f'"{field}":{_json_strings(getattr(self, field))}')
+        if extra:
+            for key, value in extra.items():
+                if fields is None or key in fields:
+                    parts.append(f"{_encode_str(key)}:{_json_any(value)}")
+        return ("{" + ",".join(parts) + "}\n").encode("utf-8")
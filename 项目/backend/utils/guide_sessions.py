@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from .image_prep import IMAGE_EXTENSIONS
+
+
+class GuideSessionStore:
+    """Short-lived sessions holding a generated guide and its screenshot.
+
+    Sessions live on disk (``<id>.json`` plus the screenshot as ``<id>.png``,
+    ``.jpg``, ``.gif`` or ``.webp``, after its format) rather than in
+    process memory, so a refine request can land on any worker on the host.
+    Every update refreshes the TTL; expired sessions are swept lazily.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: float = 900.0, max_sessions: int = 500):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max(max_sessions, 1)
+        self._sweep_interval = min(max(ttl_seconds / 10, 1.0), 60.0)
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, session_id: str, image_format: Optional[str] = None) -> Optional[Dict[str, str]]:
+        if len(session_id) != 32 or session_id.strip("0123456789abcdef"):
+            return None
+        base = os.path.join(self.directory, session_id)
+        return {"meta": f"{base}.json", "image": base + IMAGE_EXTENSIONS.get(image_format or "png", ".png")}
+
+    def create(
+        self,
+        image_path: str,
+        guide: Dict[str, Any],
+        note: str = "",
+        usage: Optional[Dict[str, Any]] = None,
+        image_sha256: Optional[str] = None,
+        image_size: Optional[List[int]] = None,
+        image_format: Optional[str] = None,
+        image_scale: float = 1.0,
+    ) -> str:
+        """Take ownership of ``image_path`` (it is moved, not copied) and return the new session id.
+
+        ``image_sha256`` is the digest of the stored file and ``image_format``
+        its format (``sniff_image`` names). ``image_size`` is the width and
+        height of the original screenshot, before any browser-side or
+        ``IMAGE_MAX_DIMENSION`` downscale; step rects are expressed in it, so
+        it can differ from the stored file's size. ``image_scale`` is stored
+        size / ``image_size``, for mapping rects onto the stored file.
+        """
+        self._maybe_sweep()
+        session_id = uuid.uuid4().hex
+        paths = self._paths(session_id, image_format)
+        shutil.move(image_path, paths["image"])
+        self._write(
+            paths["meta"],
+            {
+                "guide": guide,
+                "note": note,
+                "usage": usage,
+                "image_bytes": os.path.getsize(paths["image"]),
+                "image_sha256": image_sha256,
+                "image_format": image_format,
+                "image_size": image_size,
+                "image_scale": image_scale,
+                "created_at": time.time(),
+                "refinements": 0,
+            },
+        )
+        return session_id
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        paths = self._paths(session_id)
+        if paths is None:
+            return None
+        try:
+            if time.time() - os.path.getmtime(paths["meta"]) > self.ttl_seconds:
+                self._delete(session_id)
+                return None
+            with open(paths["meta"], "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        image_path = self._paths(session_id, record.get("image_format"))["image"]
+        if not os.path.exists(image_path):
+            return None
+        record["image_path"] = image_path
+        return record
+
+    def update(self, session_id: str, record: Dict[str, Any]) -> None:
+        paths = self._paths(session_id)
+        if paths is None:
+            raise ValueError(f"invalid session id: {session_id!r}")
+        self._write(paths["meta"], {key: value for key, value in record.items() if key != "image_path"})
+
+    @staticmethod
+    def _write(path: str, record: Dict[str, Any]) -> None:
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def _delete(self, session_id: str) -> None:
+        paths = self._paths(session_id)
+        base = os.path.splitext(paths["meta"])[0]
+        for path in [paths["meta"]] + [base + extension for extension in IMAGE_EXTENSIONS.values()]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _maybe_sweep(self) -> None:
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < self._sweep_interval:
+                return
+            self._last_sweep = now
+
+        latest: Dict[str, float] = {}
+        for name in os.listdir(self.directory):
+            session_id = name.split(".", 1)[0]
+            if self._paths(session_id) is None:
+                continue
+            try:
+                mtime = os.path.getmtime(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            latest[session_id] = max(mtime, latest.get(session_id, 0.0))
+
+        ordered = sorted(latest.items(), key=lambda item: item[1], reverse=True)
+        for index, (session_id, mtime) in enumerate(ordered):
+            # Leave room for the session about to be created.
+            if now - mtime > self.ttl_seconds or index >= self.max_sessions - 1:
+                self._delete(session_id)
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import collections
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from .metrics import UPSTREAM_PROBE_SECONDS, UPSTREAM_UP
+
+
+def _percentile(ordered: list, pct: float) -> Optional[float]:
+    if not ordered:
+        return None
+    index = min(int(round(pct / 100.0 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class UpstreamProber:
+    """Probes the upstream on a background thread and caches the outcome.
+
+    Readers only copy a pre-built snapshot dict, so health endpoints stay fast
+    and never spend quota or block a worker on the upstream.
+    """
+
+    def __init__(
+        self,
+        probe: Callable[[], Dict[str, Any]],
+        interval_seconds: float = 15.0,
+        window: int = 40,
+    ):
+        self.probe = probe
+        self.interval_seconds = max(interval_seconds, 1.0)
+        self._samples: Deque[Tuple[float, bool, float]] = collections.deque(maxlen=max(window, 1))
+        self._snapshot: Dict[str, Any] = {
+            "success": False,
+            "status": "pending",
+            "message": "上游探测尚未完成",
+            "checked_at": None,
+            "summary": self._summarize(),
+        }
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="guidebot-upstream-probe", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return self._snapshot
+
+    def probe_once(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            result = dict(self.probe())
+        except Exception as exc:  # probe implementations should not raise, but never kill the thread
+            result = {"success": False, "status": "exception", "message": str(exc)}
+        latency = time.perf_counter() - started
+        ok = bool(result.get("success"))
+
+        UPSTREAM_PROBE_SECONDS.observe(latency, outcome="ok" if ok else "error")
+        UPSTREAM_UP.set(1 if ok else 0)
+        with self._lock:
+            self._samples.append((time.time(), ok, latency))
+            result.update(
+                latency_ms=round(latency * 1000, 3),
+                checked_at=time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime()),
+                summary=self._summarize(),
+            )
+            # Swap in a new dict so readers never see a half-updated snapshot.
+            self._snapshot = result
+        return result
+
+    def _summarize(self) -> Dict[str, Any]:
+        samples = list(self._samples)
+        latencies = sorted(latency * 1000 for _, ok, latency in samples if ok)
+        errors = sum(1 for _, ok, _ in samples if not ok)
+        last_ok = next((ts for ts, ok, _ in reversed(samples) if ok), None)
+        return {
+            "window": len(samples),
+            "interval_seconds": self.interval_seconds,
+            "error_count": errors,
+            "error_rate": round(errors / len(samples), 4) if samples else None,
+            "latency_p50_ms": round(_percentile(latencies, 50), 3) if latencies else None,
+            "latency_p95_ms": round(_percentile(latencies, 95), 3) if latencies else None,
+            "latency_max_ms": round(latencies[-1], 3) if latencies else None,
+            "last_success_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(last_ok)) if last_ok else None,
+        }
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.probe_once()
+            self._stop.wait(self.interval_seconds)
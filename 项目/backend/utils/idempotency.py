@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # optional: entries stay per process on Windows
+    fcntl = None
+
+
+class IdempotencyEntry:
+    __slots__ = ("fingerprint", "created_at", "done", "status", "headers", "body")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.created_at = time.monotonic()
+        self.done = threading.Event()
+        self.status: Optional[int] = None
+        self.headers: List[Tuple[str, str]] = []
+        self.body = b""
+
+    @property
+    def completed(self) -> bool:
+        return self.done.is_set() and self.status is not None
+
+    @property
+    def finished(self) -> bool:
+        """The owner completed or abandoned the entry."""
+        return self.done.is_set()
+
+    def wait(self, timeout: float) -> bool:
+        return self.done.wait(timeout)
+
+
+class IdempotencyStore:
+    """In-process store of responses keyed by ``Idempotency-Key``.
+
+    The first request for a key becomes its owner and does the work;
+    concurrent duplicates wait on the owner's entry, later ones replay the
+    stored response until it expires. Entries are bounded by count and by
+    total body bytes, oldest first.
+    """
+
+    def __init__(self, ttl_seconds: float = 600.0, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(max_entries, 1)
+        self.max_bytes = max_bytes
+        self._entries: "collections.OrderedDict[str, IdempotencyEntry]" = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def begin(self, key: str, fingerprint: str) -> Tuple[IdempotencyEntry, bool]:
+        """Return the entry for ``key`` and whether the caller owns it (must complete or abandon it)."""
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry, False
+            entry = IdempotencyEntry(fingerprint)
+            self._entries[key] = entry
+            return entry, True
+
+    def complete(
+        self, key: str, entry: IdempotencyEntry, status: int, headers: List[Tuple[str, str]], body: bytes
+    ) -> None:
+        with self._lock:
+            entry.status, entry.headers, entry.body = status, headers, body
+            if self._entries.get(key) is entry:
+                self._bytes += len(body)
+                self._evict()
+        entry.done.set()
+
+    def abandon(self, key: str, entry: IdempotencyEntry) -> None:
+        """Forget an owned entry without a stored response, so the next retry does the work again."""
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.done.set()
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            # In-flight entries are never expired; the owner always finishes or abandons.
+            if entry.created_at > cutoff or not entry.done.is_set():
+                break
+            self._drop(key)
+
+    def _evict(self) -> None:
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_entries and self._bytes <= self.max_bytes:
+                break
+            if self._entries[key].done.is_set():
+                self._drop(key)
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+
+
+class SharedIdempotencyEntry(IdempotencyEntry):
+    __slots__ = ("_store", "_name", "_fd")
+
+    def __init__(self, store: "SharedIdempotencyStore", name: str, fingerprint: str, fd: Optional[int] = None):
+        super().__init__(fingerprint)
+        self._store = store
+        self._name = name
+        self._fd = fd
+
+    def wait(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        interval = 0.01
+        while not self.done.is_set():
+            # The owner may be another worker, so there is nothing to be woken by; poll its files.
+            if self._store._settled(self):
+                self.done.set()
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, 0.2)
+        return True
+
+
+class SharedIdempotencyStore(IdempotencyStore):
+    """``IdempotencyStore`` kept on disk, so a retry on another worker of the host finds the original.
+
+    A stored response is ``<digest>.resp`` (a JSON header line, then the
+    body), written aside and renamed into place. While the owner works it
+    holds an exclusive ``flock`` on ``<digest>.lock``, which also carries the
+    request fingerprint. Duplicates on any worker poll the two files. If the
+    owner dies, the kernel drops its lock and the next retry takes over.
+    Expired and excess responses are swept lazily, oldest first.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        ttl_seconds: float = 600.0,
+        max_entries: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        if fcntl is None:
+            raise RuntimeError("SharedIdempotencyStore needs fcntl (POSIX only)")
+        super().__init__(ttl_seconds, max_entries, max_bytes)
+        self.directory = directory
+        self._sweep_interval = min(max(ttl_seconds / 10, 1.0), 60.0)
+        self._last_sweep = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name: str, suffix: str) -> str:
+        return os.path.join(self.directory, name + suffix)
+
+    def begin(self, key: str, fingerprint: str) -> Tuple[IdempotencyEntry, bool]:
+        self._maybe_sweep()
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        lock_path = self._path(name, ".lock")
+        while True:
+            stored = self._load(name)
+            if stored is not None:
+                return stored, False
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                owner_fingerprint = os.pread(fd, 128, 0).decode("ascii", "replace")
+                os.close(fd)
+                if owner_fingerprint:
+                    return SharedIdempotencyEntry(self, name, owner_fingerprint), False
+                # The owner has the lock but has not written its fingerprint yet.
+                time.sleep(0.005)
+                continue
+            try:
+                current = os.stat(lock_path).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                current = False
+            stored = self._load(name) if current else None
+            if not current or stored is not None:
+                # Locked a marker its owner just removed, or the owner finished in between.
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+                if stored is not None:
+                    return stored, False
+                continue
+            data = fingerprint.encode("ascii")
+            os.pwrite(fd, data, 0)
+            os.ftruncate(fd, len(data))
+            return SharedIdempotencyEntry(self, name, fingerprint, fd), True
+
+    def complete(
+        self, key: str, entry: IdempotencyEntry, status: int, headers: List[Tuple[str, str]], body: bytes
+    ) -> None:
+        entry.status, entry.headers, entry.body = status, headers, body
+        path = self._path(entry._name, ".resp")
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        header = json.dumps({"fingerprint": entry.fingerprint, "status": status, "headers": headers})
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(header.encode("utf-8") + b"\n" + body)
+            os.replace(tmp_path, path)
+        finally:
+            # The response is in place before the marker goes, so a waiter that finds no marker finds it.
+            self._release(entry)
+
+    def abandon(self, key: str, entry: IdempotencyEntry) -> None:
+        self._release(entry)
+
+    def _release(self, entry: IdempotencyEntry) -> None:
+        if entry._fd is not None:
+            try:
+                os.remove(self._path(entry._name, ".lock"))
+            except FileNotFoundError:
+                pass
+            fcntl.flock(entry._fd, fcntl.LOCK_UN)
+            os.close(entry._fd)
+            entry._fd = None
+        entry.done.set()
+
+    def _load(self, name: str) -> Optional[SharedIdempotencyEntry]:
+        path = self._path(name, ".resp")
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                return None
+            with open(path, "rb") as f:
+                data = f.read()
+            header, _, body = data.partition(b"\n")
+            meta: Dict[str, Any] = json.loads(header)
+        except (OSError, ValueError):
+            return None
+        entry = SharedIdempotencyEntry(self, name, meta.get("fingerprint") or "")
+        entry.status = meta.get("status")
+        entry.headers = [(str(header_name), str(value)) for header_name, value in meta.get("headers") or []]
+        entry.body = body
+        entry.done.set()
+        return entry
+
+    def _settled(self, entry: SharedIdempotencyEntry) -> bool:
+        """Whether the owner of ``entry`` has finished; fills in the response if it completed."""
+        if self._owner_active(entry._name):
+            return False
+        stored = self._load(entry._name)
+        if stored is not None:
+            entry.status, entry.headers, entry.body = stored.status, stored.headers, stored.body
+        return True
+
+    def _owner_active(self, name: str) -> bool:
+        try:
+            fd = os.open(self._path(name, ".lock"), os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+        return False
+
+    def _maybe_sweep(self) -> None:
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < self._sweep_interval:
+                return
+            self._last_sweep = now
+
+        responses: List[Tuple[float, int, str]] = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if name.endswith(".resp"):
+                responses.append((stat.st_mtime, stat.st_size, path))
+            elif name.endswith(".tmp") and now - stat.st_mtime > self.ttl_seconds:
+                self._remove(path)
+            elif name.endswith(".lock") and now - stat.st_mtime > self.ttl_seconds:
+                self._remove_abandoned_marker(path)
+
+        responses.sort(reverse=True)
+        total_bytes = 0
+        for index, (mtime, size, path) in enumerate(responses):
+            total_bytes += size
+            if now - mtime > self.ttl_seconds or index >= self.max_entries or total_bytes > self.max_bytes:
+                self._remove(path)
+
+    @staticmethod
+    def _remove_abandoned_marker(path: str) -> None:
+        """Remove a marker left by an owner that died; a live owner still holds its lock."""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                os.remove(path)
+        except (BlockingIOError, FileNotFoundError):
+            pass
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
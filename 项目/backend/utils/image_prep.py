@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import base64
+import binascii
+import concurrent.futures
+import hashlib
+import io
+import multiprocessing
+import os
+import struct
+import threading
+from multiprocessing import shared_memory
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:  # optional: uploads are validated and hashed but never resized
+    Image = None
+
+from .metrics import IMAGE_PREP_TASKS
+
+
+class InvalidImage(ValueError):
+    """The upload is not valid base64 or not an image in a supported format."""
+
+
+def sniff_image(data: bytes) -> Tuple[str, int, int]:
+    """(format, width, height) from the file header alone; raises ``InvalidImage``."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24 and data[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", data[16:24])
+        return "png", width, height
+    if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        width, height = struct.unpack("<HH", data[6:10])
+        return "gif", width, height
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP" and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b"VP8 ":
+            width, height = struct.unpack("<HH", data[26:30])
+            return "webp", width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L":
+            bits = int.from_bytes(data[21:25], "little")
+            return "webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            width = int.from_bytes(data[24:27], "little") + 1
+            height = int.from_bytes(data[27:30], "little") + 1
+            return "webp", width, height
+    if data[:2] == b"\xff\xd8":
+        return ("jpeg",) + _jpeg_size(data)
+    raise InvalidImage("不支持的图片格式，仅支持 PNG/JPEG/GIF/WebP")
+
+
+IMAGE_EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "gif": ".gif", "webp": ".webp"}
+IMAGE_MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "gif": "image/gif", "webp": "image/webp"}
+
+
+def sniff_format(data: bytes) -> Optional[str]:
+    """Format name from the magic bytes alone, or None; unlike ``sniff_image`` it never raises."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:2] == b"\xff\xd8":
+        return "jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return None
+
+
+def data_url_prefix(data: bytes) -> str:
+    """``data:<mime>;base64,`` for image bytes, typed by their header (PNG when unrecognized)."""
+    return f"data:{IMAGE_MIME_TYPES[sniff_format(data) or 'png']};base64,"
+
+
+def image_data_url(data: bytes) -> str:
+    return data_url_prefix(data) + base64.b64encode(data).decode("ascii")
+
+
+def _jpeg_size(data: bytes) -> Tuple[int, int]:
+    index = 2
+    while index + 9 < len(data):
+        if data[index] != 0xFF:
+            index += 1
+            continue
+        marker = data[index + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+            index += 1 if marker == 0xFF else 2
+            continue
+        length = struct.unpack(">H", data[index + 2 : index + 4])[0]
+        # SOF0..SOF15 except DHT (C4), JPG (C8) and DAC (CC) carry the frame size.
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[index + 5 : index + 9])
+            return width, height
+        index += 2 + length
+    raise InvalidImage("JPEG 文件缺少尺寸信息")
+
+
+def prepare_image(encoded: Any, path: str, max_dimension: int = 0, max_pixels: int = 0) -> Dict[str, Any]:
+    """Decode base64 ``encoded``, validate it, downscale if needed, write it next to ``path`` and hash it.
+
+    The file gets the extension of the stored format (``path``'s own is
+    replaced), and ``path`` in the result is where it was written.
+    ``encoded`` may be any bytes-like object (a shared-memory view included).
+    ``scale`` in the result is stored size / original size, for mapping
+    coordinates back to the uploaded image. ``sha256`` is the digest of the
+    decoded upload, so clients can match it against what they sent;
+    ``stored_sha256`` is the digest of the file written, which differs only
+    when the image was downscaled.
+    """
+    try:
+        data = binascii.a2b_base64(encoded)
+    except (binascii.Error, ValueError) as exc:
+        raise InvalidImage(f"图片 Base64 数据无效: {exc}") from exc
+    image_format, width, height = sniff_image(data)
+    if not width or not height:
+        raise InvalidImage("图片尺寸无效")
+    if max_pixels and width * height > max_pixels:
+        raise InvalidImage(f"图片像素过多（{width}x{height}）")
+    sha256 = hashlib.sha256(data).hexdigest()
+    stored_sha256 = sha256
+
+    scale = 1.0
+    if max_dimension and max(width, height) > max_dimension and Image is not None:
+        scale = max_dimension / max(width, height)
+        with Image.open(io.BytesIO(data)) as image:
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            resized = image.resize((max(round(width * scale), 1), max(round(height * scale), 1)), Image.LANCZOS)
+            buffer = io.BytesIO()
+            resized.save(buffer, format="PNG")
+        data = buffer.getvalue()
+        image_format = "png"
+        stored_sha256 = hashlib.sha256(data).hexdigest()
+
+    path = os.path.splitext(path)[0] + IMAGE_EXTENSIONS[image_format]
+    with open(path, "wb") as f:
+        f.write(data)
+    return {
+        "path": path,
+        "format": image_format,
+        "width": width,
+        "height": height,
+        "scale": scale,
+        "bytes": len(data),
+        "sha256": sha256,
+        "stored_sha256": stored_sha256,
+    }
+
+
+def _prepare_from_shared_memory(
+    name: str, size: int, path: str, max_dimension: int, max_pixels: int
+) -> Dict[str, Any]:
+    """Pool entry point: read the base64 text straight out of the parent's shared-memory block."""
+    # Workers share the parent's resource tracker, so attaching re-registers the same
+    # name and the parent's unlink() clears it once; the worker only closes its mapping.
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        view = block.buf[:size]
+        try:
+            return prepare_image(view, path, max_dimension, max_pixels)
+        finally:
+            view.release()
+    finally:
+        block.close()
+
+
+class ImagePrepPool:
+    """Runs ``prepare_image`` in worker processes so multi-MB uploads do not hold the request threads' GIL.
+
+    The base64 text is copied once into a shared-memory block and only its
+    name crosses the process boundary; the worker writes the decoded image to
+    disk itself, so no image buffer is ever pickled. If the pool breaks, the
+    work runs inline and the pool is rebuilt on next use.
+    """
+
+    def __init__(self, workers: int, timeout_seconds: float = 30.0, max_dimension: int = 0, max_pixels: int = 0):
+        self.workers = max(workers, 0)
+        self.timeout_seconds = timeout_seconds
+        self.max_dimension = max_dimension
+        self.max_pixels = max_pixels
+        self._executor: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> Optional[concurrent.futures.ProcessPoolExecutor]:
+        if self.workers <= 0:
+            return None
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # spawn: the parent runs threads, which fork would copy in an arbitrary state.
+                    self._executor = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+        return self._executor
+
+    def warm_up(self) -> None:
+        """Start every worker process now rather than on the first uploads."""
+        executor = self._get_executor()
+        if executor is not None:
+            for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+                future.result(timeout=self.timeout_seconds)
+
+    def prepare(self, encoded: str, path: str) -> Dict[str, Any]:
+        """Prepare a base64 upload (data-URL prefix allowed) next to ``path``; raises ``InvalidImage``."""
+        start = encoded.find(",", 0, 256) + 1  # skip a "data:image/...;base64," prefix
+        executor = self._get_executor()
+        if executor is None:
+            return self._inline(encoded[start:].encode("ascii", "ignore"), path)
+
+        payload = encoded.encode("ascii", "ignore")
+        size = len(payload) - start
+        if size <= 0:
+            raise InvalidImage("图片 Base64 数据为空")
+        block = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            block.buf[:size] = memoryview(payload)[start:]
+            del payload
+            future = executor.submit(
+                _prepare_from_shared_memory, block.name, size, path, self.max_dimension, self.max_pixels
+            )
+            try:
+                result = future.result(timeout=self.timeout_seconds)
+            except InvalidImage:
+                IMAGE_PREP_TASKS.inc(mode="pool", outcome="invalid")
+                raise
+            except concurrent.futures.process.BrokenProcessPool:
+                with self._lock:
+                    self._executor = None
+                IMAGE_PREP_TASKS.inc(mode="pool", outcome="broken")
+                return self._inline(bytes(block.buf[:size]), path)
+        finally:
+            block.close()
+            block.unlink()
+        IMAGE_PREP_TASKS.inc(mode="pool", outcome="ok")
+        return result
+
+    def _inline(self, encoded: bytes, path: str) -> Dict[str, Any]:
+        try:
+            result = prepare_image(encoded, path, self.max_dimension, self.max_pixels)
+        except InvalidImage:
+            IMAGE_PREP_TASKS.inc(mode="inline", outcome="invalid")
+            raise
+        IMAGE_PREP_TASKS.inc(mode="inline", outcome="ok")
+        return result
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import email.utils
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import requests
+
+from .metrics import KEY_LATENCY_SECONDS, KEY_OUTSTANDING, KEY_REQUESTS, KEY_STATE
+
+# Statuses that mean the credential itself is unusable, not that the request failed.
+INVALID_KEY_STATUSES = frozenset({401, 403})
+# Statuses after which the same request is worth retrying immediately on another key.
+KEY_ROTATE_STATUSES = INVALID_KEY_STATUSES | {429}
+
+
+class KeyPoolExhausted(requests.RequestException):
+    """No usable key within the wait budget. A RequestException so the retry loop treats it like a network error."""
+
+
+def parse_retry_after(value: Optional[str], default: float) -> float:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return default
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    return max(parsed.timestamp() - time.time(), 0.0)
+
+
+class PooledKey:
+    __slots__ = (
+        "key",
+        "label",
+        "outstanding",
+        "cooldown_until",
+        "recovering",
+        "disabled_reason",
+        "requests",
+        "throttled",
+        "errors",
+    )
+
+    def __init__(self, key: str, index: int):
+        self.key = key
+        # Never export the secret: index plus the last four characters.
+        self.label = f"key{index}:...{key[-4:]}" if len(key) > 8 else f"key{index}"
+        self.outstanding = 0
+        self.cooldown_until = 0.0
+        # After a 429 the key takes one request at a time until a call gets through,
+        # so waiters released by the same cooldown do not all hit the limit again.
+        self.recovering = False
+        self.disabled_reason: Optional[str] = None
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def state(self, now: float) -> str:
+        if self.disabled_reason:
+            return "disabled"
+        if self.cooldown_until > now:
+            return "cooling_down"
+        return "available"
+
+
+class KeyPool:
+    """Spreads upstream calls across API keys by least outstanding requests.
+
+    A key answered with 429 sits out for its Retry-After period; a key answered
+    with 401/403 is disabled for the life of the process.
+    """
+
+    def __init__(self, keys: Sequence[str], default_cooldown_seconds: float = 1.0, max_wait_seconds: float = 10.0):
+        unique = list(dict.fromkeys(key.strip() for key in keys if key and key.strip()))
+        self._keys = [PooledKey(key, index) for index, key in enumerate(unique)]
+        self.default_cooldown_seconds = default_cooldown_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self._cond = threading.Condition()
+        now = time.monotonic()
+        for pooled in self._keys:
+            self._export_state(pooled, now)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _pick(self, now: float) -> Optional[PooledKey]:
+        candidates = [
+            pooled
+            for pooled in self._keys
+            if pooled.state(now) == "available" and not (pooled.recovering and pooled.outstanding)
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda pooled: (pooled.outstanding, pooled.requests))
+
+    def has_available(self) -> bool:
+        with self._cond:
+            return self._pick(time.monotonic()) is not None
+
+    def acquire(self, max_wait_seconds: Optional[float] = None) -> PooledKey:
+        """Reserve the least-loaded usable key, waiting out cooldowns up to ``max_wait_seconds``."""
+        budget = self.max_wait_seconds if max_wait_seconds is None else max_wait_seconds
+        deadline = time.monotonic() + budget
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                pooled = self._pick(now)
+                if pooled is not None:
+                    pooled.outstanding += 1
+                    pooled.requests += 1
+                    KEY_OUTSTANDING.set(pooled.outstanding, key=pooled.label)
+                    self._export_state(pooled, now)
+                    return pooled
+
+                cooling = [item.cooldown_until for item in self._keys if not item.disabled_reason]
+                if not cooling:
+                    raise KeyPoolExhausted("所有 API Key 均已失效")
+                # A recovering key in use frees up on release (notify), not on a timer.
+                wake_at = min(max(min(cooling), now + 0.05), deadline)
+                if wake_at <= now:
+                    raise KeyPoolExhausted(f"所有 API Key 均被限流，{budget:g} 秒内无可用 Key")
+                self._cond.wait(wake_at - now)
+
+    def release(
+        self, pooled: PooledKey, status: Optional[int], latency_seconds: float, retry_after: Optional[str] = None
+    ) -> None:
+        """Return a key after a call; ``status`` None means the request raised."""
+        with self._cond:
+            pooled.outstanding = max(pooled.outstanding - 1, 0)
+            now = time.monotonic()
+            if status == 429:
+                pooled.throttled += 1
+                cooldown = parse_retry_after(retry_after, self.default_cooldown_seconds)
+                pooled.cooldown_until = max(pooled.cooldown_until, now + cooldown)
+                pooled.recovering = True
+            elif status in INVALID_KEY_STATUSES:
+                pooled.disabled_reason = f"http_{status}"
+            elif status is None or status >= 500:
+                pooled.errors += 1
+            else:
+                pooled.recovering = False
+            self._cond.notify_all()
+
+        KEY_OUTSTANDING.set(pooled.outstanding, key=pooled.label)
+        KEY_REQUESTS.inc(key=pooled.label, status=str(status) if status is not None else "exception")
+        KEY_LATENCY_SECONDS.observe(latency_seconds, key=pooled.label)
+        self._export_state(pooled, now)
+
+    @staticmethod
+    def _export_state(pooled: PooledKey, now: float) -> None:
+        current = pooled.state(now)
+        for state in ("available", "cooling_down", "disabled"):
+            KEY_STATE.set(1 if state == current else 0, key=pooled.label, state=state)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._cond:
+            now = time.monotonic()
+            return [
+                {
+                    "key": pooled.label,
+                    "state": pooled.state(now),
+                    "outstanding": pooled.outstanding,
+                    "requests": pooled.requests,
+                    "throttled": pooled.throttled,
+                    "errors": pooled.errors,
+                    "cooldown_remaining_seconds": round(max(pooled.cooldown_until - now, 0.0), 3),
+                    "disabled_reason": pooled.disabled_reason,
+                }
+                for pooled in self._keys
+            ]
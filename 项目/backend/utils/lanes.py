@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import collections
+import threading
+import time
+from typing import Any, Deque, Dict, Optional
+
+import requests
+
+from .metrics import LANE_BORROWED, LANE_IN_USE, LANE_QUEUE_SECONDS, LANE_QUEUED
+
+
+class LaneQueueTimeout(requests.RequestException):
+    """No seat in the lane within the wait budget; handled like any other upstream failure."""
+
+
+class _LaneWaiter:
+    __slots__ = ("event", "granted", "enqueued_at")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+
+class LaneScheduler:
+    """Concurrency lanes for upstream calls, one per source type.
+
+    Each lane owns ``quotas[lane]`` seats. A lane may go past its quota by up
+    to ``borrow_limits[lane]`` seats while other lanes leave theirs idle.
+    Borrowed seats are not preempted: a lane that wants its seats back has
+    its waiters served first as soon as any seat frees up.
+    """
+
+    def __init__(self, quotas: Dict[str, int], borrow_limits: Optional[Dict[str, int]] = None):
+        self.quotas = {lane: max(quota, 1) for lane, quota in quotas.items()}
+        self.capacity = sum(self.quotas.values())
+        limits = borrow_limits or {}
+        self.borrow_limits = {
+            # By default a lane may take at most half of the other lanes' seats.
+            lane: max(limits.get(lane, (self.capacity - quota) // 2), 0)
+            for lane, quota in self.quotas.items()
+        }
+        self._in_use = {lane: 0 for lane in self.quotas}
+        self._total = 0
+        self._waiters: Dict[str, Deque[_LaneWaiter]] = {lane: collections.deque() for lane in self.quotas}
+        self._lock = threading.Lock()
+
+    def _admissible(self, lane: str) -> bool:
+        if self._total >= self.capacity:
+            return False
+        return self._in_use[lane] < self.quotas[lane] + self.borrow_limits[lane]
+
+    def _grant(self, lane: str) -> None:
+        if self._in_use[lane] >= self.quotas[lane]:
+            LANE_BORROWED.inc(lane=lane)
+        self._in_use[lane] += 1
+        self._total += 1
+        LANE_IN_USE.set(self._in_use[lane], lane=lane)
+
+    def acquire(self, lane: str, timeout: Optional[float] = None) -> float:
+        """Take a seat in ``lane`` and return the seconds spent queueing; raises ``LaneQueueTimeout``."""
+        started = time.monotonic()
+        with self._lock:
+            # Queue behind earlier waiters of the same lane, and behind any lane waiting
+            # for its own seats back, rather than borrowing ahead of them.
+            if not self._waiters[lane] and self._admissible(lane) and (
+                self._in_use[lane] < self.quotas[lane] or not self._owner_waiting()
+            ):
+                self._grant(lane)
+                LANE_QUEUE_SECONDS.observe(0.0, lane=lane, outcome="granted")
+                return 0.0
+            waiter = _LaneWaiter()
+            self._waiters[lane].append(waiter)
+            LANE_QUEUED.set(len(self._waiters[lane]), lane=lane)
+
+        granted = waiter.event.wait(timeout)
+        with self._lock:
+            if not granted and not waiter.granted:
+                self._waiters[lane].remove(waiter)
+                LANE_QUEUED.set(len(self._waiters[lane]), lane=lane)
+        waited = time.monotonic() - started
+        if waiter.granted:
+            LANE_QUEUE_SECONDS.observe(waited, lane=lane, outcome="granted")
+            return waited
+        LANE_QUEUE_SECONDS.observe(waited, lane=lane, outcome="timeout")
+        raise LaneQueueTimeout(f"{lane} 通道排队超过 {waited:.1f} 秒")
+
+    def release(self, lane: str) -> None:
+        with self._lock:
+            self._in_use[lane] -= 1
+            self._total -= 1
+            LANE_IN_USE.set(self._in_use[lane], lane=lane)
+            self._dispatch()
+
+    def _owner_waiting(self) -> bool:
+        return any(self._waiters[lane] and self._in_use[lane] < self.quotas[lane] for lane in self.quotas)
+
+    def _dispatch(self) -> None:
+        while self._total < self.capacity:
+            # Lanes below their own quota first, then lanes that may borrow; oldest waiter wins within a tier.
+            waiting = [lane for lane in self.quotas if self._waiters[lane]]
+            candidates = [lane for lane in waiting if self._in_use[lane] < self.quotas[lane]]
+            if not candidates:
+                candidates = [lane for lane in waiting if self._admissible(lane)]
+            if not candidates:
+                return
+            lane = min(candidates, key=lambda name: self._waiters[name][0].enqueued_at)
+            waiter = self._waiters[lane].popleft()
+            LANE_QUEUED.set(len(self._waiters[lane]), lane=lane)
+            waiter.granted = True
+            self._grant(lane)
+            waiter.event.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                lane: {
+                    "quota": self.quotas[lane],
+                    "borrow_limit": self.borrow_limits[lane],
+                    "in_use": self._in_use[lane],
+                    "queued": len(self._waiters[lane]),
+                }
+                for lane in self.quotas
+            }
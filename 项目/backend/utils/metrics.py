@@ -0,0 +1,642 @@
+from __future__ import annotations
+
+import atexit
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # optional: metrics stay per process on Windows
+    fcntl = None
+
+# Seconds. Covers sub-millisecond parsing up to minute-long upstream calls.
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 90.0, 120.0,
+)
+
+_current_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("guidebot_endpoint", default="none")
+_current_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "guidebot_stage_timings", default=None
+)
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def items(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self._lock:
+            return sorted(self._values.items())
+
+    def render(
+        self,
+        items: Optional[List[Tuple[Tuple[str, ...], float]]] = None,
+        label_names: Optional[Sequence[str]] = None,
+    ) -> List[str]:
+        """Exposition lines for this process's values, or for ``items`` merged from other workers."""
+        if items is None:
+            items = self.items()
+        label_names = self.label_names if label_names is None else label_names
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """A value that goes up and down.
+
+    ``multiprocess_mode`` says how workers' values combine in a shared
+    registry: ``sum`` adds them (slots in use, queue lengths), ``all`` keeps
+    one series per live worker under an extra ``pid`` label.
+    """
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (), multiprocess_mode: str = "all"):
+        super().__init__(name, help_text, label_names)
+        self.multiprocess_mode = multiprocess_mode
+
+    def set(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = value
+
+    def render(
+        self,
+        items: Optional[List[Tuple[Tuple[str, ...], float]]] = None,
+        label_names: Optional[Sequence[str]] = None,
+    ) -> List[str]:
+        lines = super().render(items, label_names)
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = ([0] * (len(self.buckets) + 1), [0.0])
+                self._values[key] = entry
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def count(self, **labels: str) -> int:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            entry = self._values.get(key)
+            return sum(entry[0]) if entry else 0
+
+    def items(self) -> List[Tuple[Tuple[str, ...], List[int], float]]:
+        with self._lock:
+            return [(key, list(counts), total[0]) for key, (counts, total) in sorted(self._values.items())]
+
+    def render(self, items: Optional[List[Tuple[Tuple[str, ...], List[int], float]]] = None) -> List[str]:
+        if items is None:
+            items = self.items()
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """The process's metrics, optionally merged with the other workers on the host at render time.
+
+    After ``share(directory)`` each process that serves requests writes its
+    values to ``<directory>/<pid>-<token>.json`` every ``flush_seconds``, at
+    exit and before every render. ``render`` then sums counters and
+    histograms over every file. Gauges are combined per their
+    ``multiprocess_mode``. Files of workers that have exited are folded into
+    ``archive.json``, so totals never go backwards when a worker is recycled.
+    A forked child starts from the values it inherited, and the parent writes
+    its own before each fork, so counts from before a preload fork are not
+    repeated once per worker.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: List[object] = []
+        self._lock = threading.Lock()
+        self._directory: Optional[str] = None
+        self._flush_seconds = 5.0
+        self._token = uuid.uuid4().hex[:8]
+        self._flusher_pid: Optional[int] = None
+        # Values inherited over a fork, subtracted from what this process writes.
+        self._baseline: Dict[str, Dict[Tuple[str, ...], Any]] = {}
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, label_names)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def gauge(
+        self, name: str, help_text: str, label_names: Sequence[str] = (), multiprocess_mode: str = "all"
+    ) -> Gauge:
+        metric = Gauge(name, help_text, label_names, multiprocess_mode)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name, help_text, label_names, buckets)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def share(self, directory: str, flush_seconds: float = 5.0) -> None:
+        if fcntl is None:
+            raise RuntimeError("shared metrics need fcntl (POSIX only)")
+        os.makedirs(directory, exist_ok=True)
+        first = self._directory is None
+        self._directory = directory
+        self._flush_seconds = max(flush_seconds, 0.5)
+        if first:
+            os.register_at_fork(before=self._before_fork, after_in_child=self._after_fork_in_child)
+
+    def ensure_flusher(self) -> None:
+        """Start this process's periodic write on its first request; processes that never serve skip it."""
+        if self._directory is None or self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+        atexit.register(self._flush_quietly)
+
+    def _flush_loop(self) -> None:
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            time.sleep(self._flush_seconds)
+            self._flush_quietly()
+
+    def _flush_quietly(self, include_gauges: bool = True) -> None:
+        try:
+            self._write(include_gauges)
+        except OSError:
+            pass
+
+    def _before_fork(self) -> None:
+        if self._directory is not None:
+            # Gauges only from processes that serve; a preloading master's would be noise.
+            self._flush_quietly(include_gauges=self._flusher_pid == os.getpid())
+
+    def _after_fork_in_child(self) -> None:
+        self._lock = threading.Lock()
+        self._token = uuid.uuid4().hex[:8]
+        self._flusher_pid = None
+        self._baseline = {}
+        for metric in self._metrics:
+            if isinstance(metric, Histogram):
+                self._baseline[metric.name] = {key: (counts, total) for key, counts, total in metric.items()}
+            elif not isinstance(metric, Gauge):
+                self._baseline[metric.name] = dict(metric.items())  # type: ignore[attr-defined]
+
+    def _snapshot(self, include_gauges: bool) -> Dict[str, Any]:
+        counters: Dict[str, List[Any]] = {}
+        histograms: Dict[str, List[Any]] = {}
+        gauges: Dict[str, List[Any]] = {}
+        for metric in list(self._metrics):
+            baseline = self._baseline.get(metric.name, {})  # type: ignore[attr-defined]
+            if isinstance(metric, Histogram):
+                rows = []
+                for key, counts, total in metric.items():
+                    base_counts, base_total = baseline.get(key, ([0] * len(counts), 0.0))
+                    counts = [count - base for count, base in zip(counts, base_counts)]
+                    if any(counts):
+                        rows.append([list(key), counts, total - base_total])
+                histograms[metric.name] = rows
+            elif isinstance(metric, Gauge):
+                if include_gauges:
+                    gauges[metric.name] = [[list(key), value] for key, value in metric.items()]
+            else:
+                items = metric.items()  # type: ignore[attr-defined]
+                rows = [[list(key), value - baseline.get(key, 0.0)] for key, value in items]
+                counters[metric.name] = [row for row in rows if row[1]]
+        return {"pid": os.getpid(), "counters": counters, "histograms": histograms, "gauges": gauges}
+
+    def _write(self, include_gauges: bool = True) -> None:
+        path = os.path.join(self._directory, f"{os.getpid()}-{self._token}.json")
+        # The flush thread and a render may write at once.
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._snapshot(include_gauges), f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def _collect(self) -> Tuple[Dict[str, Dict[Tuple[str, ...], Any]], Dict[str, Dict[Tuple[str, ...], Any]]]:
+        """Merge every worker's file: (summed counters and histograms, gauges with the file's pid)."""
+        totals: Dict[str, Dict[Tuple[str, ...], Any]] = {}
+        gauges: Dict[str, Dict[Tuple[str, ...], Any]] = {}
+        archive_path = os.path.join(self._directory, "archive.json")
+        lock_fd = os.open(os.path.join(self._directory, ".lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            archive = _read_snapshot(archive_path) or {"counters": {}, "histograms": {}}
+            archived: Dict[str, Dict[Tuple[str, ...], Any]] = {}
+            _add_snapshot(archived, archive)
+            exited: List[str] = []
+            for name in sorted(os.listdir(self._directory)):
+                if not name.endswith(".json") or name == "archive.json":
+                    continue
+                path = os.path.join(self._directory, name)
+                snapshot = _read_snapshot(path)
+                if snapshot is None:
+                    continue
+                pid = int(snapshot.get("pid") or 0)
+                if _pid_alive(pid):
+                    _add_snapshot(totals, snapshot)
+                    for metric, rows in (snapshot.get("gauges") or {}).items():
+                        merged = gauges.setdefault(metric, {})
+                        for key, value in rows:
+                            merged[(str(pid),) + tuple(key)] = value
+                else:
+                    _add_snapshot(archived, snapshot)
+                    exited.append(path)
+            if exited:
+                _write_archive(archive_path, archived)
+                for path in exited:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            for metric, rows in archived.items():
+                merged = totals.setdefault(metric, {})
+                for key, value in rows.items():
+                    merged[key] = _add_values(merged.get(key), value)
+        finally:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+        return totals, gauges
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        if self._directory is None:
+            lines: List[str] = []
+            for metric in metrics:
+                lines.extend(metric.render())  # type: ignore[attr-defined]
+            return "\n".join(lines) + "\n"
+
+        self._flush_quietly()
+        totals, gauges = self._collect()
+        lines = []
+        for metric in metrics:
+            if isinstance(metric, Histogram):
+                rows = totals.get(metric.name, {})
+                lines.extend(metric.render([(key, counts, total) for key, (counts, total) in sorted(rows.items())]))
+            elif isinstance(metric, Gauge):
+                rows = gauges.get(metric.name, {})
+                if metric.multiprocess_mode == "sum":
+                    summed: Dict[Tuple[str, ...], float] = {}
+                    for key, value in rows.items():
+                        summed[key[1:]] = summed.get(key[1:], 0.0) + value
+                    lines.extend(metric.render(sorted(summed.items())))
+                else:
+                    lines.extend(metric.render(sorted(rows.items()), ("pid",) + metric.label_names))
+            else:
+                lines.extend(metric.render(sorted(totals.get(metric.name, {}).items())))  # type: ignore[attr-defined]
+        return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_snapshot(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _add_values(current: Any, value: Any) -> Any:
+    """Sum a counter value, or a histogram's (bucket counts, sum) pair."""
+    if current is None:
+        return value
+    if isinstance(value, tuple):
+        return [a + b for a, b in zip(current[0], value[0])], current[1] + value[1]
+    return current + value
+
+
+def _add_snapshot(totals: Dict[str, Dict[Tuple[str, ...], Any]], snapshot: Dict[str, Any]) -> None:
+    for metric, rows in (snapshot.get("counters") or {}).items():
+        merged = totals.setdefault(metric, {})
+        for key, value in rows:
+            merged[tuple(key)] = _add_values(merged.get(tuple(key)), value)
+    for metric, rows in (snapshot.get("histograms") or {}).items():
+        merged = totals.setdefault(metric, {})
+        for key, counts, total in rows:
+            merged[tuple(key)] = _add_values(merged.get(tuple(key)), (counts, total))
+
+
+def _write_archive(path: str, archived: Dict[str, Dict[Tuple[str, ...], Any]]) -> None:
+    counters: Dict[str, List[Any]] = {}
+    histograms: Dict[str, List[Any]] = {}
+    for metric, rows in archived.items():
+        for key, value in rows.items():
+            if isinstance(value, tuple):
+                histograms.setdefault(metric, []).append([list(key), list(value[0]), value[1]])
+            else:
+                counters.setdefault(metric, []).append([list(key), value])
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"counters": counters, "histograms": histograms}, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+# One registry per process. app.py calls REGISTRY.share() so that, under
+# serve.py's multi-worker Gunicorn, /api/metrics reports the whole host
+# rather than whichever worker took the scrape.
+REGISTRY = MetricsRegistry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "guidebot_request_seconds",
+    "End-to-end Flask request latency by endpoint and status code.",
+    ["endpoint", "status"],
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "guidebot_stage_seconds",
+    "Latency of individual pipeline stages by endpoint.",
+    ["endpoint", "stage"],
+)
+UPSTREAM_RESPONSES = REGISTRY.counter(
+    "guidebot_upstream_responses_total",
+    "Upstream chat completion responses by HTTP status (or 'exception').",
+    ["status"],
+)
+UPSTREAM_RETRIES = REGISTRY.counter(
+    "guidebot_upstream_retries_total",
+    "Upstream retries by reason.",
+    ["reason"],
+)
+FALLBACKS = REGISTRY.counter(
+    "guidebot_fallback_total",
+    "Responses that fell back to mock guides, by endpoint and reason.",
+    ["endpoint", "reason"],
+)
+UPSTREAM_TOKENS = REGISTRY.counter(
+    "guidebot_upstream_tokens_total",
+    "Token usage reported by the upstream, by kind.",
+    ["kind"],
+)
+STARTUP_SECONDS = REGISTRY.gauge(
+    "guidebot_startup_seconds",
+    "Cold-start time of this process by warm-up phase.",
+    ["phase"],
+)
+UPSTREAM_PROBE_SECONDS = REGISTRY.histogram(
+    "guidebot_upstream_probe_seconds",
+    "Latency of background upstream reachability probes by outcome.",
+    ["outcome"],
+)
+COMPRESSION_SECONDS = REGISTRY.histogram(
+    "guidebot_compression_cpu_seconds",
+    "CPU time spent compressing response bodies by endpoint and encoding.",
+    ["endpoint", "encoding"],
+)
+COMPRESSION_RATIO = REGISTRY.histogram(
+    "guidebot_compression_ratio",
+    "Compressed size divided by original size, by endpoint and encoding.",
+    ["endpoint", "encoding"],
+    buckets=(0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1.0),
+)
+RESPONSE_BYTES = REGISTRY.counter(
+    "guidebot_response_bytes_total",
+    "Response body bytes before ('original') and after ('sent') content encoding.",
+    ["endpoint", "encoding", "kind"],
+)
+REFINE_SAVINGS = REGISTRY.counter(
+    "guidebot_refine_savings_total",
+    "Work avoided by session-based refinement: re-upload bytes and upstream tokens.",
+    ["kind"],
+)
+IDEMPOTENT_DUPLICATES = REGISTRY.counter(
+    "guidebot_idempotent_duplicates_total",
+    "Duplicate requests answered from an Idempotency-Key entry instead of redoing the work.",
+    ["endpoint", "outcome"],
+)
+KEY_REQUESTS = REGISTRY.counter(
+    "guidebot_upstream_key_requests_total",
+    "Upstream calls per pooled API key (masked) by HTTP status.",
+    ["key", "status"],
+)
+KEY_LATENCY_SECONDS = REGISTRY.histogram(
+    "guidebot_upstream_key_seconds",
+    "Upstream call latency per pooled API key (masked).",
+    ["key"],
+)
+KEY_OUTSTANDING = REGISTRY.gauge(
+    "guidebot_upstream_key_outstanding",
+    "In-flight upstream calls per pooled API key (masked).",
+    ["key"],
+    multiprocess_mode="sum",
+)
+KEY_STATE = REGISTRY.gauge(
+    "guidebot_upstream_key_state",
+    "1 for the current state (available, cooling_down, disabled) of each pooled API key.",
+    ["key", "state"],
+)
+RATE_LIMITED = REGISTRY.counter(
+    "guidebot_rate_limited_total",
+    "Requests rejected with 429 by the per-client token buckets, by endpoint and client kind (key/ip).",
+    ["endpoint", "client_kind"],
+)
+FAIR_QUEUE_SECONDS = REGISTRY.histogram(
+    "guidebot_fair_queue_seconds",
+    "Time a request waited for an upstream slot from the fair scheduler, by endpoint and outcome.",
+    ["endpoint", "outcome"],
+)
+UPSTREAM_SLOTS_IN_USE = REGISTRY.gauge(
+    "guidebot_upstream_slots_in_use",
+    "Upstream slots currently held through the fair scheduler.",
+    multiprocess_mode="sum",
+)
+LANE_QUEUE_SECONDS = REGISTRY.histogram(
+    "guidebot_lane_queue_seconds",
+    "Time an upstream call waited for a seat in its lane (image/text/url), by outcome.",
+    ["lane", "outcome"],
+)
+LANE_IN_USE = REGISTRY.gauge(
+    "guidebot_lane_in_use",
+    "Upstream calls currently holding a seat, per lane.",
+    ["lane"],
+    multiprocess_mode="sum",
+)
+LANE_QUEUED = REGISTRY.gauge(
+    "guidebot_lane_queued",
+    "Upstream calls waiting for a seat, per lane.",
+    ["lane"],
+    multiprocess_mode="sum",
+)
+LANE_BORROWED = REGISTRY.counter(
+    "guidebot_lane_borrowed_total",
+    "Seats granted beyond a lane's own quota out of other lanes' idle capacity.",
+    ["lane"],
+)
+IMAGE_PREP_TASKS = REGISTRY.counter(
+    "guidebot_image_prep_total",
+    "Uploaded images decoded/validated/hashed, by where it ran (pool/inline) and outcome.",
+    ["mode", "outcome"],
+)
+GUIDE_CACHE_LOOKUPS = REGISTRY.counter(
+    "guidebot_guide_cache_lookups_total",
+    "Shared guide cache lookups by source type and outcome (hit/miss/expired/torn).",
+    ["source", "outcome"],
+)
+GUIDE_CACHE_STORES = REGISTRY.counter(
+    "guidebot_guide_cache_stores_total",
+    "Shared guide cache writes by outcome (stored/evicted/too_large).",
+    ["outcome"],
+)
+ROUTED_REQUESTS = REGISTRY.counter(
+    "guidebot_routed_requests_total",
+    "Generation requests by routing decision (local/forwarded/fallback/hop_limit).",
+    ["endpoint", "outcome"],
+)
+PEER_UP = REGISTRY.gauge(
+    "guidebot_peer_up",
+    "1 if the peer node is taking its share of the hash ring.",
+    ["peer"],
+)
+PIPELINE_EXITS = REGISTRY.counter(
+    "guidebot_pipeline_exits_total",
+    "Pipeline runs that left the stage order early, by stage and kind (stop: answered, skip: jumped ahead).",
+    ["pipeline", "stage", "kind"],
+)
+RENDERS = REGISTRY.counter(
+    "guidebot_renders_total",
+    "Annotated step image requests by output kind (full/sprite/step) and outcome (hit/rendered/missing).",
+    ["kind", "outcome"],
+)
+PAGE_FETCHES = REGISTRY.counter(
+    "guidebot_page_fetches_total",
+    "Page outlines for URL guides by outcome (fresh/revalidated/fetched/error/blocked/not_html/too_large).",
+    ["outcome"],
+)
+UPSTREAM_UP = REGISTRY.gauge("guidebot_upstream_up", "1 if the latest background upstream probe succeeded.")
+READY = REGISTRY.gauge("guidebot_ready", "1 once warm-up has finished and the process accepts traffic.")
+
+
+def begin_request(endpoint: str) -> Tuple[contextvars.Token, contextvars.Token]:
+    """Bind the endpoint label and a fresh stage-timing list to the current context."""
+    REGISTRY.ensure_flusher()
+    return _current_endpoint.set(endpoint), _current_timings.set([])
+
+
+def end_request(tokens: Tuple[contextvars.Token, contextvars.Token]) -> None:
+    endpoint_token, timings_token = tokens
+    _current_endpoint.reset(endpoint_token)
+    _current_timings.reset(timings_token)
+
+
+def current_endpoint() -> str:
+    return _current_endpoint.get()
+
+
+def current_timings() -> List[Tuple[str, float]]:
+    """Stage timings recorded so far for the current request, in completion order."""
+    return list(_current_timings.get() or [])
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, endpoint=_current_endpoint.get(), stage=stage)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def record_fallback(reason: str) -> None:
+    FALLBACKS.inc(endpoint=_current_endpoint.get(), reason=reason)
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,383 @@
+from __future__ import annotations
+
+import collections
+import ipaddress
+import re
+import socket
+import threading
+import time
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .metrics import PAGE_FETCHES, stage_timer
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_CHARSET_RE = re.compile(rb"<meta[^>]+charset=[\"']?([A-Za-z0-9_\-]+)", re.IGNORECASE)
+_SKIPPED_TAGS = frozenset({"script", "style", "noscript", "svg", "template", "iframe"})
+_HEADINGS = {"h1": 1, "h2": 2, "h3": 3}
+_BUTTON_INPUT_TYPES = frozenset({"submit", "button", "reset", "image"})
+_FIELD_SKIP_TYPES = frozenset({"hidden"}) | _BUTTON_INPUT_TYPES
+_HTML_TYPES = ("text/html", "application/xhtml+xml")
+
+
+class PageFetchError(Exception):
+    """The page could not be fetched or is not an HTML page worth distilling."""
+
+    def __init__(self, message: str, outcome: str):
+        super().__init__(message)
+        self.outcome = outcome
+
+
+def _public_address(host: str, port: int) -> str:
+    """Resolve ``host`` once and return the address to connect to, refusing names with any non-global address."""
+    try:
+        infos = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except socket.gaierror as exc:
+        raise PageFetchError(f"无法解析域名: {host}", "error") from exc
+    addresses = [info[4][0] for info in infos]
+    for address in addresses:
+        if not ipaddress.ip_address(address.split("%", 1)[0]).is_global:
+            raise PageFetchError(f"拒绝访问内网地址: {host}", "blocked")
+    return addresses[0]
+
+
+class _PinnedConnectionMixin:
+    """Opens the socket to the address ``_public_address`` checked, never to a second lookup of the name.
+
+    Only the socket's destination changes: the Host header, SNI and the
+    certificate check still use the host name from the URL.
+    """
+
+    def _new_conn(self) -> socket.socket:
+        host = self._dns_host
+        self._dns_host = _public_address(host, self.port)
+        try:
+            return super()._new_conn()
+        finally:
+            self._dns_host = host
+
+
+class _PinnedHTTPConnection(_PinnedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _PinnedHTTPSConnection(_PinnedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _PinnedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _PinnedHTTPConnection
+
+
+class _PinnedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _PinnedHTTPSConnection
+
+
+class _PinnedAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _PinnedHTTPConnectionPool,
+            "https": _PinnedHTTPSConnectionPool,
+        }
+
+
+def _clean(text: str, limit: int = 80) -> str:
+    text = _WHITESPACE_RE.sub(" ", text).strip()
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+class _OutlineParser(HTMLParser):
+    """Collects what a user can see and act on; everything else in the page is dropped."""
+
+    def __init__(self, base_url: str, max_items: int):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.max_items = max_items
+        self.title = ""
+        self.description = ""
+        self.headings: List[Tuple[int, str]] = []
+        self.links: List[Tuple[str, str]] = []
+        self.buttons: List[str] = []
+        self.forms: List[Dict[str, Any]] = []
+        self._labels: Dict[str, str] = {}
+        self._skip_depth = 0
+        # Element whose text is being captured: (kind, extra, closing tag), plus its text so far.
+        self._capture: Optional[Tuple[str, Any, str]] = None
+        self._text: List[str] = []
+
+    def _start_capture(self, kind: str, extra: Any, tag: str) -> None:
+        self._capture = (kind, extra, tag)
+        self._text = []
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth += 1
+            return
+        if self._skip_depth:
+            return
+        attr = {name: value or "" for name, value in attrs}
+        if tag == "title" and not self.title:
+            self._start_capture("title", None, tag)
+        elif tag == "meta" and attr.get("name", "").lower() == "description":
+            self.description = _clean(attr.get("content", ""), 160)
+        elif tag in _HEADINGS:
+            self._start_capture("heading", _HEADINGS[tag], tag)
+        elif tag == "a" and attr.get("href") and not attr["href"].startswith(("#", "javascript:")):
+            self._start_capture("link", urljoin(self.base_url, attr["href"]), tag)
+        elif tag == "button" or attr.get("role") == "button":
+            self._start_capture("button", attr.get("aria-label", ""), tag)
+        elif tag == "label":
+            self._start_capture("label", attr.get("for", ""), tag)
+        elif tag == "form":
+            self.forms.append(
+                {
+                    "method": (attr.get("method") or "get").upper(),
+                    "action": urljoin(self.base_url, attr.get("action") or ""),
+                    "fields": [],
+                }
+            )
+        elif tag in ("input", "select", "textarea"):
+            self._field(tag, attr)
+
+    def _field(self, tag: str, attr: Dict[str, str]) -> None:
+        kind = (attr.get("type") or "text").lower() if tag == "input" else tag
+        if kind in _BUTTON_INPUT_TYPES:
+            if len(self.buttons) < self.max_items:
+                self.buttons.append(_clean(attr.get("value") or attr.get("aria-label") or kind, 40))
+            return
+        if kind in _FIELD_SKIP_TYPES or not self.forms:
+            return
+        fields = self.forms[-1]["fields"]
+        if len(fields) < self.max_items:
+            name = attr.get("aria-label") or attr.get("placeholder") or attr.get("name") or attr.get("id") or ""
+            fields.append({"id": attr.get("id", ""), "name": _clean(name, 40), "type": kind})
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+            return
+        if self._capture is None or self._skip_depth or tag != self._capture[2]:
+            return
+        kind, extra, _ = self._capture
+        text = _clean("".join(self._text))
+        self._capture = None
+        if kind == "title":
+            self.title = text
+        elif kind == "heading" and text and len(self.headings) < self.max_items:
+            self.headings.append((extra, text))
+        elif kind == "link" and text and len(self.links) < self.max_items:
+            self.links.append((text, extra))
+        elif kind == "button" and (text or extra) and len(self.buttons) < self.max_items:
+            self.buttons.append(_clean(text or extra, 40))
+        elif kind == "label" and text and extra:
+            self._labels[extra] = _clean(text, 40)
+
+    def handle_data(self, data: str) -> None:
+        if self._capture is not None and not self._skip_depth:
+            self._text.append(data)
+
+    def outline(self, max_chars: int) -> str:
+        lines: List[str] = []
+        if self.title:
+            lines.append(f"页面标题: {self.title}")
+        if self.description:
+            lines.append(f"页面描述: {self.description}")
+        for level, text in self.headings:
+            lines.append(f"{'#' * level} {text}")
+        if self.buttons:
+            lines.append("按钮: " + " | ".join(dict.fromkeys(self.buttons)))
+        for form in self.forms:
+            fields = [
+                f"{self._labels.get(field['id']) or field['name'] or '未命名'}({field['type']})"
+                for field in form["fields"]
+            ]
+            lines.append(f"表单 {form['method']} {form['action']}: " + (", ".join(fields) or "无输入项"))
+        seen = set()
+        for text, href in self.links:
+            if href in seen:
+                continue
+            seen.add(href)
+            lines.append(f"链接: {text} -> {href}")
+
+        outline = "\n".join(lines)
+        return outline if len(outline) <= max_chars else outline[: max_chars - 1] + "…"
+
+
+def distill_html(html: str, base_url: str, max_chars: int = 3000, max_items: int = 40) -> str:
+    """A compact text outline of a page: title, headings, buttons, forms and links."""
+    parser = _OutlineParser(base_url, max_items)
+    parser.feed(html)
+    parser.close()
+    return parser.outline(max_chars)
+
+
+class _Entry:
+    __slots__ = ("outline", "etag", "last_modified", "checked_at")
+
+    def __init__(self, outline: str, etag: Optional[str], last_modified: Optional[str], checked_at: float):
+        self.outline = outline
+        self.etag = etag
+        self.last_modified = last_modified
+        self.checked_at = checked_at
+
+
+class PageFetcher:
+    """Fetches a page for URL guides and distills it into a short outline, cached per URL.
+
+    Requests go through one pooled session, and one fetch (redirects and body
+    included) gets ``timeout_seconds`` in total; bodies are read up to
+    ``max_bytes``. Outlines are kept in a bounded LRU: within
+    ``fresh_seconds`` of the last check an entry is used as is, after that it
+    is revalidated with If-None-Match / If-Modified-Since and a 304 keeps it
+    without downloading or parsing the page again. Hosts resolving to private,
+    loopback or link-local addresses are refused unless ``allow_private``; the
+    check happens when the socket is opened, against the address it connects to.
+    """
+
+    def __init__(
+        self,
+        timeout_seconds: float = 5.0,
+        max_bytes: int = 1024 * 1024,
+        max_outline_chars: int = 3000,
+        cache_entries: int = 256,
+        fresh_seconds: float = 300.0,
+        allow_private: bool = False,
+        max_redirects: int = 3,
+        pool_size: int = 16,
+    ):
+        self.timeout_seconds = max(timeout_seconds, 0.5)
+        self.max_bytes = max(max_bytes, 16 * 1024)
+        self.max_outline_chars = max(max_outline_chars, 200)
+        self.cache_entries = max(cache_entries, 1)
+        self.fresh_seconds = max(fresh_seconds, 0.0)
+        self.allow_private = allow_private
+        self.max_redirects = max(max_redirects, 0)
+        self._cache: "collections.OrderedDict[str, _Entry]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        # A proxy would resolve the name itself, after the address check.
+        self.session.trust_env = False
+        adapter_class = HTTPAdapter if allow_private else _PinnedAdapter
+        adapter = adapter_class(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {"User-Agent": "GuideBot/1.1 (+page outline)", "Accept": "text/html,application/xhtml+xml;q=0.9"}
+        )
+
+    @staticmethod
+    def _remaining(deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise PageFetchError("页面抓取超时", "timeout")
+        return remaining
+
+    def _get(self, url: str, headers: Dict[str, str], deadline: float) -> Tuple[str, requests.Response]:
+        """GET following redirects by hand, so every hop is checked and shares the deadline."""
+        for _ in range(self.max_redirects + 1):
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https") or not parts.hostname:
+                raise PageFetchError(f"不支持的网址: {url}", "blocked")
+            remaining = self._remaining(deadline)
+            response = self.session.get(
+                url, headers=headers, timeout=(min(remaining, 3.0), remaining), stream=True, allow_redirects=False
+            )
+            if response.is_redirect and response.headers.get("Location"):
+                response.close()
+                url = urljoin(url, response.headers["Location"])
+                continue
+            return url, response
+        raise PageFetchError("重定向次数过多", "error")
+
+    def _read_html(self, response: requests.Response, deadline: float) -> str:
+        try:
+            if response.status_code != 200:
+                raise PageFetchError(f"页面返回 HTTP {response.status_code}", "error")
+            content_type = response.headers.get("Content-Type", "").split(";", 1)[0].strip().lower()
+            if content_type and content_type not in _HTML_TYPES:
+                raise PageFetchError(f"不是网页内容: {content_type}", "not_html")
+            declared = response.headers.get("Content-Length")
+            if declared and declared.isdigit() and int(declared) > self.max_bytes:
+                raise PageFetchError("页面过大", "too_large")
+            chunks: List[bytes] = []
+            received = 0
+            # read1 returns after a single socket read, so a server trickling bytes
+            # cannot keep one call (and the request thread) going past the deadline.
+            # Headings, navigation and forms are near the top; a truncated tail is not needed.
+            while received < self.max_bytes:
+                self._remaining(deadline)
+                chunk = response.raw.read1(64 * 1024, decode_content=True)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                received += len(chunk)
+            body = b"".join(chunks)[: self.max_bytes]
+        finally:
+            response.close()
+
+        encoding = response.encoding if "charset" in response.headers.get("Content-Type", "").lower() else None
+        if encoding is None:
+            match = _CHARSET_RE.search(body[:4096])
+            encoding = match.group(1).decode("ascii") if match else "utf-8"
+        try:
+            return body.decode(encoding, errors="replace")
+        except LookupError:
+            return body.decode("utf-8", errors="replace")
+
+    def outline(self, url: str) -> str:
+        """The page's outline, from the cache when fresh or still valid; raises ``PageFetchError``."""
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(url)
+            if entry is not None:
+                self._cache.move_to_end(url)
+        if entry is not None and now - entry.checked_at < self.fresh_seconds:
+            PAGE_FETCHES.inc(outcome="fresh")
+            return entry.outline
+
+        headers: Dict[str, str] = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        deadline = time.monotonic() + self.timeout_seconds
+        try:
+            with stage_timer("page_fetch"):
+                final_url, response = self._get(url, headers, deadline)
+                if response.status_code == 304 and entry is not None:
+                    response.close()
+                    entry.checked_at = time.time()
+                    PAGE_FETCHES.inc(outcome="revalidated")
+                    return entry.outline
+                html = self._read_html(response, deadline)
+        except PageFetchError as exc:
+            PAGE_FETCHES.inc(outcome=exc.outcome)
+            raise
+        except requests.RequestException as exc:
+            PAGE_FETCHES.inc(outcome="error")
+            raise PageFetchError(f"页面抓取失败: {exc}", "error") from exc
+
+        with stage_timer("page_distill"):
+            outline = distill_html(html, final_url, self.max_outline_chars)
+        PAGE_FETCHES.inc(outcome="fetched")
+        fresh = _Entry(outline, response.headers.get("ETag"), response.headers.get("Last-Modified"), time.time())
+        with self._lock:
+            self._cache[url] = fresh
+            self._cache.move_to_end(url)
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return outline
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = len(self._cache)
+        return {"entries": entries, "max_entries": self.cache_entries, "fresh_seconds": self.fresh_seconds}
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .metrics import PIPELINE_EXITS, stage_timer
+
+Stage = Callable[[Any], Any]
+
+
+class GuideContext:
+    """What the stages of one guide request hand to each other."""
+
+    __slots__ = (
+        "source",
+        "input",
+        "note",
+        "service",
+        "cache_key",
+        "page",
+        "messages",
+        "max_tokens",
+        "upstream",
+        "guide",
+        "result",
+        "extra",
+        "success_extra",
+    )
+
+    def __init__(self, source: str, source_input: Any = None, note: str = ""):
+        self.source = source
+        self.input = source_input
+        self.note = note
+        self.service: Any = None
+        self.cache_key: Optional[str] = None
+        self.page: Optional[str] = None
+        self.messages: Optional[List[Dict[str, Any]]] = None
+        self.max_tokens = 0
+        self.upstream: Optional[Dict[str, Any]] = None
+        self.guide: Any = None
+        self.result: Optional[Dict[str, Any]] = None
+        # Response keys for every outcome, and keys only a successful guide carries.
+        self.extra: Dict[str, Any] = {}
+        self.success_extra: Dict[str, Any] = {}
+
+
+class Pipeline:
+    """Named stages run in order over one context object, each under ``stage_timer``.
+
+    A stage returns None to hand over to the next one, the name of a later
+    stage to skip ahead to it (a cache hit skipping generation), or
+    any other value to stop; ``run`` returns that value, or None when the last
+    stage hands over. Early exits are counted per stage. Pipelines are
+    immutable: ``replace``/``insert_before``/``insert_after``/``without``
+    return a new one, so a variant can be built from a shared base.
+    """
+
+    def __init__(self, name: str, stages: Sequence[Tuple[str, Stage]]):
+        names = [stage_name for stage_name, _ in stages]
+        if len(set(names)) != len(names):
+            raise ValueError(f"pipeline {name!r} has duplicate stage names: {names}")
+        self.name = name
+        self.stages: Tuple[Tuple[str, Stage], ...] = tuple(stages)
+        self._index = {stage_name: index for index, stage_name in enumerate(names)}
+
+    @property
+    def stage_names(self) -> List[str]:
+        return [stage_name for stage_name, _ in self.stages]
+
+    def run(self, ctx: Any) -> Any:
+        stages = self.stages
+        index = 0
+        while index < len(stages):
+            stage_name, stage = stages[index]
+            with stage_timer(stage_name):
+                outcome = stage(ctx)
+            if outcome is None:
+                index += 1
+                continue
+            if isinstance(outcome, str):
+                target = self._index.get(outcome)
+                if target is None or target <= index:
+                    raise ValueError(f"{self.name}: stage {stage_name!r} cannot skip to {outcome!r}")
+                PIPELINE_EXITS.inc(pipeline=self.name, stage=stage_name, kind="skip")
+                index = target
+                continue
+            if index < len(stages) - 1:
+                PIPELINE_EXITS.inc(pipeline=self.name, stage=stage_name, kind="stop")
+            return outcome
+        return None
+
+    def _position(self, stage_name: str) -> int:
+        if stage_name not in self._index:
+            raise KeyError(f"pipeline {self.name!r} has no stage {stage_name!r}")
+        return self._index[stage_name]
+
+    def _with_stages(self, stages: List[Tuple[str, Stage]], name: Optional[str]) -> "Pipeline":
+        return Pipeline(name or self.name, stages)
+
+    def replace(self, stage_name: str, stage: Stage, name: Optional[str] = None) -> "Pipeline":
+        stages = list(self.stages)
+        stages[self._position(stage_name)] = (stage_name, stage)
+        return self._with_stages(stages, name)
+
+    def insert_before(self, anchor: str, stage_name: str, stage: Stage, name: Optional[str] = None) -> "Pipeline":
+        stages = list(self.stages)
+        stages.insert(self._position(anchor), (stage_name, stage))
+        return self._with_stages(stages, name)
+
+    def insert_after(self, anchor: str, stage_name: str, stage: Stage, name: Optional[str] = None) -> "Pipeline":
+        stages = list(self.stages)
+        stages.insert(self._position(anchor) + 1, (stage_name, stage))
+        return self._with_stages(stages, name)
+
+    def without(self, stage_name: str, name: Optional[str] = None) -> "Pipeline":
+        stages = list(self.stages)
+        del stages[self._position(stage_name)]
+        return self._with_stages(stages, name)
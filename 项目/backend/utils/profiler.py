@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+_PROFILE_ID_RE = re.compile(r"^[0-9]{13}-[0-9a-f]{8}$")
+_MAX_STACK_DEPTH = 128
+
+
+def _collapse_stack(frame: Any) -> str:
+    """Render a frame chain root-first in flamegraph "collapsed" form."""
+    names: List[str] = []
+    while frame is not None and len(names) < _MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+class SamplingProfiler:
+    """Samples the stacks of registered threads from one background thread.
+
+    Only threads that called ``start`` are sampled, so the cost scales with the
+    number of in-flight profiled requests and is zero when nothing is registered.
+    """
+
+    def __init__(self, interval_seconds: float = 0.01):
+        self.interval_seconds = max(interval_seconds, 0.001)
+        self._sessions: Dict[int, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> int:
+        ident = threading.get_ident()
+        with self._lock:
+            self._sessions[ident] = {}
+            self._active.set()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="guidebot-profiler", daemon=True)
+                self._thread.start()
+        return ident
+
+    def stop(self, ident: int) -> Dict[str, int]:
+        with self._lock:
+            stacks = self._sessions.pop(ident, {})
+            if not self._sessions:
+                self._active.clear()
+        return stacks
+
+    def _run(self) -> None:
+        own_ident = threading.get_ident()
+        while True:
+            self._active.wait()
+            time.sleep(self.interval_seconds)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, stacks in self._sessions.items():
+                    if ident == own_ident:
+                        continue
+                    frame = frames.get(ident)
+                    if frame is None:
+                        continue
+                    stack = _collapse_stack(frame)
+                    stacks[stack] = stacks.get(stack, 0) + 1
+            del frames
+
+
+class ProfileStore:
+    """Bounded on-disk ring of captured profiles; the oldest entries are evicted first."""
+
+    def __init__(self, directory: str, max_profiles: int = 50):
+        self.directory = directory
+        self.max_profiles = max(max_profiles, 1)
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, profile_id: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    def _profile_ids(self) -> List[str]:
+        ids = [name[:-5] for name in os.listdir(self.directory) if name.endswith(".json")]
+        return sorted(profile_id for profile_id in ids if _PROFILE_ID_RE.match(profile_id))
+
+    def save(self, record: Dict[str, Any]) -> str:
+        profile_id = f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}"
+        record = dict(record, id=profile_id)
+        tmp_path = self._path(profile_id) + ".tmp"
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(profile_id))
+
+            ids = self._profile_ids()
+            for stale_id in ids[: max(len(ids) - self.max_profiles, 0)]:
+                try:
+                    os.remove(self._path(stale_id))
+                except OSError:
+                    pass
+        return profile_id
+
+    def load(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        if not _PROFILE_ID_RE.match(profile_id):
+            return None
+        try:
+            with open(self._path(profile_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def list(self) -> List[Dict[str, Any]]:
+        summaries: List[Dict[str, Any]] = []
+        for profile_id in reversed(self._profile_ids()):
+            record = self.load(profile_id)
+            if record is None:
+                continue
+            summaries.append({key: value for key, value in record.items() if key != "stacks"})
+        return summaries
+
+
+def render_collapsed(stacks: Dict[str, int]) -> str:
+    """Text accepted by flamegraph.pl / speedscope: one "stack count" line per stack."""
+    lines: List[Tuple[str, int]] = sorted(stacks.items(), key=lambda item: item[1], reverse=True)
+    return "".join(f"{stack} {count}\n" for stack, count in lines)
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import collections
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # optional: buckets stay per process on Windows
+    fcntl = None
+
+from .metrics import UPSTREAM_SLOTS_IN_USE
+from .shared_file import open_shared_file
+
+_BUCKET_MAGIC = b"GBRL"
+# magic, version, sets, ways
+_BUCKET_FILE_HEADER = struct.Struct("<4sIII")
+_BUCKET_FILE_HEADER_SIZE = 64
+# client digest, tokens, updated_at (wall clock: monotonic time is not comparable across boots)
+_BUCKET = struct.Struct("<16sdd")
+_BUCKET_WAYS = 8
+_EMPTY_DIGEST = b"\x00" * 16
+
+
+class RateDecision:
+    __slots__ = ("allowed", "limit", "remaining", "reset_seconds", "retry_after_seconds")
+
+    def __init__(self, allowed: bool, limit: int, remaining: int, reset_seconds: int, retry_after_seconds: int):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_seconds = reset_seconds
+        self.retry_after_seconds = retry_after_seconds
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(self.reset_seconds),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after_seconds)
+        return headers
+
+
+class TokenBucketLimiter:
+    """Per-client token buckets: ``burst`` requests at once, refilled at ``refill_per_second``.
+
+    Buckets live in memory, one per client, least recently seen evicted first
+    past ``max_clients`` (an evicted client simply starts again with a full bucket).
+    """
+
+    def __init__(self, burst: float, refill_per_second: float, max_clients: int = 10000):
+        self.burst = max(burst, 1.0)
+        self.refill_per_second = max(refill_per_second, 1e-9)
+        self.max_clients = max(max_clients, 1)
+        # client -> [tokens, updated_at]
+        self._buckets: "collections.OrderedDict[str, List[float]]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, client: str, cost: float = 1.0) -> RateDecision:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = [self.burst, now]
+                self._buckets[client] = bucket
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.refill_per_second)
+                bucket[1] = now
+
+            allowed = bucket[0] >= cost
+            if allowed:
+                bucket[0] -= cost
+            tokens = bucket[0]
+
+        return self._decision(allowed, tokens, cost)
+
+    def _decision(self, allowed: bool, tokens: float, cost: float) -> RateDecision:
+        return RateDecision(
+            allowed=allowed,
+            limit=int(self.burst),
+            remaining=int(tokens),
+            reset_seconds=math.ceil((self.burst - tokens) / self.refill_per_second),
+            retry_after_seconds=0 if allowed else max(math.ceil((cost - tokens) / self.refill_per_second), 1),
+        )
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class SharedTokenBucketLimiter(TokenBucketLimiter):
+    """``TokenBucketLimiter`` whose buckets live in a memory-mapped file shared by the host's workers.
+
+    With per-process buckets every Gunicorn worker grants the full rate, so
+    the effective limit is N times the configured one. Here a client's digest
+    picks a set of ``_BUCKET_WAYS`` buckets in the file; a bucket is updated
+    under a byte-range lock on its set, and a full set drops the bucket seen
+    least recently (that client starts again with a full bucket, as with
+    ``max_clients`` in memory).
+    """
+
+    def __init__(self, path: str, burst: float, refill_per_second: float, max_clients: int = 10000):
+        if fcntl is None:
+            raise RuntimeError("SharedTokenBucketLimiter needs fcntl (POSIX only)")
+        super().__init__(burst, refill_per_second, max_clients)
+        self.path = path
+        self.sets = max(math.ceil(self.max_clients / _BUCKET_WAYS), 1)
+        self._set_bytes = _BUCKET_WAYS * _BUCKET.size
+        self.size = _BUCKET_FILE_HEADER_SIZE + self.sets * self._set_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        header = _BUCKET_FILE_HEADER.pack(_BUCKET_MAGIC, 1, self.sets, _BUCKET_WAYS)
+        self._fd = open_shared_file(path, header, self.size)
+        self._mm = mmap.mmap(self._fd, self.size)
+
+    def take(self, client: str, cost: float = 1.0) -> RateDecision:
+        digest = hashlib.sha256(client.encode("utf-8")).digest()[:16]
+        set_offset = _BUCKET_FILE_HEADER_SIZE + (int.from_bytes(digest[:8], "little") % self.sets) * self._set_bytes
+        mm = self._mm
+        # Byte-range locks are per process, so threads of one worker also need the local lock.
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self._set_bytes, set_offset)
+            try:
+                now = time.time()
+                slot: Optional[int] = None
+                oldest: Optional[int] = None
+                oldest_at = float("inf")
+                for way in range(_BUCKET_WAYS):
+                    offset = set_offset + way * _BUCKET.size
+                    slot_digest, tokens, updated_at = _BUCKET.unpack_from(mm, offset)
+                    if slot_digest == digest:
+                        slot = offset
+                        break
+                    if slot_digest == _EMPTY_DIGEST:
+                        updated_at = -1.0
+                    if updated_at < oldest_at:
+                        oldest, oldest_at = offset, updated_at
+                if slot is None:
+                    slot, tokens = oldest, self.burst
+                else:
+                    tokens = min(self.burst, tokens + max(now - updated_at, 0.0) * self.refill_per_second)
+
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                _BUCKET.pack_into(mm, slot, digest, tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self._set_bytes, set_offset)
+
+        return self._decision(allowed, tokens, cost)
+
+    def __len__(self) -> int:
+        mm = self._mm
+        return sum(
+            mm[offset : offset + 16] != _EMPTY_DIGEST
+            for offset in range(_BUCKET_FILE_HEADER_SIZE, self.size, _BUCKET.size)
+        )
+
+
+class _Waiter:
+    __slots__ = ("event", "granted")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.granted = False
+
+
+class FairScheduler:
+    """Shares a fixed number of upstream slots between clients.
+
+    Free slots are taken immediately while nobody is queued. Once requests
+    queue, each freed slot goes to the waiting client that currently holds the
+    fewest slots, round-robin among ties, so one client with many requests in
+    flight cannot starve the others. A client may keep at most
+    ``max_queued_per_client`` requests waiting, since each one holds a worker thread.
+    """
+
+    def __init__(self, slots: int, max_queued_per_client: int = 4):
+        self.slots = max(slots, 1)
+        self.max_queued_per_client = max(max_queued_per_client, 0)
+        self._in_use = 0
+        self._held: Dict[str, int] = {}
+        self._waiters: "collections.OrderedDict[str, Deque[_Waiter]]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, client: str, timeout: Optional[float] = None) -> str:
+        """Take a slot for ``client``: returns ``granted``, ``timeout`` or ``queue_full``."""
+        with self._lock:
+            if self._in_use < self.slots and not self._waiters:
+                self._grant(client)
+                return "granted"
+            if len(self._waiters.get(client, ())) >= self.max_queued_per_client:
+                return "queue_full"
+            waiter = _Waiter()
+            self._waiters.setdefault(client, collections.deque()).append(waiter)
+
+        if waiter.event.wait(timeout):
+            return "granted"
+        with self._lock:
+            if waiter.granted:  # granted between the timeout and taking the lock
+                return "granted"
+            queue = self._waiters.get(client)
+            if queue is not None:
+                queue.remove(waiter)
+                if not queue:
+                    del self._waiters[client]
+            return "timeout"
+
+    def release(self, client: str) -> None:
+        with self._lock:
+            held = self._held.get(client, 0) - 1
+            if held > 0:
+                self._held[client] = held
+            else:
+                self._held.pop(client, None)
+            self._in_use -= 1
+            self._dispatch()
+            UPSTREAM_SLOTS_IN_USE.set(self._in_use)
+
+    def _grant(self, client: str) -> None:
+        self._in_use += 1
+        self._held[client] = self._held.get(client, 0) + 1
+        UPSTREAM_SLOTS_IN_USE.set(self._in_use)
+
+    def _dispatch(self) -> None:
+        while self._in_use < self.slots and self._waiters:
+            # min() returns the first of equal candidates, and served clients move to the end.
+            client = min(self._waiters, key=lambda name: self._held.get(name, 0))
+            queue = self._waiters[client]
+            waiter = queue.popleft()
+            if queue:
+                self._waiters.move_to_end(client)
+            else:
+                del self._waiters[client]
+            waiter.granted = True
+            self._grant(client)
+            waiter.event.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "slots": self.slots,
+                "in_use": self._in_use,
+                "clients_in_flight": len(self._held),
+                "clients_queued": len(self._waiters),
+                "queued": sum(len(queue) for queue in self._waiters.values()),
+            }
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import bisect
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+import requests
+
+from .metrics import PEER_UP
+
+
+def _ring_position(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class PeerRouter:
+    """Consistent-hash ring over GuideBot nodes, with background health checks.
+
+    Every node appears ``vnodes`` times on the ring so keys spread evenly and a
+    node leaving moves only its own share. A key belongs to the first healthy
+    node clockwise from its hash; a peer that fails ``failure_threshold``
+    health checks in a row (or one forwarded request) is skipped until a check
+    succeeds again, which hands its keys to the next node and back.
+    """
+
+    def __init__(
+        self,
+        self_url: str,
+        peers: Sequence[str],
+        vnodes: int = 64,
+        health_interval_seconds: float = 5.0,
+        failure_threshold: int = 2,
+        health_path: str = "/api/ready",
+    ):
+        self.self_url = self_url.rstrip("/")
+        self.nodes = sorted({peer.rstrip("/") for peer in peers} | {self.self_url})
+        self.vnodes = max(vnodes, 1)
+        self.health_interval_seconds = max(health_interval_seconds, 0.5)
+        self.failure_threshold = max(failure_threshold, 1)
+        self.health_path = health_path
+
+        ring = sorted((_ring_position(f"{node}#{index}"), node) for node in self.nodes for index in range(self.vnodes))
+        self._positions = [position for position, _ in ring]
+        self._owners = [node for _, node in ring]
+        self._up = {node: True for node in self.nodes}
+        self._failures = {node: 0 for node in self.nodes}
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        for node in self.nodes:
+            PEER_UP.set(1, peer=node)
+
+    def owner(self, key: str) -> str:
+        """The healthy node owning ``key``; this node itself when every peer is down."""
+        start = bisect.bisect(self._positions, _ring_position(key))
+        for offset in range(len(self._owners)):
+            node = self._owners[(start + offset) % len(self._owners)]
+            if node == self.self_url or self._up[node]:
+                return node
+        return self.self_url
+
+    def mark_down(self, node: str) -> None:
+        if node == self.self_url:
+            return
+        with self._lock:
+            self._failures[node] = self.failure_threshold
+            self._up[node] = False
+        PEER_UP.set(0, peer=node)
+
+    def _record(self, node: str, ok: bool) -> None:
+        with self._lock:
+            self._failures[node] = 0 if ok else self._failures[node] + 1
+            self._up[node] = self._failures[node] < self.failure_threshold
+        PEER_UP.set(1 if self._up[node] else 0, peer=node)
+
+    def check_once(self) -> None:
+        for node in self.nodes:
+            if node == self.self_url:
+                continue
+            try:
+                response = self._session.get(f"{node}{self.health_path}", timeout=2.0)
+                self._record(node, response.status_code == 200)
+            except requests.RequestException:
+                self._record(node, False)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="guidebot-peer-health", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.check_once()
+            self._stop.wait(self.health_interval_seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            peers: List[Dict[str, Any]] = [
+                {"node": node, "self": node == self.self_url, "up": self._up[node], "failures": self._failures[node]}
+                for node in self.nodes
+            ]
+        return {
+            "self": self.self_url,
+            "vnodes": self.vnodes,
+            "health_interval_seconds": self.health_interval_seconds,
+            "peers": peers,
+        }
@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+import os
+
+try:
+    import fcntl
+except ImportError:  # optional: callers check for POSIX before opening a shared file
+    fcntl = None
+
+
+def open_shared_file(path: str, header: bytes, size: int) -> int:
+    """Open a file of ``size`` bytes that starts with ``header``, swapping in an empty one if it does not.
+
+    A file other workers may have mapped is never truncated: touching a page
+    past a shrunk end is SIGBUS. The replacement is built aside and renamed
+    over the path, so those workers keep a valid (if orphaned) inode until
+    they restart. The swap happens under an exclusive lock on the old file,
+    and whoever waited on that lock reopens the path.
+    """
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            try:
+                current = os.stat(path).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                current = False
+            if current and os.pread(fd, len(header), 0) == header and os.fstat(fd).st_size == size:
+                return fd
+            if current:
+                _replace_file(path, header, size)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        # Lost a race with another worker's swap, or just swapped: open what the path names now.
+        os.close(fd)
+
+
+def _replace_file(path: str, header: bytes, size: int) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.ftruncate(fd, size)
+        os.pwrite(fd, header, 0)
+    finally:
+        os.close(fd)
+    os.replace(tmp_path, path)
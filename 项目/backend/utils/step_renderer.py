@@ -0,0 +1,332 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from PIL import Image, ImageColor, ImageDraw, ImageFont
+except ImportError:  # optional: without Pillow the render endpoints report themselves unavailable
+    Image = ImageColor = ImageDraw = ImageFont = None
+
+from .metrics import RENDERS, stage_timer
+
+# Bump when the drawing changes, so new renders get new ids instead of stale cached files.
+RENDER_VERSION = 1
+RENDER_FORMATS = {"png": ("PNG", "image/png"), "webp": ("WEBP", "image/webp")}
+_OUTPUT_RE = re.compile(r"^(full|sprite|step-([1-9][0-9]{0,2}))$")
+_SPEC_NAME = "spec.json"
+_CJK_FONT_CANDIDATES = (
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+    "/System/Library/Fonts/PingFang.ttc",
+    "C:/Windows/Fonts/msyh.ttc",
+)
+
+
+def is_render_id(value: str) -> bool:
+    return len(value) == 32 and not value.strip("0123456789abcdef")
+
+
+def _color(value: Any) -> str:
+    if isinstance(value, str):
+        try:
+            return "#%02x%02x%02x" % ImageColor.getrgb(value.strip())[:3]
+        except ValueError:
+            pass
+    return "#ff0000"
+
+
+def _label(step: Dict[str, Any], limit: int = 24) -> str:
+    text = (step.get("title") or step.get("description") or "").replace("\n", " ").strip()
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+def _box_to_rect(box: Sequence[int]) -> Tuple[int, int, int, int]:
+    return box[0], box[1], box[2] - box[0], box[3] - box[1]
+
+
+class StepRenderer:
+    """Guide steps composited onto their screenshot, rendered once and kept on disk by content hash.
+
+    ``prepare`` turns a screenshot plus its steps into a render id: the hash of
+    the image bytes' digest and everything drawn (boxes, numbers, labels,
+    colours). The screenshot and a layout spec are stored under that id, and
+    each output (``full``, ``sprite`` or ``step-<n>``, as PNG or WebP) is drawn
+    on first request and then served from the file, so an id's files never
+    change and may be cached anywhere. Least recently prepared ids are swept
+    once the directory grows past ``max_bytes``.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 256 * 1024 * 1024,
+        font_path: Optional[str] = None,
+        crop_padding: int = 48,
+    ):
+        if Image is None:
+            raise RuntimeError("StepRenderer needs Pillow")
+        self.directory = directory
+        self.max_bytes = max(max_bytes, 1024 * 1024)
+        self.crop_padding = max(crop_padding, 0)
+        # Labels are Chinese, so they are only drawn with a font that has the glyphs; numbers always are.
+        self.font_path = font_path or next((path for path in _CJK_FONT_CANDIDATES if os.path.exists(path)), None)
+        self._fonts: Dict[Tuple[int, bool], Any] = {}
+        self._locks = [threading.Lock() for _ in range(16)]
+        self._sweep_lock = threading.Lock()
+        self._last_sweep = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _font(self, size: int, label: bool) -> Any:
+        key = (size, label)
+        font = self._fonts.get(key)
+        if font is None:
+            if self.font_path:
+                font = ImageFont.truetype(self.font_path, size)
+            else:
+                try:
+                    font = ImageFont.load_default(size)
+                except TypeError:  # Pillow < 10.1: fixed-size bitmap font only
+                    font = ImageFont.load_default()
+            self._fonts[key] = font
+        return font
+
+    def prepare(
+        self,
+        image_path: str,
+        steps: Sequence[Dict[str, Any]],
+        image_sha256: str,
+        original_size: Optional[Sequence[int]] = None,
+    ) -> str:
+        """Register ``steps`` over the screenshot at ``image_path`` and return their render id.
+
+        Step rects are in the coordinates of the original upload; when the
+        stored screenshot was downscaled (``original_size`` differs from its
+        size) they are mapped onto the stored pixels.
+        """
+        with Image.open(image_path) as image:
+            width, height = image.size
+        scale = width / original_size[0] if original_size and original_size[0] else 1.0
+
+        drawn: List[Dict[str, Any]] = []
+        for index, step in enumerate(steps, start=1):
+            rect = step.get("rect") or {}
+            x0 = min(max(round(int(rect.get("x", 0) or 0) * scale), 0), width - 1)
+            y0 = min(max(round(int(rect.get("y", 0) or 0) * scale), 0), height - 1)
+            x1 = min(max(x0 + round(int(rect.get("width", 120) or 120) * scale), x0 + 1), width)
+            y1 = min(max(y0 + round(int(rect.get("height", 40) or 40) * scale), y0 + 1), height)
+            drawn.append(
+                {
+                    "step": int(step.get("step") or index),
+                    "box": [x0, y0, x1, y1],
+                    "color": _color(step.get("color")),
+                    "label": _label(step),
+                }
+            )
+
+        key = json.dumps([RENDER_VERSION, image_sha256, bool(self.font_path), drawn], ensure_ascii=False)
+        render_id = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        directory = os.path.join(self.directory, render_id)
+        spec_path = os.path.join(directory, _SPEC_NAME)
+        if os.path.exists(spec_path):
+            os.utime(spec_path)
+            return render_id
+
+        os.makedirs(directory, exist_ok=True)
+        shutil.copyfile(image_path, os.path.join(directory, "source"))
+        spec = self._layout(width, height, drawn)
+        spec["scale"] = scale
+        # The spec is written last: its presence means the id is complete.
+        tmp_path = f"{spec_path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(spec, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, spec_path)
+        self._maybe_sweep()
+        return render_id
+
+    def _layout(self, width: int, height: int, drawn: List[Dict[str, Any]]) -> Dict[str, Any]:
+        unit = max(min(width, height) / 600, 1.0)
+        label_size = round(14 * unit)
+        pad = round(self.crop_padding * unit)
+        # Room under the box for its label.
+        label_room = round(label_size * 1.8) if self.font_path else 0
+
+        sprite_y = 0
+        sprite_width = 0
+        for step in drawn:
+            x0, y0, x1, y1 = step["box"]
+            crop = [max(x0 - pad, 0), max(y0 - pad, 0), min(x1 + pad, width), min(y1 + pad + label_room, height)]
+            crop_width, crop_height = crop[2] - crop[0], crop[3] - crop[1]
+            step["crop"] = crop
+            step["sprite"] = [0, sprite_y, crop_width, crop_height]
+            sprite_y += crop_height
+            sprite_width = max(sprite_width, crop_width)
+
+        return {
+            "width": width,
+            "height": height,
+            "unit": unit,
+            "labels": bool(self.font_path),
+            "steps": drawn,
+            "sprite_size": [max(sprite_width, 1), max(sprite_y, 1)],
+        }
+
+    def _load_spec(self, render_id: str) -> Optional[Dict[str, Any]]:
+        if not is_render_id(render_id):
+            return None
+        try:
+            with open(os.path.join(self.directory, render_id, _SPEC_NAME), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def describe(self, render_id: str) -> Optional[Dict[str, Any]]:
+        """Sizes of every output and where each step sits in the screenshot and the sprite."""
+        spec = self._load_spec(render_id)
+        if spec is None:
+            return None
+        return {
+            "width": spec["width"],
+            "height": spec["height"],
+            # Stored pixels per pixel of the upload that step rects refer to.
+            "scale": spec["scale"],
+            "sprite": {"width": spec["sprite_size"][0], "height": spec["sprite_size"][1]},
+            "steps": [
+                {
+                    "step": step["step"],
+                    "crop": dict(zip(("x", "y", "width", "height"), _box_to_rect(step["crop"]))),
+                    "sprite": dict(zip(("x", "y", "width", "height"), step["sprite"])),
+                }
+                for step in spec["steps"]
+            ],
+        }
+
+    def output(self, render_id: str, name: str, fmt: str) -> Optional[str]:
+        """Path of the rendered ``name`` (``full``/``sprite``/``step-<n>``) in ``fmt``, drawing it if needed.
+
+        None when the id is unknown (or swept) or it has no such output.
+        """
+        match = _OUTPUT_RE.match(name)
+        if match is None or fmt not in RENDER_FORMATS:
+            return None
+        kind = "step" if match.group(2) else name
+        spec = self._load_spec(render_id)
+        if spec is None:
+            RENDERS.inc(kind=kind, outcome="missing")
+            return None
+        steps = spec["steps"]
+        if match.group(2):
+            number = int(match.group(2))
+            steps = [step for step in steps if step["step"] == number][:1]
+            if not steps:
+                RENDERS.inc(kind=kind, outcome="missing")
+                return None
+
+        path = os.path.join(self.directory, render_id, f"{name}.{fmt}")
+        if os.path.exists(path):
+            RENDERS.inc(kind=kind, outcome="hit")
+            return path
+        with self._locks[int(render_id[:4], 16) % len(self._locks)]:
+            if os.path.exists(path):
+                RENDERS.inc(kind=kind, outcome="hit")
+                return path
+            with stage_timer("render"):
+                image = self._draw(render_id, spec, kind, steps)
+                tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+                image.save(tmp_path, format=RENDER_FORMATS[fmt][0], **({"quality": 85} if fmt == "webp" else {}))
+                os.replace(tmp_path, path)
+        RENDERS.inc(kind=kind, outcome="rendered")
+        return path
+
+    def _draw(self, render_id: str, spec: Dict[str, Any], kind: str, steps: List[Dict[str, Any]]) -> Any:
+        with Image.open(os.path.join(self.directory, render_id, "source")) as source:
+            image = source.convert("RGB")
+        if kind == "full":
+            self._annotate(image, spec, steps, (0, 0))
+            return image
+        if kind == "step":
+            return self._crop(image, spec, steps[0])
+
+        sprite = Image.new("RGB", tuple(spec["sprite_size"]), "#ffffff")
+        for step in steps:
+            sprite.paste(self._crop(image, spec, step), tuple(step["sprite"][:2]))
+        return sprite
+
+    def _crop(self, image: Any, spec: Dict[str, Any], step: Dict[str, Any]) -> Any:
+        crop = image.crop(tuple(step["crop"]))
+        self._annotate(crop, spec, [step], step["crop"][:2])
+        return crop
+
+    def _annotate(
+        self, image: Any, spec: Dict[str, Any], steps: List[Dict[str, Any]], origin: Sequence[int]
+    ) -> None:
+        unit = spec["unit"]
+        line = max(round(3 * unit), 2)
+        radius = round(13 * unit)
+        number_font = self._font(round(16 * unit), False)
+        label_font = self._font(round(14 * unit), True) if spec["labels"] else None
+        draw = ImageDraw.Draw(image, "RGBA")
+        for step in steps:
+            x0, y0, x1, y1 = step["box"]
+            x0, x1 = x0 - origin[0], x1 - origin[0]
+            y0, y1 = y0 - origin[1], y1 - origin[1]
+            red, green, blue = ImageColor.getrgb(step["color"])[:3]
+            draw.rectangle((x0, y0, x1, y1), fill=(red, green, blue, 36), outline=(red, green, blue, 255), width=line)
+
+            # Number badge on the top-left corner, kept inside the image.
+            cx = min(max(x0, radius), image.width - radius)
+            cy = min(max(y0, radius), image.height - radius)
+            draw.ellipse((cx - radius, cy - radius, cx + radius, cy + radius), fill=(red, green, blue, 255))
+            draw.text((cx, cy), str(step["step"]), fill="#ffffff", font=number_font, anchor="mm")
+
+            if label_font is not None and step["label"]:
+                left, top, right, bottom = draw.textbbox((0, 0), step["label"], font=label_font)
+                text_width, text_height = right - left, bottom - top
+                margin = max(round(4 * unit), 2)
+                tx = min(max(x0, 0), max(image.width - text_width - 2 * margin, 0))
+                ty = y1 + line + margin
+                if ty + text_height + 2 * margin > image.height:
+                    ty = max(y0 - text_height - 2 * margin - line, 0)
+                draw.rectangle(
+                    (tx, ty, tx + text_width + 2 * margin, ty + text_height + 2 * margin), fill=(255, 255, 255, 224)
+                )
+                draw.text((tx + margin - left, ty + margin - top), step["label"], fill="#1f2328", font=label_font)
+
+    def _maybe_sweep(self) -> None:
+        now = time.time()
+        with self._sweep_lock:
+            if now - self._last_sweep < 60:
+                return
+            self._last_sweep = now
+
+        entries: List[Tuple[float, int, str]] = []
+        total = 0
+        for name in os.listdir(self.directory):
+            directory = os.path.join(self.directory, name)
+            if not is_render_id(name):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+                mtime = os.path.getmtime(os.path.join(directory, _SPEC_NAME))
+            except OSError:
+                continue
+            entries.append((mtime, size, directory))
+            total += size
+
+        for _, size, directory in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(directory, ignore_errors=True)
+            total -= size
+
+    def stats(self) -> Dict[str, Any]:
+        return {"directory": self.directory, "max_bytes": self.max_bytes, "labels": bool(self.font_path)}
@@ -4,39 +4,123 @@ const API_BASE = isLocalHost
     ? 'http://localhost:5000/api'
     : 'https://your-backend.vercel.app/api'
 
-// Upload image and process
-async function uploadImage(file, note = '') {
+// Screenshots are shrunk and re-encoded in the browser before upload.
+// Override per page with window.GUIDEBOT_UPLOAD_OPTIONS = { maxEdge: 1600, quality: 0.75 }.
+const IMAGE_UPLOAD_OPTIONS = Object.assign(
+    {
+        maxEdge: 2048,
+        quality: 0.82,
+        // Tried in order; browsers that cannot encode WebP fall through to JPEG.
+        mimeTypes: ['image/webp', 'image/jpeg'],
+    },
+    window.GUIDEBOT_UPLOAD_OPTIONS || {}
+)
+
+function readAsDataURL(blob) {
     return new Promise((resolve, reject) => {
         const reader = new FileReader()
+        reader.onload = e => resolve(e.target.result)
+        reader.onerror = () => reject(new Error('文件读取失败'))
+        reader.readAsDataURL(blob)
+    })
+}
 
-        reader.onload = function (e) {
-            const base64Data = e.target.result
-
-            fetch(`${API_BASE}/process/image`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ image: base64Data, note }),
-            })
-                .then(response => {
-                    if (!response.ok) {
-                        throw new Error(`HTTP错误: ${response.status}`)
-                    }
-                    return response.json()
-                })
-                .then(data => resolve(data))
-                .catch(error => reject(error))
-        }
+async function decodeImage(file) {
+    if (typeof createImageBitmap === 'function') {
+        return await createImageBitmap(file)
+    }
+
+    const url = URL.createObjectURL(file)
+    try {
+        const image = new Image()
+        image.src = url
+        await image.decode()
+        return image
+    } finally {
+        URL.revokeObjectURL(url)
+    }
+}
+
+function canvasToBlob(canvas, mimeType, quality) {
+    return new Promise(resolve => canvas.toBlob(resolve, mimeType, quality))
+}
+
+// Downscale to options.maxEdge and re-encode; returns the blob to upload and the original size.
+async function prepareImageForUpload(file, options = IMAGE_UPLOAD_OPTIONS) {
+    let image
+    try {
+        image = await decodeImage(file)
+    } catch (error) {
+        // Not decodable here (e.g. an unusual format): let the backend judge the raw file.
+        return { blob: file, width: 0, height: 0 }
+    }
 
-        reader.onerror = function () {
-            reject(new Error('文件读取失败'))
+    const width = image.naturalWidth || image.width
+    const height = image.naturalHeight || image.height
+    const scale = Math.min(1, options.maxEdge / Math.max(width, height))
+    const canvas = document.createElement('canvas')
+    canvas.width = Math.max(1, Math.round(width * scale))
+    canvas.height = Math.max(1, Math.round(height * scale))
+
+    const ctx = canvas.getContext('2d')
+    // JPEG has no alpha channel; transparent areas would otherwise turn black.
+    ctx.fillStyle = '#ffffff'
+    ctx.fillRect(0, 0, canvas.width, canvas.height)
+    ctx.imageSmoothingQuality = 'high'
+    ctx.drawImage(image, 0, 0, canvas.width, canvas.height)
+    if (typeof image.close === 'function') image.close()
+
+    for (const mimeType of options.mimeTypes) {
+        const blob = await canvasToBlob(canvas, mimeType, options.quality)
+        // Unsupported types silently come back as PNG.
+        if (!blob || blob.type !== mimeType) continue
+        // Re-encoding an already small file can make it bigger; keep the original then.
+        if (scale === 1 && blob.size >= file.size) break
+        return { blob, width, height }
+    }
+    return { blob: file, width, height }
+}
+
+// fetch() cannot report upload progress, so the image goes through XHR.
+function postJSONWithProgress(url, body, onProgress) {
+    return new Promise((resolve, reject) => {
+        const xhr = new XMLHttpRequest()
+        xhr.open('POST', url)
+        xhr.setRequestHeader('Content-Type', 'application/json')
+        xhr.responseType = 'json'
+
+        if (typeof onProgress === 'function') {
+            xhr.upload.onprogress = e => {
+                if (e.lengthComputable) onProgress(e.loaded, e.total)
+            }
+            xhr.upload.onload = () => onProgress(1, 1)
         }
 
-        reader.readAsDataURL(file)
+        xhr.onload = () => {
+            if (xhr.status < 200 || xhr.status >= 300) {
+                reject(new Error(`HTTP错误: ${xhr.status}`))
+                return
+            }
+            resolve(xhr.response)
+        }
+        xhr.onerror = () => reject(new Error('网络错误，请检查连接'))
+        xhr.send(body)
     })
 }
 
+// Upload image and process; onProgress(loaded, total) follows the upload.
+async function uploadImage(file, note = '', onProgress = null) {
+    const prepared = await prepareImageForUpload(file)
+    const base64Data = await readAsDataURL(prepared.blob)
+    const payload = { image: base64Data, note }
+    if (prepared.width && prepared.height) {
+        payload.original_width = prepared.width
+        payload.original_height = prepared.height
+    }
+
+    return await postJSONWithProgress(`${API_BASE}/process/image`, JSON.stringify(payload), onProgress)
+}
+
 async function processUrlAPI(url) {
     const response = await fetch(`${API_BASE}/process/url`, {
         method: 'POST',
@@ -111,7 +111,7 @@ async function processImage(file, note = '') {
     UIManager.prepareForNewResult()
     UIManager.showLoading()
     try {
-        const result = await uploadImage(file, note)
+        const result = await uploadImage(file, note, (loaded, total) => UIManager.showUploadProgress(loaded, total))
         displayResult(result)
     } catch (error) {
         UIManager.hideLoading()
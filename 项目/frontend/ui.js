@@ -29,6 +29,9 @@ const UIManager = {
                 <div class="ai-loading-orb"></div>
                 <p class="ai-loading-title">AI 正在思考<span id="loading-dots">.</span></p>
                 <p class="ai-loading-tip" id="loading-tip">正在理解你的任务目标...</p>
+                <div class="upload-progress" id="upload-progress" style="display: none;">
+                    <div class="upload-progress-bar" id="upload-progress-bar"></div>
+                </div>
             </div>
         `
         loading.style.display = 'block'
@@ -54,6 +57,17 @@ const UIManager = {
         }, 1600)
     },
 
+    showUploadProgress(loaded, total) {
+        const progress = document.getElementById('upload-progress')
+        const bar = document.getElementById('upload-progress-bar')
+        if (!progress || !bar || !total) return
+
+        const percent = Math.min(100, Math.round((loaded / total) * 100))
+        // Hidden again once the upload is done and the wait is on the model.
+        progress.style.display = percent < 100 ? 'block' : 'none'
+        bar.style.width = `${percent}%`
+    },
+
     hideLoading() {
         if (this._loadingTimer) {
             clearInterval(this._loadingTimer)